@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import queue
+import threading
+
+import config
+
+
+class Truncated:
+    """
+    A string shortened in the middle when it is formatted, so log arguments are only shortened (and copied)
+    by the thread writing the log.
+    """
+    __slots__ = ('string', 'limit')
+
+    def __init__(self, string, limit):
+        self.string = string
+        self.limit = limit
+
+    def __str__(self):
+        if len(self.string) <= self.limit:
+            return self.string
+        right = self.limit // 2 - 2
+        left = self.limit - right - 3
+        return '%s...%s' % (self.string[:left], self.string[-right:])
+
+
+class BatchingHandler(logging.Handler):
+    """
+    Log handler appending to a file from a background thread. Logging a record only queues it, the thread formats
+    the queued records and writes them in batches with a single write each. The queue is bounded, logging blocks
+    while it is full, so a slow disk slows the crawl down instead of growing the memory.
+    """
+    _closed = object()
+
+    def __init__(self, path, capacity=config.LOG_QUEUE_SIZE, batch=config.LOG_BATCH):
+        """
+        Batching handler constructor. Opens the file for appending and starts the writing thread.
+
+        :param path: file name or path to the log file
+        :type path: str
+        :param capacity: optional maximal number of queued records, defaults to config.LOG_QUEUE_SIZE
+        :type capacity: int
+        :param batch: optional maximal number of records written at once, defaults to config.LOG_BATCH
+        :type batch: int
+        :return:
+        """
+        if capacity < 1 or batch < 1:
+            raise ValueError('log queue size and batch must be positive')
+
+        super().__init__()
+        self.path = path
+        self.batch = batch
+        self.writes = 0
+        self._handle = open(path, 'a')
+        self._queue = queue.Queue(capacity)
+        self._thread = threading.Thread(target=self._write, name='log', daemon=True)
+        self._thread.start()
+
+    def handle(self, record):
+        # queuing needs no lock of the handler, the records are formatted by the writing thread
+        if self.filter(record):
+            self._queue.put(record)
+        return record
+
+    def emit(self, record):
+        self._queue.put(record)
+
+    def _write(self):
+        closed = False
+        while not closed:
+            records = [self._queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = []
+            for record in records:
+                if record is self._closed:
+                    closed = True
+                    continue
+                try:
+                    lines.append(self.format(record) + '\n')
+                except Exception:
+                    self.handleError(record)
+            try:
+                if lines:
+                    self._handle.write(''.join(lines))
+                    self._handle.flush()
+                    self.writes += 1
+            except OSError:
+                self.handleError(records[0])
+            finally:
+                for record in records:
+                    self._queue.task_done()
+
+    def flush(self):
+        """
+        Waits until the queued records are written.
+
+        :return:
+        """
+        if self._thread.is_alive():
+            self._queue.join()
+
+    def close(self):
+        """
+        Writes the queued records, stops the writing thread and closes the file.
+
+        :return:
+        """
+        if self._thread.is_alive():
+            self._queue.put(self._closed)
+            self._thread.join()
+        if not self._handle.closed:
+            self._handle.close()
+        super().close()
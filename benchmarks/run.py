@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import os.path
+import resource
+import subprocess
+import tempfile
+import time
+
+import config
+import connectionpool
+import imgcrawl
+import metrics
+from benchmarks import server
+
+
+DEFAULT_RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+DEFAULT_SIZES = (1000,)
+
+
+def generate_urls(path, count, netlocs, profile):
+    """
+    Writes a URL list spreading count images round-robin over the hosts, a share of them (by the disallow rate of the
+    profile) below the path disallowed by robots.txt.
+
+    :param path: file to be written
+    :type path: str
+    :param count: number of URLs
+    :type count: int
+    :param netlocs: host and port of each host
+    :type netlocs: list of str
+    :param profile: behaviour of the hosts
+    :type profile: server.Profile
+    :return:
+    """
+    with open(path, 'w') as handle:
+        for number in range(count):
+            directory = 'private' if profile.disallowed(number) else 'img'
+            handle.write('http://%s/%s/%d.png\n' % (netlocs[number % len(netlocs)], directory, number))
+
+
+def _system_counters():
+    # read and write system calls of this process (Linux), voluntary and involuntary context switches
+    counters = {}
+    try:
+        with open('/proc/self/io') as handle:
+            for line in handle:
+                name, value = line.split(':')
+                if name in ('syscr', 'syscw'):
+                    counters[name] = int(value)
+    except OSError:
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    counters['voluntary_switches'], counters['involuntary_switches'] = usage.ru_nvcsw, usage.ru_nivcsw
+    return counters
+
+
+def crawl(url_file, workers, host_workers):
+    """
+    Crawls a URL list into a temporary directory and measures it. Runs in a fresh process per run,
+    so the peak memory is the one of this crawl.
+
+    :param url_file: the URL list
+    :type url_file: str
+    :param workers: number of concurrent downloads
+    :type workers: int
+    :param host_workers: number of concurrent downloads per host
+    :type host_workers: int
+    :return: the measurements
+    :rtype: dict
+    """
+    with tempfile.TemporaryDirectory(prefix='imgcrawl-benchmark-') as directory:
+        recorder = metrics.MetricsRecorder()
+        pool = connectionpool.ConnectionPool(max(workers, config.DEFAULT_POOL_SIZE))
+        crawler = imgcrawl.ImgCrawler(workers, host_workers, pool=pool, retries=0, metrics=recorder)
+        before = _system_counters()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            crawler.download_images(url_file, os.path.join(directory, 'images'), os.path.join(directory, 'crawl.log'))
+        seconds = time.perf_counter() - started
+        after = _system_counters()
+        pool.close()
+
+    summary = recorder.summary()
+    result = {'urls': summary['urls'],
+              'downloaded': crawler.download_count,
+              'bytes': summary['bytes'],
+              'seconds': round(seconds, 3),
+              'urls_per_second': round(summary['urls'] / seconds, 1),
+              'megabytes_per_second': round(summary['bytes'] / seconds / 1e6, 3),
+              'peak_rss_kilobytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              'connections': pool.opened,
+              'requests': pool.requests,
+              'outcomes': summary['outcomes'],
+              'p90_seconds': {name: latency['p90'] for name, latency in summary['phases'].items()}}
+    for name in after:
+        result[name] = after[name] - before.get(name, 0)
+    return result
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def previous(results, parameters, current_version):
+    """
+    Returns the latest saved result of a different version for the same parameters, None if there is none.
+    """
+    if not os.path.exists(results):
+        return None
+    found = None
+    with open(results) as handle:
+        for line in handle:
+            result = json.loads(line)
+            if result['parameters'] == parameters and result['version'] != current_version:
+                found = result
+    return found
+
+
+def run(sizes=DEFAULT_SIZES, hosts=8, workers=16, host_workers=config.DEFAULT_HOST_WORKERS, profile=None, results=None):
+    """
+    Runs the benchmark for each URL list size against a stand-in server, saving each result as a JSON line
+    and comparing it to the latest result of another version with the same parameters. The measurements include
+    the requests and connections counted by the server.
+
+    :param sizes: optional numbers of URLs of the lists, defaults to DEFAULT_SIZES
+    :type sizes: tuple of int
+    :param hosts: optional number of stand-in hosts, defaults to 8
+    :type hosts: int
+    :param workers: optional number of concurrent downloads, defaults to 16
+    :type workers: int
+    :param host_workers: optional number of concurrent downloads per host, defaults to config.DEFAULT_HOST_WORKERS
+    :type host_workers: int
+    :param profile: optional behaviour of the hosts, defaults to server.Profile()
+    :type profile: server.Profile
+    :param results: optional file to which the results are appended, defaults to not saving them
+    :type results: str
+    :return: the results
+    :rtype: list of dict
+    """
+    profile = server.Profile() if profile is None else profile
+    current_version = version()
+    reports = []
+    for size in sizes:
+        # a fresh server per run, so its request and connection counts are the ones of the run
+        netlocs, stop = multiprocessing.Queue(), multiprocessing.Event()
+        process = multiprocessing.Process(target=server.serve, args=(profile, hosts, netlocs, stop), daemon=True)
+        process.start()
+        try:
+            addresses = netlocs.get(timeout=30)
+            with tempfile.TemporaryDirectory(prefix='imgcrawl-benchmark-') as directory:
+                url_file = os.path.join(directory, 'urls.txt')
+                generate_urls(url_file, size, addresses, profile)
+                with concurrent.futures.ProcessPoolExecutor(1) as executor:
+                    measurements = executor.submit(crawl, url_file, workers, host_workers).result()
+        finally:
+            stop.set()
+        measurements['server_requests'], measurements['server_connections'] = netlocs.get(timeout=30)
+        process.join(10)
+
+        parameters = {'urls': size, 'hosts': hosts, 'workers': workers, 'host_workers': host_workers,
+                      'latency': profile.latency, 'bandwidth': profile.bandwidth, 'sizes': profile.sizes,
+                      'error_rate': profile.error_rate, 'non_image_rate': profile.non_image_rate,
+                      'disallow_rate': profile.disallow_rate, 'crawl_delay': profile.crawl_delay}
+        report = {'version': current_version, 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                  'parameters': parameters, 'measurements': measurements}
+        if results:
+            report['previous'] = previous(results, parameters, current_version)
+            with open(results, 'a') as handle:
+                handle.write(json.dumps({name: value for name, value in report.items() if name != 'previous'}) + '\n')
+        reports.append(report)
+    return reports
+
+
+def describe(report):
+    measurements = report['measurements']
+    text = '%(urls)7d urls: %(urls_per_second)9.1f urls/s %(megabytes_per_second)8.2f MB/s, %(peak_rss_kilobytes)d KB peak RSS, ' \
+           '%(connections)d connections for %(requests)d requests (server: %(server_connections)d for %(server_requests)d)' % measurements
+    if 'syscr' in measurements:
+        text += ', %(syscr)d read / %(syscw)d write syscalls' % measurements
+    if report.get('previous'):
+        before = report['previous']['measurements']
+        text += '; urls/s %+.1f%% against %s' % ((measurements['urls_per_second'] / before['urls_per_second'] - 1) * 100,
+                                                  report['previous']['version'])
+    return text
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the image crawler against a local stand-in server.')
+    parser.add_argument('--urls', metavar='URLS', dest='urls', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='numbers of URLs of the generated lists (default: %s)' % ' '.join(map(str, DEFAULT_SIZES)))
+    parser.add_argument('--hosts', metavar='HOSTS', type=int, default=8, help='number of stand-in hosts (default: 8)')
+    parser.add_argument('-j', '--workers', metavar='WORKERS', type=int, default=16, help='number of concurrent downloads (default: 16)')
+    parser.add_argument('--host-workers', metavar='HOST_WORKERS', type=int, default=config.DEFAULT_HOST_WORKERS,
+                        help='number of concurrent downloads per host (default: %d)' % config.DEFAULT_HOST_WORKERS)
+    parser.add_argument('--latency', metavar='SECONDS', type=float, default=0.0, help='seconds before each response (default: 0)')
+    parser.add_argument('--bandwidth', metavar='BYTES', type=int, default=0, help='bytes per second of each response, 0 for unlimited (default: 0)')
+    parser.add_argument('--sizes', metavar='DISTRIBUTION', dest='distribution', default='lognormal:8000:1.0',
+                        help='image sizes: fixed:BYTES, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA (default: lognormal:8000:1.0)')
+    parser.add_argument('--error-rate', metavar='RATE', type=float, default=0.0, help='fraction of images answered with 500 (default: 0)')
+    parser.add_argument('--non-image-rate', metavar='RATE', type=float, default=0.0, help='fraction of URLs answered with HTML (default: 0)')
+    parser.add_argument('--disallow-rate', metavar='RATE', type=float, default=0.0, help='fraction of URLs disallowed by robots.txt (default: 0)')
+    parser.add_argument('--crawl-delay', metavar='SECONDS', type=float, default=0.0, help='Crawl-delay of the robots.txt (default: none)')
+    parser.add_argument('--results', metavar='RESULTS_FILE', default=DEFAULT_RESULTS,
+                        help='file to which the results are appended as JSON lines (default: %s)' % DEFAULT_RESULTS)
+    return parser
+
+
+if __name__ == '__main__':
+    arguments = make_parser().parse_args()
+    profile = server.Profile(arguments.latency, arguments.bandwidth, arguments.distribution, arguments.error_rate,
+                             arguments.non_image_rate, arguments.disallow_rate, arguments.crawl_delay)
+    for report in run(arguments.urls, arguments.hosts, arguments.workers, arguments.host_workers, profile, arguments.results):
+        print(describe(report))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import random
+import time
+
+from tests.server import LocalServer, png_image
+
+
+class Profile:
+    """
+    Behaviour of the stand-in hosts: response latency, bandwidth per response, image size distribution,
+    robots.txt rules and the rates of errors and non-image responses. The behaviour of each path is derived from
+    a hash of the path, so repeated runs serve the same content and answers.
+    """
+    def __init__(self, latency=0.0, bandwidth=0, sizes='lognormal:8000:1.0', error_rate=0.0, non_image_rate=0.0,
+                 disallow_rate=0.0, crawl_delay=0.0):
+        """
+        Profile constructor.
+
+        :param latency: optional seconds before the response headers are sent, defaults to 0
+        :type latency: float
+        :param bandwidth: optional bytes per second of a response body, 0 for unlimited, defaults to 0
+        :type bandwidth: int
+        :param sizes: optional image size distribution: fixed:BYTES, uniform:MIN:MAX or lognormal:MEDIAN:SIGMA,
+                      defaults to lognormal:8000:1.0
+        :type sizes: str
+        :param error_rate: optional fraction of paths answered with 500, defaults to 0
+        :type error_rate: float
+        :param non_image_rate: optional fraction of paths answered with HTML, defaults to 0
+        :type non_image_rate: float
+        :param disallow_rate: optional fraction of paths disallowed by robots.txt, defaults to 0
+        :type disallow_rate: float
+        :param crawl_delay: optional Crawl-delay of the robots.txt, defaults to none
+        :type crawl_delay: float
+        :return:
+        """
+        kind, *parameters = sizes.split(':')
+        if kind not in ('fixed', 'uniform', 'lognormal') or len(parameters) != {'fixed': 1, 'uniform': 2, 'lognormal': 2}[kind]:
+            raise ValueError('unknown size distribution: %s' % sizes)
+
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.sizes = sizes
+        self.error_rate = error_rate
+        self.non_image_rate = non_image_rate
+        self.disallow_rate = disallow_rate
+        self.crawl_delay = crawl_delay
+        self._size_kind, self._size_parameters = kind, [float(parameter) for parameter in parameters]
+
+    @staticmethod
+    def _fraction(path, salt):
+        return int.from_bytes(hashlib.md5(('%s:%s' % (salt, path)).encode()).digest()[:8], 'big') / 2 ** 64
+
+    def disallowed(self, number):
+        return self._fraction(number, 'disallow') < self.disallow_rate
+
+    def robots(self):
+        lines = ['User-agent: *', 'Disallow: /private/']
+        if self.crawl_delay:
+            lines.append('Crawl-delay: %g' % self.crawl_delay)
+        return ('\n'.join(lines) + '\n').encode()
+
+    def size(self, path):
+        generator = random.Random(path)
+        if self._size_kind == 'fixed':
+            size = self._size_parameters[0]
+        elif self._size_kind == 'uniform':
+            size = generator.uniform(*self._size_parameters)
+        else:
+            size = generator.lognormvariate(0, self._size_parameters[1]) * self._size_parameters[0]
+        return max(int(size), 64)
+
+    def respond(self, path):
+        """
+        Returns the answer for a path.
+
+        :param path: the requested path
+        :type path: str
+        :return: status, content type and body
+        :rtype: tuple
+        """
+        if path == '/robots.txt':
+            return 200, 'text/plain', self.robots()
+        if not path.startswith(('/img/', '/private/')):
+            return 404, 'text/plain', b'not found'
+        if self._fraction(path, 'error') < self.error_rate:
+            return 500, 'text/plain', b'server error'
+        if self._fraction(path, 'html') < self.non_image_rate:
+            return 200, 'text/html', b'<html><body>no image</body></html>'
+        return 200, 'image/png', png_image(64, 64, self.size(path))
+
+
+class StandInHost(LocalServer):
+    """
+    Stand-in image host answering every path by the profile, counting the requests instead of recording them.
+    """
+    def __init__(self, profile):
+        super().__init__()
+        self.profile = profile
+        self.request_count = 0
+
+    def answer(self, handler):
+        with self._lock:
+            self.request_count += 1
+        profile = self.profile
+        if profile.latency:
+            time.sleep(profile.latency)
+        status, content_type, body = profile.respond(handler.path)
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if not profile.bandwidth:
+            handler.wfile.write(body)
+            return
+        # throttle the body to the bandwidth in chunks of a tenth of a second
+        chunk = max(profile.bandwidth // 10, 1)
+        for start in range(0, len(body), chunk):
+            handler.wfile.write(body[start:start + chunk])
+            time.sleep(len(body[start:start + chunk]) / profile.bandwidth)
+
+
+class StandInServer:
+    """
+    Stand-in for a number of image hosts on localhost, one listening port per host.
+    """
+    def __init__(self, profile, hosts=1):
+        self.profile = profile
+        self.hosts = [StandInHost(profile) for host in range(hosts)]
+
+    @property
+    def netlocs(self):
+        return [host.netloc for host in self.hosts]
+
+    @property
+    def requests(self):
+        return sum(host.request_count for host in self.hosts)
+
+    @property
+    def connections(self):
+        return sum(host.connections for host in self.hosts)
+
+    def start(self):
+        for host in self.hosts:
+            host.__enter__()
+        return self
+
+    def stop(self):
+        for host in self.hosts:
+            host.__exit__(None, None, None)
+
+
+def serve(profile, hosts, netlocs, stop):
+    """
+    Runs the stand-in server in a separate process, so it does not compete with the crawler for the interpreter.
+
+    :param profile: behaviour of the hosts
+    :type profile: Profile
+    :param hosts: number of hosts
+    :type hosts: int
+    :param netlocs: queue receiving the host and port of each host, followed by the request and connection counts when stopped
+    :type netlocs: multiprocessing.Queue
+    :param stop: event stopping the server
+    :type stop: multiprocessing.Event
+    :return:
+    """
+    server = StandInServer(profile, hosts).start()
+    netlocs.put(server.netlocs)
+    stop.wait()
+    server.stop()
+    netlocs.put((server.requests, server.connections))
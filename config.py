@@ -8,30 +8,251 @@ DEFAULT_LOG_FILE = 'crawling.log'
 
 # command arguments help
 DESCRIPTION = 'Download images from URL list in a file.'
-HELP_URL_FILE = 'plaintext file containing URLs of images to download'
+HELP_URL_FILE = 'plaintext file containing URLs of images to download, optionally gzip, bzip2 or xz compressed, - for standard input ' \
+                '(omitted when running as a service with --spool or --socket)'
 HELP_DESTINATION_DIR = 'specify alternative destination directory (default: current working directory)'
 HELP_LOG_FILE = 'specify alternative log file (default: %s)'
+HELP_WORKERS = 'number of images downloaded concurrently (default: %d)'
+HELP_HOST_WORKERS = 'number of images downloaded concurrently from the same host (default: %d)'
+HELP_DELAY = 'minimal seconds between requests to the same host, robots.txt Crawl-delay and Request-rate may ask for more (default: %g)'
+HELP_ROBOTS_CACHE = 'file in which robots.txt rules are kept between crawls (default: not persisted)'
+HELP_ROBOTS_TTL = 'seconds after which cached robots.txt rules are fetched again (default: %d)'
+HELP_ROBOTS_CACHE_SIZE = 'maximal number of hosts with cached robots.txt rules (default: %d)'
+HELP_POOL_SIZE = 'maximal number of idle connections kept open per host (default: %d)'
+HELP_IDLE_TIMEOUT = 'seconds after which idle connections are closed (default: %d)'
+HELP_DNS_TTL = 'seconds for which resolved host addresses are cached, 0 to resolve every connection (default: %d)'
+HELP_CONNECT_TIMEOUT = 'seconds to wait for a connection to a host (default: %g)'
+HELP_READ_TIMEOUT = 'seconds to wait for data from a host (default: %g)'
+HELP_RETRIES = 'number of retries of requests failing by timeouts, resets or server errors (default: %d)'
+HELP_BREAKER_THRESHOLD = 'number of consecutive failures after which the remaining URLs of a host are skipped, 0 to never skip (default: %d)'
+HELP_MAX_BYTES = 'skip images larger than the given number of bytes (default: no limit)'
+HELP_SEGMENTS = 'number of byte ranges of a large image fetched in parallel, 1 fetches images in one piece (default: %d)'
+HELP_SEGMENT_THRESHOLD = 'minimal size in bytes of the images fetched in segments (default: %d)'
+HELP_MIN_SIZE = 'skip images smaller than the given width or height, read from the image header (default: no limit)'
+HELP_MAX_SIZE = 'skip images larger than the given width or height, read from the image header (default: no limit)'
+HELP_STORAGE = 'storage for the images: flat files, content-addressed with deduplication, files in a sharded directory tree ' \
+               'or a pack of segment files with an index (default: %s)'
+HELP_MANIFEST = 'file recording the downloaded images, which are only downloaded again if they changed (default: none)'
+HELP_DEDUP = 'skip repeated URLs after normalization: off, bloom (bounded memory, rare false positives) or sort (exact, external sort, not for standard input) (default: %s)'
+HELP_DEDUP_CAPACITY = 'expected number of URLs sizing the Bloom filter (default: %d)'
+HELP_DEDUP_ERROR_RATE = 'rate of unique URLs the Bloom filter may report as repeated (default: %g)'
+HELP_SHARD = 'crawl only the hosts of shard i of N (0 <= i < N), with its own log, journal, manifest and robots.txt cache files'
+HELP_SHARDS = 'crawl the URLs in N shards by separate processes and merge their logs (also on several machines sharing the file system)'
+HELP_PROCESSES = 'maximal number of shards crawled at a time on this machine (default: number of CPUs)'
+HELP_METRICS = 'file to which the phase timings, size, status and outcome of each URL and a summary are appended as JSON lines (default: none)'
+HELP_PROMETHEUS = 'file to which the summary of the crawl is written in the Prometheus text format (default: none)'
+HELP_ASYNC_LOG = 'write the log in batches from a background thread instead of from each download'
+HELP_ADAPTIVE = 'adapt the number of concurrent downloads, overall and per host, to the latency and overload answers ' \
+                'of the hosts, WORKERS and HOST_WORKERS become the maximums'
+HELP_MAX_BANDWIDTH = 'maximal bytes per second received by all downloads together (default: no limit)'
+HELP_NEAR_DUPLICATES = 'detect near duplicates of downloaded images (re-encoded, resized) by perceptual hashes differing in at most BITS of 64 bits, ' \
+                       'needs NumPy and Pillow (default: off)'
+HELP_SKIP_NEAR_DUPLICATES = 'do not store near duplicates instead of only logging them'
+HELP_PERCEPTUAL_HASH = 'perceptual hash of the near-duplicate detection: ahash, dhash or phash (default: %s)'
+HELP_HASH_INDEX = 'file keeping the perceptual hashes of the stored images for the near-duplicate detection of later crawls (default: none)'
+HELP_PROFILE = 'profile the crawl, including the download threads, with cProfile and write the statistics to PSTATS_FILE, ' \
+               'e.g. for python -m pstats (default: none)'
+HELP_TRACE_MEMORY = 'trace the memory allocations with tracemalloc and log the lines allocating the most every SECONDS seconds (default: off)'
+HELP_SPOOL = 'run as a service crawling each URL file placed into the directory SPOOL_DIR, until terminated'
+HELP_SOCKET = 'run as a service crawling the URLs sent to the Unix domain socket SOCKET, answering with the results, until terminated'
+HELP_RESUME = 'continue an interrupted crawl recorded in the journal next to the log file (LOG_FILE%s)'
+POSITIVE_ARGUMENT = 'must be positive: %s'
+NON_NEGATIVE_ARGUMENT = 'must not be negative: %s'
+
+# concurrency
+DEFAULT_WORKERS = 1
+DEFAULT_HOST_WORKERS = 4
+
+# adaptive concurrency (additive increase, multiplicative decrease)
+AIMD_INITIAL = 4
+AIMD_DECREASE = 0.5
+AIMD_SMOOTHING = 0.2
+AIMD_LATENCY_FACTOR = 3.0
+AIMD_LATENCY_FLOOR = 0.5
+AIMD_WINDOW = 50
+AIMD_ERROR_RATE = 0.2
+AIMD_GLOBAL_COOLDOWN = 5.0
+AIMD_HOSTS = 10000
+
+# sharding
+SHARD_SUFFIX = '.%d-of-%d'
+SHARD_CLAIM = '.claim'
+SHARD_DONE = '.done'
+SHARD_MERGE = '.merge'
+SHARD_POLL = 0.1
+# claims not refreshed for this many seconds are taken over, their launcher being gone
+SHARD_STALE = 600
+SHARD_HEARTBEAT = 60
+SHARD_INCOMPLETE = 'shards left to other machines or failed'
+
+# service
+SPOOL_WORK = '.work'
+SPOOL_POLL = 0.1
+BATCH_DIRECTORY = 'batches'
+BATCH_URLS = '%s.urls'
+BATCH_LOG = '%s.log'
+BATCH_RESULTS = '%s.results'
+BATCH_ERROR = '%s.error'
+BATCH_SOCKET = 'socket-%s-%d'
+SOCKET_TIMEOUT = 30.0
+SERVICE_ARGUMENTS = 'either URL_FILE or --spool/--socket must be given'
+SERVICE_OPTIONS = '--resume and --dedup sort need a URL_FILE and cannot be used with --spool/--socket'
+
+# politeness
+DEFAULT_CRAWL_DELAY = 0.0
+MAX_CRAWL_DELAY = 60.0
+SCHEDULER_WINDOW = 10000
+
+# URL input
+STDIN = '-'
+ESTIMATED_URL_BYTES = 80
+
+# URL deduplication
+DEDUP_OFF = 'off'
+DEDUP_BLOOM = 'bloom'
+DEDUP_SORT = 'sort'
+DEDUP_CAPACITY = 10000000
+DEDUP_ERROR_RATE = 0.0001
+DEDUP_ARGUMENTS = '--dedup-error-rate needs a RATE between 0 and 1'
+DEDUP_SORT_CHUNK = 1000000
 
 # URL requests
 IMAGE_MIMETYPE = 'image'
+MAX_REDIRECTS = 10
+DRAIN_LIMIT = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = '.part'
+DEFAULT_SEGMENTS = 4
+DEFAULT_SEGMENT_THRESHOLD = 32 * 1024 * 1024
+SNIFF_BYTES = 4 * 1024
+SNIFF_LIMIT = 64 * 1024
+
+# connection pool
+DEFAULT_POOL_SIZE = 4
+DEFAULT_IDLE_TIMEOUT = 30
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 30.0
+
+# DNS cache
+DNS_CACHE_TTL = 5 * 60
+DNS_NEGATIVE_TTL = 30
+DNS_CACHE_SIZE = 10000
+DNS_PREFETCH_WORKERS = 4
+DNS_PREFETCH_QUEUE = 256
+
+# retries
+DEFAULT_RETRIES = 2
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_CAP = 10.0
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 5 * 60
 
 # robots.txt
 ROBOTS = 'robots.txt'
 USER_AGENT = '*'
+ROBOTS_CACHE_TTL = 24 * 60 * 60
+ROBOTS_CACHE_SIZE = 10000
+ROBOTS_NEGATIVE_TTL = 60
+
+# storage
+STORAGE_FLAT = 'flat'
+STORAGE_CONTENT = 'content'
+STORAGE_SHARDED = 'sharded'
+STORAGE_PACK = 'pack'
+CONTENT_OBJECTS = 'objects'
+CONTENT_INDEX = 'index.tsv'
+PACK_SEGMENT = 'segment-%05d.pack'
+PACK_URLS = 'segment-%05d.urls'
+PACK_INDEX = 'index.bin'
+PACK_TABLE = 'segment-%05d.hash'
+PACK_TABLE_CAPACITY = 1024
+PACK_SEGMENT_SIZE = 1024 ** 3
+
+# near duplicates
+DEFAULT_PERCEPTUAL_HASH = 'dhash'
+DEFAULT_NEAR_DUPLICATE_BITS = 5
+NEAR_DUPLICATE_ARGUMENTS = '--near-duplicates needs NumPy and Pillow and BITS between 0 and 64'
+HASH_INDEX_CAPACITY = 1024
+HASH_SUFFIX = '.hashing'
+
+# conditional re-crawls
+MANIFEST_BATCH = 1000
+
+# resuming
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_BATCH = 1000
+JOURNAL_HASH_LENGTH = 16
+JOURNAL_TAIL = 64 * 1024
+
+# metrics
+OUTCOME_DOWNLOADED = 'downloaded'
+OUTCOME_NOT_MODIFIED = 'not_modified'
+OUTCOME_INVALID = 'invalid'
+OUTCOME_ROBOTS_ERROR = 'robots_error'
+OUTCOME_DISALLOWED = 'disallowed'
+OUTCOME_HOST_FAILING = 'host_failing'
+OUTCOME_OPEN_ERROR = 'open_error'
+OUTCOME_NOT_AN_IMAGE = 'not_an_image'
+OUTCOME_TOO_LARGE = 'too_large'
+OUTCOME_DIMENSIONS = 'dimensions'
+OUTCOME_DOWNLOAD_ERROR = 'download_error'
+OUTCOME_DUPLICATE_URL = 'duplicate_url'
+OUTCOME_NEAR_DUPLICATE = 'near_duplicate'
+METRICS_UNTIMED = (OUTCOME_DUPLICATE_URL,)
+METRICS_SAMPLES = 10000
+METRICS_HOSTS = 10000
+METRICS_OTHER_HOSTS = '(other)'
+METRICS_HOST_SAMPLES = 100
+METRICS_SLOWEST_HOSTS = 10
+METRICS_PREFIX = 'imgcrawl_'
+
+# profiling
+STAGE_REPORT = 'stages after %.3f seconds: calls, seconds, milliseconds per call, maximal milliseconds'
+STAGE_REPORT_LINE = '%-10s %10d %12.3f %10.3f %10.3f'
+TRACE_MEMORY_TOP = 10
+TRACE_MEMORY_ARGUMENTS = '--trace-memory needs a positive number of SECONDS'
 
 # logging
 LOG_FORMAT = '%(asctime)s %(message)s'
+LOG_NAME = 'imgcrawl'
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH = 256
+LOG_SERVICE_STARTED = 'service started, spool: %s, socket: %s'
+LOG_SERVICE_BATCH = 'batch %s: %d urls, %d images stored in %.3f seconds'
+LOG_SERVICE_FAILED = 'batch %s failed after %d urls: %s'
+LOG_SERVICE_STOPPED = 'service stopped after %d batches'
 LOG_INITIAL_MESSAGE = 'downloading images from URLs listed in file "%s" into directory "%s".'
 LOG_URL_INVALID = 'url string invalid'
 LOG_ERROR_ROBOTS = 'unable to access URL'
+LOG_ROBOTS_CACHE_IGNORED = 'robots.txt cache file %s ignored: %s'
 LOG_DISALLOWED = 'download disallowed by robots.txt'
 LOG_ERROR_OPENING = 'failed to open image URL'
 LOG_NOT_AN_IMAGE = 'url content is not an image'
 LOG_ERROR_DOWNLOADING = 'unable to download the image'
 LOG_DOWNLOADED = 'downloaded'
+LOG_NEAR_DUPLICATE = 'near duplicate of image %d (%d bits differ)'
+LOG_NOT_MODIFIED = 'not modified'
+LOG_DUPLICATE_URL = 'repeated url skipped'
+LOG_TOO_LARGE = 'image exceeds the maximal size'
+LOG_DIMENSIONS = 'image dimensions outside the limits'
+LOG_TOO_MANY_REDIRECTS = 'too many redirects'
+LOG_HOST_FAILING = 'host failing repeatedly, url skipped'
+LOG_MEMORY = 'memory: %.3f MB traced in %d blocks'
+LOG_MEMORY_LINE = 'memory: %s:%d %.1f KiB (%+.1f KiB) in %d blocks'
+LOG_SUMMARY = 'summary: robots.txt cache %(robots_hits)d hits, %(robots_misses)d misses; DNS cache %(dns_hits)d hits, %(dns_misses)d misses; ' \
+              '%(requests)d requests over %(connections)d connections; ' \
+              '%(duplicates)d duplicates (%(duplicate_bytes)d bytes); %(not_modified)d not modified (%(not_modified_bytes)d bytes); ' \
+              '%(duplicate_urls)d repeated urls skipped; %(retries)d retries; %(breaker_rejected)d urls of failing hosts skipped; ' \
+              '%(rejected)d transfers aborted by content (%(rejected_saved_bytes)d bytes saved); ' \
+              '%(resumed)d transfers resumed (%(resumed_bytes)d bytes kept); %(segmented)d images fetched in segments; ' \
+              '%(near_duplicates)d near duplicates (%(near_duplicate_bytes)d bytes)'
 
 # appearance
 MAX_URL = 40
 MAX_FILE_NAME = 15
 PROGRESS_BAR_WIDTH = 30
 PROGRESS_COMPLETE = 'completed'
+PROGRESS_INTERVAL = 0.2
+PROGRESS_LINE_INTERVAL = 10.0
+PROGRESS_STATUS = '%s %.1f urls/s %.2f MB/s, ETA %s, %d active, %d errors'
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64
+import collections
+import http.client
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import config
+import dnscache
+import metrics
+
+
+class PooledResponse:
+    """
+    Response of a pooled request, offering the parts of the urllib.request.urlopen() response used by the crawler.
+    Closing the response after reading the whole body hands the connection back to the pool for reuse.
+    """
+    def __init__(self, pool, key, connection, response, url):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+
+    def info(self):
+        return self.headers
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+    def readinto(self, buffer):
+        return self.response.readinto(buffer)
+
+    def close(self):
+        """
+        Releases the connection: it is kept if the body was completely read and the server allows keep-alive,
+        otherwise it is closed.
+
+        :return:
+        """
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.release(self.key, connection)
+        else:
+            self.response.close()
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of persistent HTTP(S) connections per scheme, host and port.
+    Connections are reused across requests (keep-alive) instead of opening a new TCP connection
+    and TLS session per request. Idle connections are kept up to a maximal number per host and
+    discarded after an idle timeout. Like urllib.request.urlopen(), requests go through the proxies of the
+    http_proxy and https_proxy environment variables, except for the hosts of no_proxy: HTTP requests are
+    sent to the proxy, HTTPS requests through a tunnel opened by CONNECT.
+    """
+    REDIRECT_CODES = (301, 302, 303, 307, 308)
+    STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+    def __init__(self, max_idle=config.DEFAULT_POOL_SIZE, idle_timeout=config.DEFAULT_IDLE_TIMEOUT, timeout=config.DEFAULT_READ_TIMEOUT,
+                 connect_timeout=config.DEFAULT_CONNECT_TIMEOUT, resolver=None, proxies=None):
+        """
+        Connection pool constructor.
+
+        :param max_idle: optional maximal number of idle connections kept per host, defaults to config.DEFAULT_POOL_SIZE
+        :type max_idle: int
+        :param idle_timeout: optional number of seconds after which idle connections are closed, defaults to config.DEFAULT_IDLE_TIMEOUT
+        :type idle_timeout: int, float
+        :param timeout: optional seconds to wait for data from the server, None to wait indefinitely,
+                        defaults to config.DEFAULT_READ_TIMEOUT
+        :type timeout: int, float
+        :param connect_timeout: optional seconds to wait for a connection to be established, None to wait indefinitely,
+                                defaults to config.DEFAULT_CONNECT_TIMEOUT
+        :type connect_timeout: int, float
+        :param resolver: optional cache of host addresses, defaults to a cache with default limits
+        :type resolver: dnscache.DnsCache
+        :param proxies: optional proxy URLs by scheme and hosts not to proxy under 'no', as returned by
+                        urllib.request.getproxies(), defaults to the proxies of the environment
+        :type proxies: dict
+        :return:
+        """
+        if max_idle < 0:
+            raise ValueError('pool size must not be negative')
+        if (timeout is not None and timeout <= 0) or (connect_timeout is not None and connect_timeout <= 0):
+            raise ValueError('timeouts must be positive')
+
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.resolver = dnscache.DnsCache() if resolver is None else resolver
+        self.proxies = urllib.request.getproxies() if proxies is None else proxies
+        self.opened = 0
+        self.requests = 0
+
+        self._idle = {}
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+        self._headers = {'User-Agent': 'Python-urllib/%s' % urllib.request.__version__,
+                         'Accept-Encoding': 'identity'}
+
+    def _key(self, components):
+        scheme = components.scheme.lower()
+        if scheme not in ('http', 'https'):
+            raise urllib.error.URLError('unknown url type: %s' % scheme)
+        if not components.hostname:
+            raise urllib.error.URLError('no host given')
+        try:
+            port = components.port
+        except ValueError as error:
+            raise urllib.error.URLError(error)
+        return scheme, components.hostname, port or (443 if scheme == 'https' else 80)
+
+    def _route(self, key):
+        """
+        Returns the proxy of the requests to a host, looked up once per host.
+
+        :param key: scheme, host and port
+        :type key: tuple
+        :return: the host, port and Proxy-Authorization headers of the proxy, None if the host is requested directly
+        :rtype: tuple
+        """
+        route = self._routes.get(key, False)
+        if route is not False:
+            return route
+        scheme, host, port = key
+        proxy = self.proxies.get(scheme)
+        route = None
+        if proxy and not urllib.request.proxy_bypass_environment(host, self.proxies):
+            components = urllib.parse.urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+            headers = {}
+            if components.username is not None:
+                credentials = '%s:%s' % (urllib.parse.unquote(components.username), urllib.parse.unquote(components.password or ''))
+                headers['Proxy-Authorization'] = 'Basic ' + base64.b64encode(credentials.encode()).decode('ascii')
+            try:
+                route = components.hostname, components.port or 80, headers
+            except ValueError as error:
+                raise urllib.error.URLError(error)
+        self._routes[key] = route
+        return route
+
+    def _connect(self, key):
+        scheme, host, port = key
+        route = self._route(key)
+        if route is None:
+            address = host, port
+        else:
+            address = route[:2]
+        if scheme == 'https':
+            connection = http.client.HTTPSConnection(*address, timeout=self.connect_timeout, context=self._ssl_context)
+            if route is not None:
+                connection.set_tunnel(host, port, route[2])
+        else:
+            connection = http.client.HTTPConnection(*address, timeout=self.connect_timeout)
+        # resolve the host through the cache instead of the system resolver for each connection
+        connection._create_connection = self.resolver.create_connection
+        with self._lock:
+            self.opened += 1
+        try:
+            with metrics.phase('connect'):
+                connection.connect()
+            # the connect timeout applied to establishing the connection (and the TLS handshake), waiting for data may take longer
+            connection.sock.settimeout(self.timeout)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def acquire(self, key):
+        """
+        Returns an idle connection to the host, discarding expired ones, or None if there is none.
+
+        :param key: scheme, host and port
+        :type key: tuple
+        :return: a connection and a flag whether it was used before
+        :rtype: http.client.HTTPConnection, None
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                connection, released = idle.pop()
+                if now - released <= self.idle_timeout:
+                    return connection
+                connection.close()
+        return None
+
+    def release(self, key, connection):
+        """
+        Puts a connection back into the pool, closing it if the pool of the host is full.
+
+        :param key: scheme, host and port
+        :type key: tuple
+        :param connection: a connection without pending response
+        :type connection: http.client.HTTPConnection
+        :return:
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, collections.deque())
+            if len(idle) < self.max_idle:
+                idle.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def prefetch(self, url):
+        """
+        Resolves the host of an URL, or of its proxy, in the background, unless a connection to it is idle.
+
+        :param url: an URL to be requested soon
+        :type url: str
+        :return:
+        """
+        try:
+            key = self._key(urllib.parse.urlsplit(url))
+            route = self._route(key)
+        except (urllib.error.URLError, ValueError):
+            return
+        with self._lock:
+            if self._idle.get(key):
+                return
+        self.resolver.prefetch(*(key[1:] if route is None else route[:2]))
+
+    def close(self):
+        """
+        Closes all idle connections and stops resolving prefetched hosts.
+
+        :return:
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, released in connections:
+                connection.close()
+        self.resolver.close()
+
+    def _send(self, key, selector, headers):
+        connection = self.acquire(key)
+        reused = connection is not None
+        while True:
+            if connection is None:
+                connection = self._connect(key)
+            try:
+                with metrics.phase('ttfb'):
+                    connection.request('GET', selector, headers=headers)
+                    return connection, connection.getresponse()
+            except self.STALE_ERRORS:
+                # the server closed the kept-alive connection in the meantime, retry once on a fresh one
+                connection.close()
+                if not reused:
+                    raise
+                connection, reused = None, False
+            except BaseException:
+                connection.close()
+                raise
+
+    def urlopen(self, url, headers=None):
+        """
+        Sends a GET request over a pooled connection following redirects, comparable to urllib.request.urlopen().
+        Error statuses are raised as urllib.error.HTTPError, connection failures as urllib.error.URLError.
+
+        :param url: the URL to be requested
+        :type url: str
+        :param headers: optional additional request headers
+        :type headers: dict
+        :return: the response, to be closed after reading the body
+        :rtype: PooledResponse
+        """
+        for redirect in range(config.MAX_REDIRECTS + 1):
+            components = urllib.parse.urlsplit(url)
+            key = self._key(components)
+            selector = urllib.parse.urlunsplit(('', '', components.path or '/', components.query, ''))
+            request_headers = dict(self._headers, **(headers or {}))
+            route = self._route(key)
+            if route is not None and key[0] == 'http':
+                # a proxy is sent the whole URL, a tunnel only the path
+                selector = urllib.parse.urlunsplit((key[0], components.netloc, components.path or '/', components.query, ''))
+                request_headers.update(route[2])
+
+            try:
+                connection, response = self._send(key, selector, request_headers)
+            except OSError as error:
+                raise urllib.error.URLError(error)
+            except http.client.HTTPException as error:
+                raise urllib.error.URLError(error)
+            with self._lock:
+                self.requests += 1
+
+            pooled = PooledResponse(self, key, connection, response, url)
+            if response.status in self.REDIRECT_CODES and response.getheader('Location'):
+                self._discard_body(pooled)
+                url = urllib.parse.urljoin(url, response.getheader('Location'))
+                continue
+            if response.status >= 400:
+                self._discard_body(pooled)
+                raise urllib.error.HTTPError(url, response.status, response.reason, response.msg, None)
+            return pooled
+
+        raise urllib.error.HTTPError(url, response.status, config.LOG_TOO_MANY_REDIRECTS, response.msg, None)
+
+    def _discard_body(self, pooled):
+        # small bodies are drained to keep the connection alive, large ones are not worth the transfer
+        length = pooled.getheader('Content-Length')
+        try:
+            if length is not None and int(length) <= config.DRAIN_LIMIT:
+                pooled.read()
+        except (OSError, ValueError, http.client.HTTPException):
+            pass
+        pooled.close()
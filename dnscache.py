@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import concurrent.futures
+import socket
+import threading
+import time
+
+import config
+import metrics
+
+
+class DnsCache:
+    """
+    Thread-safe cache of resolved host addresses, with an expiry time and least-recently-used eviction once the
+    maximal number of entries is reached. Failed resolutions are cached for a shorter time.
+    Hosts can be prefetched on a small pool of background threads, so their addresses are known by the time
+    they are requested.
+    """
+    def __init__(self, ttl=config.DNS_CACHE_TTL, max_entries=config.DNS_CACHE_SIZE, negative_ttl=config.DNS_NEGATIVE_TTL,
+                 prefetch_workers=config.DNS_PREFETCH_WORKERS):
+        """
+        DNS cache constructor.
+
+        :param ttl: optional number of seconds resolved addresses stay valid, 0 disables the cache, defaults to config.DNS_CACHE_TTL
+        :type ttl: int, float
+        :param max_entries: optional maximal number of cached hosts, defaults to config.DNS_CACHE_SIZE
+        :type max_entries: int
+        :param negative_ttl: optional number of seconds failed resolutions stay cached, defaults to config.DNS_NEGATIVE_TTL
+        :type negative_ttl: int, float
+        :param prefetch_workers: optional number of threads resolving prefetched hosts, defaults to config.DNS_PREFETCH_WORKERS
+        :type prefetch_workers: int
+        :return:
+        """
+        if max_entries < 1 or prefetch_workers < 1:
+            raise ValueError('DNS cache size and prefetch workers must be positive')
+        if ttl < 0 or negative_ttl < 0:
+            raise ValueError('DNS cache times must not be negative')
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.prefetch_workers = prefetch_workers
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+        self._entries = collections.OrderedDict()
+        self._resolving = {}
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now >= entry[0]:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _fetch(self, key):
+        """
+        Resolves a host, caching the addresses or the error. Concurrent resolutions of the same host wait for a
+        single call of the system resolver.
+
+        :param key: host and port
+        :type key: tuple
+        :return: the cached entry of expiry time, addresses and error
+        :rtype: tuple
+        """
+        while True:
+            with self._lock:
+                entry = self._get(key, time.monotonic())
+                if entry is not None:
+                    self.hits += 1
+                    return entry
+                event = self._resolving.get(key)
+                if event is None:
+                    event = self._resolving[key] = threading.Event()
+                    self.misses += 1
+                    break
+            event.wait()
+
+        try:
+            try:
+                entry = (time.monotonic() + self.ttl, socket.getaddrinfo(key[0], key[1], type=socket.SOCK_STREAM), None)
+            except socket.gaierror as error:
+                entry = (time.monotonic() + min(self.negative_ttl, self.ttl), None, error)
+            if self.ttl:
+                with self._lock:
+                    self._put(key, entry)
+        finally:
+            with self._lock:
+                del self._resolving[key]
+            event.set()
+        return entry
+
+    def resolve(self, host, port):
+        """
+        Returns the addresses of a host like socket.getaddrinfo(), resolving it on a miss.
+
+        :param host: the host name
+        :type host: str
+        :param port: the port
+        :type port: int
+        :return: address family, socket type, protocol, canonical name and socket address of each address
+        :rtype: list of tuple
+        :raises socket.gaierror: if the host cannot be resolved
+        """
+        expires, addresses, error = self._fetch((host.lower(), port))
+        if error is not None:
+            raise error
+        return addresses
+
+    def prefetch(self, host, port):
+        """
+        Resolves a host in the background unless it is cached or being resolved. Hosts are dropped if too many are
+        waiting for resolution, they are resolved when requested then.
+
+        :param host: the host name
+        :type host: str
+        :param port: the port
+        :type port: int
+        :return:
+        """
+        key = (host.lower(), port)
+        with self._lock:
+            if not self.ttl or key in self._resolving or self._get(key, time.monotonic()) is not None:
+                return
+            if self._queued >= config.DNS_PREFETCH_QUEUE:
+                return
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.prefetch_workers, thread_name_prefix='dns')
+            self._queued += 1
+            self.prefetched += 1
+            executor = self._executor
+        executor.submit(self._prefetch, key)
+
+    def _prefetch(self, key):
+        try:
+            self._fetch(key)
+        finally:
+            with self._lock:
+                self._queued -= 1
+
+    def create_connection(self, address, timeout=None, source_address=None):
+        """
+        Connects to a host like socket.create_connection(), using the cached addresses.
+
+        :param address: host and port
+        :type address: tuple
+        :param timeout: optional socket timeout, defaults to waiting indefinitely
+        :type timeout: float
+        :param source_address: optional local address to bind to
+        :type source_address: tuple
+        :return: the connected socket
+        :rtype: socket.socket
+        """
+        host, port = address
+        error = None
+        with metrics.phase('dns'):
+            addresses = self.resolve(host, port)
+        for family, kind, protocol, name, socket_address in addresses:
+            sock = None
+            try:
+                sock = socket.socket(family, kind, protocol)
+                sock.settimeout(timeout)
+                if source_address:
+                    sock.bind(source_address)
+                sock.connect(socket_address)
+                return sock
+            except OSError as failure:
+                error = failure
+                if sock is not None:
+                    sock.close()
+        raise error if error is not None else OSError('getaddrinfo returns an empty list')
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
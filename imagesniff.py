@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import re
+import struct
+
+
+JPEG_FRAMES = frozenset(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+# the smallest content of an unknown format which may be an image
+UNKNOWN_MINIMUM = 16
+
+# the root element, behind an XML declaration, processing instructions, comments and a doctype
+_SVG_ROOT = re.compile(rb'(?:\s+|<\?.*?\?>|<!--.*?-->|<!(?i:DOCTYPE)\s[^\[>]*(?:\[.*?\])?\s*>)*(?=<svg[\s>/])', re.DOTALL)
+_SVG_TAG = re.compile(rb'<svg\b[^>]*>', re.DOTALL)
+_SVG_LENGTH = rb'\b%s\s*=\s*["\']\s*([0-9]*\.?[0-9]+)\s*(?:px)?\s*["\']'
+_HEIF_BRANDS = (b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'hevm', b'hevs', b'mif1', b'msf1')
+_TEXT_CONTROLS = bytes(set(range(32)) - set(b'\t\n\r\x0c'))
+_SVG_VIEW_BOX = re.compile(rb'\bviewBox\s*=\s*["\']\s*[-0-9.eE]+[\s,]+[-0-9.eE]+[\s,]+([0-9.eE]+)[\s,]+([0-9.eE]+)\s*["\']')
+
+
+class ImageHeader:
+    """
+    Format and dimensions of an image read from the start of its content, the dimensions are None if they are not
+    given within the read bytes.
+    """
+    __slots__ = ('kind', 'width', 'height')
+
+    def __init__(self, kind, width=None, height=None):
+        self.kind = kind
+        self.width = width
+        self.height = height
+
+    def fits(self, min_size=None, max_size=None):
+        """
+        Returns whether the dimensions are within the limits, images of unknown dimensions always fit.
+
+        :param min_size: optional minimal width and height, defaults to no limit
+        :type min_size: tuple
+        :param max_size: optional maximal width and height, defaults to no limit
+        :type max_size: tuple
+        :return: False if the image is too small or too large
+        :rtype: bool
+        """
+        if self.width is None or self.height is None:
+            return True
+        if min_size is not None and (self.width < min_size[0] or self.height < min_size[1]):
+            return False
+        if max_size is not None and (self.width > max_size[0] or self.height > max_size[1]):
+            return False
+        return True
+
+
+def parse_dimensions(value):
+    """
+    Parses image dimensions given as WIDTHxHEIGHT.
+
+    :param value: the dimensions argument
+    :type value: str
+    :return: width and height
+    :rtype: tuple
+    :raises argparse.ArgumentTypeError: if the value are no valid dimensions
+    """
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('dimensions must be given as WIDTHxHEIGHT: %s' % value)
+    if width < 0 or height < 0:
+        raise argparse.ArgumentTypeError('dimensions must not be negative: %s' % value)
+    return width, height
+
+
+def _jpeg(data):
+    # the dimensions are in the first start of frame segment, behind the application segments (e.g. Exif)
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xff:
+            break
+        marker = data[position + 1]
+        if marker == 0xff:
+            position += 1
+            continue
+        if marker == 0x01 or 0xd0 <= marker <= 0xd8:
+            position += 2
+            continue
+        if marker in JPEG_FRAMES:
+            if position + 9 > len(data):
+                break
+            height, width = struct.unpack_from('>HH', data, position + 5)
+            return ImageHeader('jpeg', width, height)
+        position += 2 + struct.unpack_from('>H', data, position + 2)[0]
+    return ImageHeader('jpeg')
+
+
+def _webp(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30 and data[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack_from('<HH', data, 26)
+        return ImageHeader('webp', width & 0x3fff, height & 0x3fff)
+    if chunk == b'VP8L' and len(data) >= 25 and data[20] == 0x2f:
+        bits = int.from_bytes(data[21:25], 'little')
+        return ImageHeader('webp', (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1)
+    if chunk == b'VP8X' and len(data) >= 30:
+        return ImageHeader('webp', int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1)
+    return ImageHeader('webp')
+
+
+def _heif(data):
+    # AVIF and HEIC are both HEIF files, told apart by the brands of the file type box
+    size = struct.unpack_from('>I', data)[0]
+    brands = [data[offset:offset + 4] for offset in range(16, min(size, len(data)) - 3, 4)] + [data[8:12]]
+    if b'avif' in brands or b'avis' in brands:
+        kind = 'avif'
+    elif any(brand in brands for brand in _HEIF_BRANDS):
+        kind = 'heic'
+    else:
+        return None
+    # the image spatial extents property of the primary image
+    position = data.find(b'ispe')
+    if position < 0 or position + 16 > len(data):
+        return ImageHeader(kind)
+    width, height = struct.unpack_from('>II', data, position + 8)
+    return ImageHeader(kind, width, height)
+
+
+def _svg(data):
+    text = data[3:] if data.startswith(b'\xef\xbb\xbf') else data
+    root = _SVG_ROOT.match(text)
+    if root is None:
+        return None
+    tag = _SVG_TAG.match(text, root.end())
+    if tag is None:
+        return ImageHeader('svg')
+    width, height = (re.search(_SVG_LENGTH % name, tag.group()) for name in (b'width', b'height'))
+    if width is not None and height is not None:
+        return ImageHeader('svg', round(float(width.group(1))), round(float(height.group(1))))
+    view_box = _SVG_VIEW_BOX.search(tag.group())
+    if view_box is not None:
+        try:
+            return ImageHeader('svg', round(float(view_box.group(1))), round(float(view_box.group(2))))
+        except ValueError:
+            pass
+    return ImageHeader('svg')
+
+
+def sniff(data):
+    """
+    Recognizes an image by the magic bytes at the start of its content and reads its dimensions from the format header
+    without decoding the pixels. Knows JPEG, PNG, GIF, WebP, AVIF, HEIC and SVG (a document with an svg root element)
+    as well as BMP, ICO and TIFF.
+
+    :param data: the first bytes of the content
+    :type data: bytes
+    :return: format and dimensions of the image, None if the content is no known image format
+    :rtype: ImageHeader
+    """
+    data = bytes(data)
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        if len(data) >= 24 and data[12:16] == b'IHDR':
+            return ImageHeader('png', *struct.unpack_from('>II', data, 16))
+        return ImageHeader('png')
+    if data.startswith(b'\xff\xd8\xff'):
+        return _jpeg(data)
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        if len(data) >= 10:
+            return ImageHeader('gif', *struct.unpack_from('<HH', data, 6))
+        return ImageHeader('gif')
+    if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+        return _webp(data)
+    if data[4:8] == b'ftyp' and len(data) >= 12:
+        return _heif(data)
+    if data.startswith(b'BM') and len(data) >= 18:
+        header = struct.unpack_from('<I', data, 14)[0]
+        if header == 12 and len(data) >= 22:
+            return ImageHeader('bmp', *struct.unpack_from('<HH', data, 18))
+        if header >= 40 and len(data) >= 26:
+            width, height = struct.unpack_from('<ii', data, 18)
+            return ImageHeader('bmp', abs(width), abs(height))
+        return None
+    if data.startswith(b'\x00\x00\x01\x00') and len(data) >= 8:
+        return ImageHeader('ico', data[6] or 256, data[7] or 256)
+    if data.startswith((b'II*\x00', b'MM\x00*')):
+        return ImageHeader('tiff')
+    return _svg(data)
+
+
+def binary(data):
+    """
+    Returns whether content of an unknown format may be an image of its declared type: binary data of at least
+    UNKNOWN_MINIMUM bytes, rather than text such as an HTML page, JSON document or error message.
+
+    :param data: the first bytes of the content
+    :type data: bytes
+    :return: a flag indicating whether the content is binary
+    :rtype: bool
+    """
+    data = bytes(data)
+    if len(data) < UNKNOWN_MINIMUM:
+        return False
+    # control characters do not occur in text
+    if len(data.translate(None, _TEXT_CONTROLS)) < len(data):
+        return True
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError as error:
+        # text may be cut within a character at the end of the read bytes
+        return error.start < len(data) - 3 or error.reason != 'unexpected end of data'
+    return False
@@ -1,29 +1,310 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import concurrent.futures
+import functools
+import hashlib
+import http
+import http.client
 import logging
 import os.path
+import re
+import signal
 import sys
+import threading
+import time
 import urllib.error
 import urllib.parse
-import urllib.robotparser
-import urllib.request
 
 import argparse
+import asynclog
 import config
+import connectionpool
+import dnscache
+import imagesniff
+import journal
+import manifest
+import metrics
+import pacing
+import perceptual
+import profiling
 import progressbar
+import retry
+import robotscache
+import scheduler
+import service
+import sharding
+import storage
+import urldedup
+import urlinput
+
+
+CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+# the crawl log of the library API, silent unless the application configures logging
+logging.getLogger(config.LOG_NAME).addHandler(logging.NullHandler())
+
+
+class DownloadError(Exception):
+    """
+    Raised when an opened image URL cannot be stored, the message being the log message for the URL.
+    Transient errors (e.g. a connection reset while receiving) are worth a retry, which continues the partially
+    received image if the error keeps it.
+    """
+    def __init__(self, message, transient=False, partial=None):
+        super().__init__(message)
+        self.transient = transient
+        self.partial = partial
+
+
+class PartialDownload:
+    """
+    Start of an image kept after a failed transfer: the temporary file holding the received bytes and the validator
+    (strong ETag or Last-Modified) by which a retry asks for the rest only if the image did not change.
+    """
+    __slots__ = ('temporary', 'received', 'validator')
+
+    def __init__(self, temporary, received, validator):
+        self.temporary = temporary
+        self.received = received
+        self.validator = validator
+
+
+class Segment:
+    """
+    Byte range of an image received into its temporary file, from start to end (exclusive, None up to the end of the body),
+    position being the offset of the next byte to be received.
+    """
+    __slots__ = ('start', 'end', 'position')
+
+    def __init__(self, start, end=None):
+        self.start = start
+        self.end = end
+        self.position = start
+
+    def complete(self):
+        return self.end is not None and self.position >= self.end
+
+
+class CrawlResult:
+    """
+    Outcome of an URL of a crawl: the outcome category (one of the config.OUTCOME_* categories), HTTP status and size
+    of the image, and the number, name and location in the storage of a stored image.
+    """
+    __slots__ = ('url', 'outcome', 'status', 'size', 'number', 'name', 'location')
+
+    def __init__(self, url, outcome, status=None, size=0, number=None, name=None, location=None):
+        self.url = url
+        self.outcome = outcome
+        self.status = status
+        self.size = size
+        self.number = number
+        self.name = name
+        self.location = location
+
+    def record(self):
+        """
+        Returns the result as a JSON-serializable record.
+
+        :return: the record
+        :rtype: dict
+        """
+        return {'url': self.url, 'outcome': self.outcome, 'status': self.status, 'size': self.size,
+                'number': self.number, 'location': self.location}
+
+    @property
+    def stored(self):
+        return self.outcome == config.OUTCOME_DOWNLOADED
+
+    def __repr__(self):
+        return 'CrawlResult(%r, %r, status=%r, size=%r, name=%r)' % (self.url, self.outcome, self.status, self.size, self.name)
 
 
 class ImgCrawler:
     """
-    Image crawler for batch downloading images given by a list of URLs read from a plaintext file.
+    Image crawler for batch downloading images given by a list of URLs read from a plaintext file,
+    or by any iterable of URLs through crawl.
     """
 
+    def __init__(self, workers=config.DEFAULT_WORKERS, host_workers=config.DEFAULT_HOST_WORKERS, robots_cache=None, pool=None,
+                 max_bytes=None, resume=False, storage=config.STORAGE_FLAT, manifest=None, dedup=config.DEDUP_OFF,
+                 dedup_capacity=config.DEDUP_CAPACITY, dedup_error_rate=config.DEDUP_ERROR_RATE, delay=config.DEFAULT_CRAWL_DELAY,
+                 retries=config.DEFAULT_RETRIES, backoff=None, breaker=None, shard=None, metrics=None, async_log=False,
+                 min_size=None, max_size=None, controller=None, bandwidth=None, segments=config.DEFAULT_SEGMENTS,
+                 segment_threshold=config.DEFAULT_SEGMENT_THRESHOLD, near_duplicates=None, profiler=None, trace_memory=None):
+        """
+        Image crawler constructor. Sets the limits for concurrent downloads and image sizes, the robots.txt cache
+        and the connection pool, both of which are kept between calls of download_images.
+
+        :param workers: optional number of images downloaded concurrently, defaults to config.DEFAULT_WORKERS
+        :type workers: int
+        :param host_workers: optional number of concurrent downloads from the same host, defaults to config.DEFAULT_HOST_WORKERS
+        :type host_workers: int
+        :param robots_cache: optional cache of robots.txt rules, defaults to an in-memory cache with default limits
+        :type robots_cache: robotscache.RobotsCache
+        :param pool: optional pool of persistent HTTP connections, defaults to a pool with default limits
+        :type pool: connectionpool.ConnectionPool
+        :param max_bytes: optional maximal image size in bytes, larger images are not stored, defaults to no limit
+        :type max_bytes: int
+        :param resume: optional flag whether to continue the crawl recorded in the journal next to the log file, defaults to False
+        :type resume: bool
+        :param storage: optional name of the storage for the images, one of storage.STORAGES, defaults to config.STORAGE_FLAT
+        :type storage: str
+        :param manifest: optional record of downloaded images, enabling conditional requests for images stored before
+        :type manifest: manifest.Manifest
+        :param dedup: optional mode of skipping repeated URLs, one of urldedup.DEDUPLICATORS, defaults to config.DEDUP_OFF
+        :type dedup: str
+        :param dedup_capacity: optional expected number of URLs for the Bloom filter, defaults to config.DEDUP_CAPACITY
+        :type dedup_capacity: int
+        :param dedup_error_rate: optional false positive rate of the Bloom filter, defaults to config.DEDUP_ERROR_RATE
+        :type dedup_error_rate: float
+        :param delay: optional minimal seconds between requests to the same host, robots.txt may ask for more,
+                      defaults to config.DEFAULT_CRAWL_DELAY
+        :type delay: int, float
+        :param retries: optional number of retries of requests failing transiently, defaults to config.DEFAULT_RETRIES
+        :type retries: int
+        :param backoff: optional backoff between retries, defaults to exponential backoff with default limits
+        :type backoff: retry.Backoff
+        :param breaker: optional per-host circuit breaker, defaults to a breaker with default limits
+        :type breaker: retry.CircuitBreaker
+        :param shard: optional zero-based index and number of shards, only the hosts of the shard are crawled and the image
+                      numbers are unique among the shards, defaults to crawling all URLs
+        :type shard: tuple
+        :param metrics: optional recorder of the phase timings and outcomes of the URLs, defaults to no metrics
+        :type metrics: metrics.MetricsRecorder
+        :param async_log: optional flag whether log entries are written in batches by a background thread, defaults to False
+        :type async_log: bool
+        :param min_size: optional minimal width and height of the images, smaller images are not stored, defaults to no limit
+        :type min_size: tuple
+        :param max_size: optional maximal width and height of the images, larger images are not stored, defaults to no limit
+        :type max_size: tuple
+        :param controller: optional adaptive limits of the concurrent downloads overall and per host, bounded by workers and
+                           host_workers, defaults to the fixed limits
+        :type controller: pacing.AimdController
+        :param bandwidth: optional limit of the bytes per second received by all downloads together, defaults to no limit
+        :type bandwidth: pacing.TokenBucket
+        :param segments: optional number of byte ranges of a large image fetched in parallel, 1 fetches images in one piece,
+                         defaults to config.DEFAULT_SEGMENTS
+        :type segments: int
+        :param segment_threshold: optional minimal size in bytes of the images fetched in segments, defaults to config.DEFAULT_SEGMENT_THRESHOLD
+        :type segment_threshold: int
+        :param near_duplicates: optional detector of near duplicates among the images by their perceptual hashes, defaults to none
+        :type near_duplicates: perceptual.NearDuplicates
+        :param profiler: optional profiler of the download threads, started and stopped by the caller, defaults to none
+        :type profiler: profiling.Profiler
+        :param trace_memory: optional seconds between logged snapshots of the memory allocations, defaults to no tracing
+        :type trace_memory: float
+        :return:
+        """
+        if workers < 1 or host_workers < 1 or segments < 1:
+            raise ValueError('worker and segment counts must be positive')
+        if delay < 0 or retries < 0:
+            raise ValueError('delay and retries must not be negative')
+        if shard is not None and not 0 <= shard[0] < shard[1]:
+            raise ValueError('shard index must be between 0 and the number of shards')
+        if max_bytes is not None and max_bytes < 0:
+            raise ValueError('maximal image size must not be negative')
+        if trace_memory is not None and trace_memory <= 0:
+            raise ValueError('memory tracing interval must be positive')
+
+        self.workers = workers
+        self.host_workers = host_workers
+        self.delay = delay
+        self.max_bytes = max_bytes
+        self.resume = resume
+        self.storage = storage
+        self.manifest = manifest
+        self.dedup = dedup
+        self.dedup_capacity = dedup_capacity
+        self.dedup_error_rate = dedup_error_rate
+        self.download_count = 0
+        self.duplicates = 0
+        self.duplicate_bytes = 0
+        self.not_modified = 0
+        self.not_modified_bytes = 0
+        self.duplicate_urls = 0
+        self.retries = retries
+        self.shard = shard
+        self.metrics = metrics
+        self.async_log = async_log
+        self.min_size = min_size
+        self.max_size = max_size
+        self.controller = controller
+        self.bandwidth = bandwidth
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.rejected = 0
+        self.rejected_saved_bytes = 0
+        self.resumed = 0
+        self.resumed_bytes = 0
+        self.segmented = 0
+        self.near_duplicates = near_duplicates
+        self.near_duplicate_count = 0
+        self.near_duplicate_bytes = 0
+        self.profiler = profiler
+        self.trace_memory = trace_memory
+        # seconds spent in the stages of the crawls, reported on demand
+        self.stages = profiling.StageCounters()
+        self.retried = 0
+        self.backoff = retry.Backoff() if backoff is None else backoff
+        self.breaker = retry.CircuitBreaker() if breaker is None else breaker
+        self.robots_cache = robotscache.RobotsCache() if robots_cache is None else robots_cache
+        self.pool = connectionpool.ConnectionPool() if pool is None else pool
+
+        self._lock = threading.Lock()
+        self._buffers = threading.local()
+        self._dashboard = None
+
+    def crawl(self, urls, sink, log_file=None, progress=None):
+        """
+        Downloads the images of URLs from any iterable, yielding the result of each URL as soon as it is processed
+        (not necessarily in the order of the URLs). The images are handed to the sink, either a storage of the storage
+        module or a function called with the URL, image name and content of each image by the worker threads.
+        Errors which abort the crawl are raised. Stopping the iteration early stops the crawl after the running downloads.
+        URLs read from a URL file (urlinput.UrlSource) are logged with their file, may be deduplicated by sorting it,
+        recorded in a journal and shown on a progress display.
+
+        :param urls: the URLs of the images
+        :type urls: iterable of str, urlinput.UrlSource
+        :param sink: storage receiving the images, or a function receiving their contents
+        :type sink: storage.FlatStorage, callable
+        :param log_file: optional file name or path to the log file, defaults to the imgcrawl logger
+        :type log_file: str
+        :param progress: optional journal of a crawl of a URL file, which continues behind the URLs it records and
+                         shows the progress, defaults to neither
+        :type progress: journal.Journal
+        :return: the results of the URLs
+        :rtype: generator of CrawlResult
+        """
+        store = sink if isinstance(sink, storage.FlatStorage) else storage.CallbackStorage(sink)
+        logger = self.setup_log(log_file) if log_file is not None else logging.getLogger(config.LOG_NAME)
+        source = urls if isinstance(urls, urlinput.UrlSource) else None
+        try:
+            if source is not None:
+                logger.info(config.LOG_INITIAL_MESSAGE, source.url_file, store.directory)
+            with urldedup.create(self.dedup, source.url_file if source is not None else None, self.dedup_capacity,
+                                 self.dedup_error_rate) as deduplicator:
+                if source is None:
+                    yield from self._run(((line, None, url) for line, url in enumerate(urls)), store, logger, deduplicator)
+                    return
+                bar = None
+                if progress is not None:
+                    # continue behind the urls processed by an interrupted crawl, keeping the image numbers
+                    self.download_count = progress.count
+                    source.seek(progress.offset, progress.lines)
+                    bar = progressbar.Dashboard(source.estimate(), progress.lines)
+                entries = ((source.lines - 1, source.offset, url) for url in source)
+                yield from self._run(entries, store, logger, deduplicator, progress, bar, source.estimate)
+        finally:
+            if log_file is not None:
+                self.shutdown_log(logger)
+
     def _download_images(self, url_file, destination_dir, log_file):
         """
-        Internal implementation of the image downloading. Opens the URLs file and iterates over each URL.
+        Internal implementation of the image downloading, a crawl of the URLs file read once, continuing an interrupted
+        crawl recorded in the journal next to the log file and showing the progress.
 
-        :param url_file: file name or path to the file with URLs
+        :param url_file: file name or path to the (compressed) file with URLs, '-' for the standard input
         :type url_file: str
         :param destination_dir: path to directory in which to store the images
         :type destination_dir: str
@@ -31,70 +312,852 @@ class ImgCrawler:
         :type log_file: str
         :return:
         """
-        logger = self.setup_log(log_file)
-        logger.info(config.LOG_INITIAL_MESSAGE % (url_file, destination_dir))
-
-        with open(url_file) as urls:
-            for i, l in enumerate(urls):
+        with urlinput.UrlSource(url_file) as urls, journal.Journal(log_file + config.JOURNAL_SUFFIX, self.resume) as progress, \
+                storage.create(self.storage, destination_dir) as store:
+            for result in self.crawl(urls, store, log_file, progress):
                 pass
-        bar = progressbar.ProgressBar(i + 1)
-
-        download_count = 0
-
-        # opening the url file and reading the urls
-        with open(url_file, 'r') as urls:
-            for i, url in enumerate(urls):
-                bar.set(i)
-
-                url = url.strip()
-                components = urllib.parse.urlparse(url)
-                if not (components.scheme and components.netloc and components.path):
-                    logger.error('%s: "%s"' % (config.LOG_URL_INVALID, self.truncate_middle(url, config.MAX_URL)))
-                    continue
-            
-                # check whether the robots.txt allows us to crawl this URL
-                try:
-                    can_fetch = self.download_allowed(url, components.scheme, components.netloc)
-                except (AttributeError, urllib.error.URLError, ValueError):
-                    logger.error('%s: %s' % (config.LOG_ERROR_ROBOTS, self.truncate_middle(url, config.MAX_URL)))
-                    continue
-
-                # log that image download is disallowed
-                if not can_fetch:
-                    logger.error('%s: %s' % (config.LOG_DISALLOWED, self.truncate_middle(url, config.MAX_URL)))
-                    continue
-                
-                # open image url
+
+    def _run(self, entries, store, logger, deduplicator, progress=None, bar=None, estimate=None):
+        """
+        Hands the URLs to a pool of worker threads, keeping at most a bounded window of URLs queued per host so memory
+        stays independent of the number of URLs, and yields the result of each URL once it is processed.
+        Logs the summary of the crawl and keeps the robots.txt rules and image validators once all URLs are processed.
+
+        :param entries: the zero-based line number, the byte offset behind the line (None if unknown) and the URL of each URL
+        :type entries: iterator of tuple
+        :param store: storage for the images
+        :type store: storage.FlatStorage
+        :param logger: logger object for the download protocol
+        :type logger: logging.Logger
+        :param deduplicator: detector of repeated URLs
+        :type deduplicator: urldedup.Deduplicator
+        :param progress: optional journal of the crawl, defaults to not recording the processed URLs
+        :type progress: journal.Journal
+        :param bar: optional progress display, defaults to no display
+        :type bar: progressbar.Dashboard
+        :param estimate: optional function returning the estimated number of URLs for the progress display
+        :type estimate: callable
+        :return: the results of the URLs
+        :rtype: generator of CrawlResult
+        """
+        statistics = self.statistics()
+        if self.metrics is not None:
+            self.metrics.begin()
+        if self.robots_cache.load_error is not None:
+            logger.warning(config.LOG_ROBOTS_CACHE_IGNORED, self.robots_cache.path, self.robots_cache.load_error)
+            self.robots_cache.load_error = None
+        # number the images behind those of earlier crawls, which are kept when they did not change or appended to a pack
+        highest = store.highest_number()
+        if self.manifest is not None:
+            highest = max(highest, self.manifest.highest_number())
+        self.download_count = max(self.download_count, self._numbered_before(highest))
+
+        # reading the urls once into per-host queues while handing them to the workers by politeness of their hosts,
+        # progress is tracked by completed urls
+        completed = lines = progress.lines if progress is not None else 0
+        if bar is not None:
+            self._dashboard = bar
+            logger.addFilter(bar.count_errors)
+        hosts = scheduler.HostScheduler(self.host_workers, self.delay, self.controller)
+        pending = {}
+        exhausted = False
+        download_image = self._download_image if self.profiler is None else self.profiler.wrap(self._download_image)
+        tracer = profiling.MemoryTracer(self.trace_memory, logger) if self.trace_memory is not None else None
+        if tracer is not None:
+            tracer.start()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
                 try:
-                    url_response = urllib.request.urlopen(url)
-                except urllib.error.URLError as error:
-                    logger.error('%s: %s' % (config.LOG_ERROR_OPENING, self.truncate_middle(url, config.MAX_URL)))
-                    continue
-
-                # check whether the URL content is an image 
-                if url_response.info().get_content_maintype().lower() != config.IMAGE_MIMETYPE:
-                    logger.error('%s: %s' % (config.LOG_NOT_AN_IMAGE, self.truncate_middle(url, config.MAX_URL)))
-                    continue
-                
-                # retrieve the content and store in the destination directory
-                os.makedirs(destination_dir, exist_ok=True) 
-                image_name = '%s_%s' % (download_count + 1, os.path.basename(url))
-                with open(os.path.join(destination_dir, image_name), 'wb') as image_file:
-                    try:
-                        image_file.write(url_response.read())
-                    except urllib.error.URLError as error:
-                        logger.error('%s: %s' % (config.LOG_ERROR_DOWNLOADING, self.truncate_middle(url, config.MAX_URL)))
-                        continue
-                
-                # log download and increment the counter
-                logger.info('%s %s, url: %s' % (config.LOG_DOWNLOADED, self.truncate_middle(image_name, config.MAX_FILE_NAME), self.truncate_middle(url, config.MAX_URL)))
-                download_count += 1
+                    while True:
+                        # keep a bounded window of urls queued, so hosts can be interleaved
+                        while not exhausted and len(hosts) < config.SCHEDULER_WINDOW:
+                            with self.stages.stage('read'):
+                                entry = next(entries, None)
+                            if entry is None:
+                                exhausted = True
+                                break
+                            line, offset, url = entry
+                            lines = line + 1
+                            # leave the hosts of other shards to them
+                            if self.shard is not None and sharding.shard_of(url.strip(), self.shard[1]) != self.shard[0]:
+                                if progress is not None:
+                                    progress.skip(line, offset)
+                                completed += 1
+                                continue
+                            if progress is not None and progress.completed(line, url.strip()):
+                                completed += 1
+                                continue
+                            # skip repeated urls
+                            with self.stages.stage('dedup'):
+                                duplicate = deduplicator.duplicate(line, url.strip())
+                            if duplicate:
+                                self.duplicate_urls += 1
+                                logger.info('%s: %s', config.LOG_DUPLICATE_URL, asynclog.Truncated(url.strip(), config.MAX_URL))
+                                timing = metrics.Timing(url.strip(), urllib.parse.urlparse(url.strip()).netloc.lower(), config.OUTCOME_DUPLICATE_URL)
+                                if self.metrics is not None:
+                                    self.metrics.record(timing)
+                                if progress is not None:
+                                    progress.record(line, offset, url.strip())
+                                completed += 1
+                                yield CrawlResult(url.strip(), timing.outcome)
+                                continue
+                            with self.stages.stage('schedule'):
+                                hosts.add(urllib.parse.urlparse(url.strip()).netloc.lower(), (line, offset, url))
+                                # resolve the hosts of the queued urls before they are requested
+                                self.pool.prefetch(url.strip())
+
+                        # start the urls of the hosts which may be requested
+                        wait = None
+                        with self.stages.stage('schedule'):
+                            while len(pending) < (self.workers if self.controller is None else self.controller.limit()):
+                                host, item = hosts.pop(time.monotonic())
+                                if host is None:
+                                    wait = item
+                                    break
+                                pending[executor.submit(download_image, item[2], store, logger)] = item + (host,)
+
+                        if not pending:
+                            if exhausted and not len(hosts):
+                                break
+                            time.sleep(wait)
+                            continue
+
+                        with self.stages.stage('collect'):
+                            results = self._collect(pending, progress, hosts, wait)
+                        completed += len(results)
+                        if bar is not None:
+                            with self.stages.stage('progress'):
+                                self._update_bar(bar, completed, lines if exhausted else max(estimate(), lines), len(pending))
+                        yield from results
+                except BaseException:
+                    # do not start queued downloads once an unrecoverable error occurred or the results are not needed anymore
+                    for future in pending:
+                        future.cancel()
+                    if bar is not None:
+                        bar.close()
+                    raise
+        finally:
+            if bar is not None:
+                logger.removeFilter(bar.count_errors)
+                self._dashboard = None
+            if tracer is not None:
+                tracer.stop()
 
         # set the progress bar to 100 percent and print a comment and new line for the returning prompt
-        bar.complete('completed')
+        if bar is not None:
+            bar.resize(lines)
+            bar.complete('completed')
+
+        # summarize the crawl and keep the robots.txt rules, image validators and perceptual hashes for the next one
+        if self.near_duplicates is not None:
+            self.near_duplicates.wait()
+        current = self.statistics()
+        logger.info(config.LOG_SUMMARY, {name: current[name] - statistics[name] for name in current})
+        self.robots_cache.save()
+        if self.manifest is not None:
+            self.manifest.commit()
+        if self.near_duplicates is not None:
+            self.near_duplicates.save()
+        if self.metrics is not None:
+            self.metrics.finish()
+
+    def statistics(self):
+        """
+        Returns the counters of the crawler since its creation, the summary of a crawl logs their difference.
+
+        :return: counter values by name
+        :rtype: dict
+        """
+        return {'robots_hits': self.robots_cache.hits,
+                'robots_misses': self.robots_cache.misses,
+                'dns_hits': self.pool.resolver.hits,
+                'dns_misses': self.pool.resolver.misses,
+                'requests': self.pool.requests,
+                'connections': self.pool.opened,
+                'duplicates': self.duplicates,
+                'duplicate_bytes': self.duplicate_bytes,
+                'not_modified': self.not_modified,
+                'not_modified_bytes': self.not_modified_bytes,
+                'duplicate_urls': self.duplicate_urls,
+                'retries': self.retried,
+                'breaker_rejected': self.breaker.rejected,
+                'rejected': self.rejected,
+                'rejected_saved_bytes': self.rejected_saved_bytes,
+                'resumed': self.resumed,
+                'resumed_bytes': self.resumed_bytes,
+                'segmented': self.segmented,
+                'near_duplicates': self.near_duplicate_count,
+                'near_duplicate_bytes': self.near_duplicate_bytes}
+
+    def _update_bar(self, bar, completed, total, active):
+        if total != bar.max_value:
+            bar.resize(total)
+        bar.set(completed, active)
+
+    def _collect(self, pending, progress, hosts, timeout=None):
+        """
+        Waits for downloads to finish, or until the timeout when the next host becomes ready, releases their hosts
+        and records them in the journal, re-raising errors which should abort the whole crawl (e.g. a full disk).
+
+        :param pending: running download tasks mapped to their line number, byte offset behind the line, URL and host
+        :type pending: dict
+        :param progress: journal of the crawl, None if the crawl is not recorded
+        :type progress: journal.Journal
+        :param hosts: scheduler of the hosts
+        :type hosts: scheduler.HostScheduler
+        :param timeout: optional maximal seconds to wait, defaults to waiting for the first download
+        :type timeout: float
+        :return: the results of the collected downloads
+        :rtype: list of CrawlResult
+        """
+        done, not_done = concurrent.futures.wait(pending, timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+        results = []
+        for future in done:
+            number, result = future.result()
+            line, offset, url, host = pending.pop(future)
+            hosts.done(host, self.host_delay(url.strip()))
+            if progress is not None:
+                progress.record(line, offset, url.strip(), number)
+            results.append(result)
+        return results
+
+    def host_delay(self, url):
+        """
+        Returns the seconds between requests to the host of an URL, as requested by the Crawl-delay or
+        Request-rate of its cached robots.txt, but not less than the configured delay.
+
+        :param url: an URL of the host
+        :type url: str
+        :return: the delay in seconds
+        :rtype: float
+        """
+        components = urllib.parse.urlparse(url)
+        if not (components.scheme and components.netloc):
+            return 0.0
+
+        delay = self.delay
+        entry = self.robots_cache.get(components.scheme, components.netloc)
+        if entry is not None and entry.reachable:
+            rules = entry.parser()
+            crawl_delay = rules.crawl_delay(config.USER_AGENT)
+            request_rate = rules.request_rate(config.USER_AGENT)
+            if crawl_delay:
+                delay = max(delay, float(crawl_delay))
+            if request_rate and request_rate.requests:
+                delay = max(delay, request_rate.seconds / request_rate.requests)
+        return min(delay, max(config.MAX_CRAWL_DELAY, self.delay))
+
+    def _next_image_number(self):
+        """
+        Reserves the next image number. Numbers are only handed out for completely received images,
+        so the stored files are numbered without gaps regardless of the number of workers.
+
+        :return: the number for the image
+        :rtype: int
+        """
+        with self._lock:
+            self.download_count += 1
+            return self.download_count
+
+    def image_number(self, number):
+        """
+        Returns the number in the name of an image. The images of shards are numbered interleaved,
+        the n-th image of shard i of N getting the number (n - 1) * N + i + 1, so the names are unique among the shards.
+
+        :param number: the number of the image among the images of the crawl
+        :type number: int
+        :return: the number for the image name
+        :rtype: int
+        """
+        if self.shard is None:
+            return number
+        index, count = self.shard
+        return (number - 1) * count + index + 1
+
+    def _download_image(self, url, store, logger):
+        """
+        Downloads a single image into the storage and logs the outcome, timing its phases for the metrics.
+        Runs in a worker thread.
+
+        :param url: the URL of the image, possibly including the line break
+        :type url: str
+        :param store: storage for the images
+        :type store: storage.FlatStorage
+        :param logger: logger object for the download protocol
+        :type logger: logging.Logger
+        :return: the number of the stored image among the images of the crawl (None if no image was stored) and the result
+        :rtype: tuple
+        """
+        timing = metrics.start(url.strip(), urllib.parse.urlparse(url.strip()).netloc.lower())
+        try:
+            number = self._download(url.strip(), store, logger)
+        finally:
+            metrics.stop()
+            self.stages.record(timing)
+            if self.metrics is not None:
+                self.metrics.record(timing)
+
+        result = CrawlResult(timing.url, timing.outcome, timing.status, timing.size)
+        if number is not None:
+            result.number = self.image_number(number)
+            result.name = self.image_name(number, timing.url)
+            result.location = store.location(result.name)
+        return number, result
+
+    def _numbered_before(self, highest):
+        """
+        Returns the count of images of the crawl after which the image numbers are above a number, the inverse of
+        image_number.
+
+        :param highest: the highest image number in use
+        :type highest: int
+        :return: the count of images
+        :rtype: int
+        """
+        if self.shard is None:
+            return highest
+        index, count = self.shard
+        return max((highest - index - 1) // count + 1, 0)
+
+    def image_name(self, number, url):
+        """
+        Returns the name of a stored image.
+
+        :param number: the number of the image among the images of the crawl
+        :type number: int
+        :param url: the URL of the image
+        :type url: str
+        :return: the image name
+        :rtype: str
+        """
+        return '%s_%s' % (self.image_number(number), os.path.basename(url))
+
+    def _download(self, url, store, logger):
+        """
+        Downloads a single image into the storage and logs the outcome.
+        Requests failing transiently are retried with backoff, the circuit breaker of the host counts their failures.
+        A retry asks only for the rest of an image whose transfer failed.
+
+        :param url: the URL of the image
+        :type url: str
+        :param store: storage for the images
+        :type store: storage.FlatStorage
+        :param logger: logger object for the download protocol
+        :type logger: logging.Logger
+        :return: the number of the stored image, None if no image was stored
+        :rtype: int
+        """
+        components = urllib.parse.urlparse(url)
+        if not (components.scheme and components.netloc and components.path):
+            metrics.outcome(config.OUTCOME_INVALID)
+            logger.error('%s: "%s"', config.LOG_URL_INVALID, asynclog.Truncated(url, config.MAX_URL))
+            return None
+
+        # check whether the robots.txt allows us to crawl this URL
+        try:
+            with metrics.phase('robots', opaque=True):
+                can_fetch = self.download_allowed(url, components.scheme, components.netloc)
+        except (AttributeError, urllib.error.URLError, ValueError):
+            metrics.outcome(config.OUTCOME_ROBOTS_ERROR)
+            logger.error('%s: %s', config.LOG_ERROR_ROBOTS, asynclog.Truncated(url, config.MAX_URL))
+            return None
+
+        # log that image download is disallowed
+        if not can_fetch:
+            metrics.outcome(config.OUTCOME_DISALLOWED)
+            logger.error('%s: %s', config.LOG_DISALLOWED, asynclog.Truncated(url, config.MAX_URL))
+            return None
+
+        # ask only for a changed image if it is stored from a previous crawl
+        entry = self.manifest.get(url) if self.manifest is not None else None
+        if entry is not None and not store.exists(entry.path):
+            entry = None
+
+        # retry transient failures with backoff, unless the host keeps failing
+        host = components.netloc.lower()
+        timing = metrics.current()
+        partial = None
+        attempt = 0
+        try:
+            while True:
+                if not self.breaker.allow(host):
+                    metrics.outcome(config.OUTCOME_HOST_FAILING)
+                    logger.error('%s: %s', config.LOG_HOST_FAILING, asynclog.Truncated(url, config.MAX_URL))
+                    return None
+                waited = timing.phases['ttfb'] if timing is not None else None
+                try:
+                    number = self._fetch(url, entry, store, logger, partial)
+                except (urllib.error.URLError, DownloadError) as error:
+                    if isinstance(error, DownloadError):
+                        partial = error.partial
+                    if not retry.transient(error):
+                        # the host answered, only the image is unavailable
+                        self.breaker.success(host)
+                        if self.controller is not None:
+                            self.controller.success(host)
+                    else:
+                        self.breaker.failure(host)
+                        if self.controller is not None:
+                            self.controller.congestion(host)
+                        if attempt < self.retries:
+                            with self._lock:
+                                self.retried += 1
+                            time.sleep(self.backoff.delay(attempt))
+                            attempt += 1
+                            continue
+                    if isinstance(error, DownloadError):
+                        message = error
+                    else:
+                        message = config.LOG_ERROR_OPENING
+                        metrics.outcome(config.OUTCOME_OPEN_ERROR, getattr(error, 'code', None))
+                    logger.error('%s: %s', message, asynclog.Truncated(url, config.MAX_URL))
+                    return None
+                self.breaker.success(host)
+                if self.controller is not None:
+                    self.controller.success(host, timing.phases['ttfb'] - waited if timing is not None else None)
+                return number
+        finally:
+            # the start of an image which the retries did not complete
+            if partial is not None and partial.temporary is not None:
+                os.remove(partial.temporary)
+
+    def _fetch(self, url, entry, store, logger, partial=None):
+        """
+        Requests an image once, stores it and logs the outcome, unless the request fails.
+        If the start of the image was kept from a failed transfer, only the rest is requested.
 
-        # release the logger handles
-        self.shutdown_log(logger)
+        :param url: the URL of the image
+        :type url: str
+        :param entry: the manifest entry of the image stored by a previous crawl, None if there is none
+        :type entry: manifest.ManifestEntry
+        :param store: storage for the images
+        :type store: storage.FlatStorage
+        :param logger: logger object for the download protocol
+        :type logger: logging.Logger
+        :param partial: optional start of the image kept from a failed transfer
+        :type partial: PartialDownload
+        :return: the number of the stored image, None if no image was stored
+        :rtype: int
+        :raises urllib.error.URLError: if the image URL could not be opened
+        :raises DownloadError: if the image could not be received
+        """
+        # open image url, asking for the rest of a partially received image unless it changed
+        headers = entry.headers() if entry is not None else {}
+        if partial is not None:
+            headers.update({'Range': 'bytes=%d-' % partial.received, 'If-Range': partial.validator})
+        url_response = self.pool.urlopen(url, headers or None)
+
+        with url_response:
+            # keep the stored image if it did not change, a server answering an unconditional request so sent no image
+            if url_response.status == http.HTTPStatus.NOT_MODIFIED and entry is None:
+                metrics.outcome(config.OUTCOME_DOWNLOAD_ERROR, url_response.status)
+                raise DownloadError(config.LOG_ERROR_DOWNLOADING)
+            if url_response.status == http.HTTPStatus.NOT_MODIFIED:
+                metrics.outcome(config.OUTCOME_NOT_MODIFIED, url_response.status)
+                with self._lock:
+                    self.not_modified += 1
+                    self.not_modified_bytes += entry.size
+                logger.info('%s %s, url: %s', config.LOG_NOT_MODIFIED, asynclog.Truncated(os.path.basename(entry.path), config.MAX_FILE_NAME), asynclog.Truncated(url, config.MAX_URL))
+                return None
+
+            # check whether the URL content is an image
+            if url_response.info().get_content_maintype().lower() != config.IMAGE_MIMETYPE:
+                metrics.outcome(config.OUTCOME_NOT_AN_IMAGE, url_response.status)
+                logger.error('%s: %s', config.LOG_NOT_AN_IMAGE, asynclog.Truncated(url, config.MAX_URL))
+                return None
+
+            # stream the content into a temporary file of the storage
+            temporary, size, digest = self._receive(url_response, store, partial)
+            etag, last_modified = url_response.getheader('ETag'), url_response.getheader('Last-Modified')
+            status = url_response.status
+
+        # compare the image to the images stored before by its perceptual hash, waiting for it only to skip near duplicates
+        match = slot = None
+        if self.near_duplicates is not None and self.near_duplicates.skip:
+            try:
+                match, slot = self.near_duplicates.check(temporary)
+            except BaseException:
+                os.remove(temporary)
+                raise
+            if match is not None:
+                self._near_duplicate(size, url, logger, *match)
+                os.remove(temporary)
+                metrics.outcome(config.OUTCOME_NEAR_DUPLICATE, status, size)
+                return None
+
+        # give the complete image its final name
+        number = self._next_image_number()
+        image_name = self.image_name(number, url)
+        if slot is not None:
+            self.near_duplicates.label(slot, self.image_number(number))
+        elif self.near_duplicates is not None and not self.near_duplicates.skip:
+            try:
+                self.near_duplicates.submit(temporary, self.image_number(number), functools.partial(self._near_duplicate, size, url, logger))
+            except BaseException:
+                os.remove(temporary)
+                raise
+        with metrics.phase('write'):
+            duplicate = store.store(temporary, image_name, url, digest, size, self.image_number(number))
+        if duplicate:
+            with self._lock:
+                self.duplicates += 1
+                self.duplicate_bytes += size
+
+        # remember the validators for conditional requests of the next crawl, the changed image replaces the stored one
+        if self.manifest is not None and (etag or last_modified):
+            self.manifest.put(url, etag, last_modified, size, store.location(image_name), self.image_number(number))
+        if entry is not None and entry.path != store.location(image_name):
+            store.remove(entry.path)
+
+        # log download
+        metrics.outcome(config.OUTCOME_DOWNLOADED, status, size)
+        dashboard = self._dashboard
+        if dashboard is not None:
+            dashboard.add(size)
+        logger.info('%s %s, url: %s', config.LOG_DOWNLOADED, asynclog.Truncated(image_name, config.MAX_FILE_NAME), asynclog.Truncated(url, config.MAX_URL))
+        return number
+
+    def _near_duplicate(self, size, url, logger, number, distance):
+        """
+        Counts and logs a near duplicate, called by the download worker or once the background hash is compared.
+
+        :param size: the size of the image in bytes
+        :type size: int
+        :param url: the image URL
+        :type url: str
+        :param logger: the logger
+        :type logger: logging.Logger
+        :param number: the number of the nearest stored image
+        :type number: int
+        :param distance: the number of differing hash bits
+        :type distance: int
+        :return:
+        """
+        with self._lock:
+            self.near_duplicate_count += 1
+            self.near_duplicate_bytes += size
+        logger.info(config.LOG_NEAR_DUPLICATE + ', url: %s', number, distance, asynclog.Truncated(url, config.MAX_URL))
+
+    def _buffer(self):
+        """
+        Returns the receive buffer of the calling worker thread, allocated once per thread
+        so the memory used for downloads does not depend on the image sizes.
+
+        :return: a writable view of the buffer
+        :rtype: memoryview
+        """
+        buffer = getattr(self._buffers, 'view', None)
+        if buffer is None:
+            buffer = self._buffers.view = memoryview(bytearray(config.CHUNK_SIZE))
+        return buffer
+
+    def _receive(self, url_response, store, partial=None):
+        """
+        Streams the response body in chunks into a temporary file, which is removed again if the download fails.
+        A partial response continues the temporary file kept from a failed transfer. Large bodies of hosts accepting byte
+        ranges are received in segments fetched in parallel. If the transfer fails transiently, the received start of the
+        body is kept for a retry, provided the host identified the image by a validator.
+        The download is aborted as soon as the announced or received size exceeds max_bytes, or as soon as the first bytes
+        show that the content is no image or has dimensions outside min_size and max_size.
+        The content is hashed while it is received if the storage needs the digest.
+
+        :param url_response: the opened response
+        :type url_response: connectionpool.PooledResponse
+        :param store: storage providing the temporary file
+        :type store: storage.FlatStorage
+        :param partial: optional start of the body kept from a failed transfer, whose temporary file is taken over
+        :type partial: PartialDownload
+        :return: path of the temporary file holding the complete body, its size and its hex digest (or None)
+        :rtype: tuple
+        :raises DownloadError: if the body is too large, no image or could not be received completely (transient)
+        """
+        try:
+            length = int(url_response.getheader('Content-Length'))
+        except (TypeError, ValueError):
+            length = None
+        start = 0
+        resumed = url_response.status == http.HTTPStatus.PARTIAL_CONTENT
+        if resumed:
+            content_range = CONTENT_RANGE.match(url_response.getheader('Content-Range') or '')
+            if content_range is not None:
+                start = int(content_range.group(1))
+                length = int(content_range.group(3)) if content_range.group(3) != '*' else None
+        etag = url_response.getheader('ETag')
+        validator = etag if etag and not etag.startswith('W/') else url_response.getheader('Last-Modified')
+        if validator is None and partial is not None:
+            validator = partial.validator
+
+        temporary = None
+        if partial is not None:
+            temporary, partial.temporary = partial.temporary, None
+        segments = []
+        # the start of the body, until it is known to be an image of fitting dimensions
+        head = bytearray() if not resumed else None
+        try:
+            # only the requested rest of the body continues the kept start
+            if resumed and (partial is None or content_range is None or start != partial.received):
+                metrics.outcome(config.OUTCOME_DOWNLOAD_ERROR, url_response.status)
+                raise DownloadError(config.LOG_ERROR_DOWNLOADING, True)
+            if self.max_bytes is not None and length is not None and length > self.max_bytes:
+                metrics.outcome(config.OUTCOME_TOO_LARGE, url_response.status)
+                raise DownloadError(config.LOG_TOO_LARGE)
+
+            if temporary is None:
+                descriptor, temporary = store.temporary()
+            else:
+                descriptor = os.open(temporary, os.O_WRONLY if resumed else os.O_WRONLY | os.O_TRUNC)
+            if resumed:
+                with self._lock:
+                    self.resumed += 1
+                    self.resumed_bytes += start
+
+            segments = self._segments(url_response, start, length, validator)
+            content_hash = hashlib.sha256() if store.needs_digest and not resumed and len(segments) == 1 else None
+            try:
+                head = self._receive_segments(url_response, descriptor, segments, head, content_hash, length, validator)
+            finally:
+                os.close(descriptor)
+
+            received = self._received(segments)
+            if head is not None:
+                self._inspect(head, True, url_response, length, received)
+            if length is not None and received != length:
+                metrics.outcome(config.OUTCOME_DOWNLOAD_ERROR, url_response.status)
+                raise DownloadError(config.LOG_ERROR_DOWNLOADING, True)
+        except BaseException as error:
+            if temporary is not None:
+                # keep the received start of an image for the retry of a transient failure
+                kept = self._received(segments) if segments and head is None and validator is not None and \
+                    isinstance(error, DownloadError) and error.transient else 0
+                if kept:
+                    os.truncate(temporary, kept)
+                    error.partial = PartialDownload(temporary, kept, validator)
+                else:
+                    os.remove(temporary)
+            raise
+
+        if store.needs_digest and content_hash is None:
+            content_hash = self._digest(temporary)
+        return temporary, received, content_hash.hexdigest() if content_hash is not None else None
+
+    def _segments(self, url_response, start, length, validator):
+        """
+        Divides the rest of a body into the byte ranges fetched in parallel. The body is received in one piece
+        unless it is large, the host accepts byte ranges and identifies the image by a validator (so all ranges
+        are known to be of the same image), and the host asks for no delay between requests.
+
+        :param url_response: the opened response
+        :type url_response: connectionpool.PooledResponse
+        :param start: the offset of the response body in the image
+        :type start: int
+        :param length: the size of the image, None if unknown
+        :type length: int
+        :param validator: the strong ETag or Last-Modified of the image, None if there is none
+        :type validator: str
+        :return: the segments, the first one being received from the response
+        :rtype: list of Segment
+        """
+        if self.segments < 2 or length is None or length - start < self.segment_threshold or validator is None or \
+                (url_response.getheader('Accept-Ranges') or '').lower() != 'bytes' or self.host_delay(url_response.url):
+            return [Segment(start)]
+        size = -(-(length - start) // self.segments)
+        with self._lock:
+            self.segmented += 1
+        return [Segment(offset, min(offset + size, length)) for offset in range(start, length, size)]
+
+    def _receive_segments(self, url_response, descriptor, segments, head, content_hash, length, validator):
+        """
+        Receives the segments of a body into the temporary file, the first one from the response and the others
+        by range requests in parallel. A failing segment stops the others.
+
+        :param url_response: the opened response
+        :type url_response: connectionpool.PooledResponse
+        :param descriptor: the temporary file
+        :type descriptor: int
+        :param segments: the byte ranges of the body
+        :type segments: list of Segment
+        :param head: the start of the body received so far, None if the content is checked
+        :type head: bytearray
+        :param content_hash: optional hash updated by the received bytes, only for a body received in one piece
+        :type content_hash: hashlib.sha256
+        :param length: the size of the image, None if unknown
+        :type length: int
+        :param validator: the strong ETag or Last-Modified of the image, None if there is none
+        :type validator: str
+        :return: the head left to be checked, None if the content is checked
+        :rtype: bytearray
+        :raises DownloadError: if the body is too large, no image or a segment could not be received (transient)
+        """
+        if len(segments) == 1:
+            return self._stream(url_response, descriptor, segments[0], head, content_hash, length)
+
+        os.ftruncate(descriptor, length)
+        abort = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(len(segments) - 1, thread_name_prefix='segment') as executor:
+            futures = [executor.submit(self._fetch_segment, url_response.url, segment, validator, descriptor, abort)
+                       for segment in segments[1:]]
+            try:
+                head = self._stream(url_response, descriptor, segments[0], head, content_hash, length, abort)
+                for future in futures:
+                    future.result()
+            except DownloadError as error:
+                abort.set()
+                if error.transient:
+                    metrics.outcome(config.OUTCOME_DOWNLOAD_ERROR, url_response.status)
+                raise
+            except BaseException:
+                abort.set()
+                raise
+        return head
+
+    def _fetch_segment(self, url, segment, validator, descriptor, abort):
+        """
+        Receives a segment of a body by a range request into the temporary file. Runs in a thread of the download.
+
+        :param url: the URL of the image
+        :type url: str
+        :param segment: the byte range
+        :type segment: Segment
+        :param validator: the strong ETag or Last-Modified of the image
+        :type validator: str
+        :param descriptor: the temporary file
+        :type descriptor: int
+        :param abort: event set when another segment failed
+        :type abort: threading.Event
+        :return:
+        :raises DownloadError: if the segment could not be received or the image changed
+        """
+        try:
+            try:
+                segment_response = self.pool.urlopen(url, {'Range': 'bytes=%d-%d' % (segment.start, segment.end - 1), 'If-Range': validator})
+            except urllib.error.URLError as error:
+                raise DownloadError(config.LOG_ERROR_DOWNLOADING, retry.transient(error))
+            with segment_response:
+                # the whole body is sent if the image changed since the first request
+                content_range = CONTENT_RANGE.match(segment_response.getheader('Content-Range') or '')
+                if segment_response.status != http.HTTPStatus.PARTIAL_CONTENT or content_range is None or \
+                        int(content_range.group(1)) != segment.start:
+                    raise DownloadError(config.LOG_ERROR_DOWNLOADING, True)
+                self._stream(segment_response, descriptor, segment, None, None, None, abort)
+            if not segment.complete():
+                raise DownloadError(config.LOG_ERROR_DOWNLOADING, True)
+        except BaseException:
+            abort.set()
+            raise
+
+    def _stream(self, response, descriptor, segment, head, content_hash, length, abort=None):
+        """
+        Streams a response body in chunks into a segment of the temporary file, checking the head of the body.
+
+        :param response: the opened response
+        :type response: connectionpool.PooledResponse
+        :param descriptor: the temporary file
+        :type descriptor: int
+        :param segment: the byte range, its position is advanced by the received bytes
+        :type segment: Segment
+        :param head: the start of the body received so far, None if the content is checked
+        :type head: bytearray
+        :param content_hash: optional hash updated by the received bytes
+        :type content_hash: hashlib.sha256
+        :param length: the size of the image, None if unknown
+        :type length: int
+        :param abort: optional event stopping the transfer
+        :type abort: threading.Event
+        :return: the head left to be checked, None if the content is checked
+        :rtype: bytearray
+        :raises DownloadError: if the body is too large, no image or could not be received (transient)
+        """
+        buffer = self._buffer()
+        while not segment.complete():
+            if abort is not None and abort.is_set():
+                raise DownloadError(config.LOG_ERROR_DOWNLOADING, True)
+            view = buffer if segment.end is None else buffer[:min(len(buffer), segment.end - segment.position)]
+            try:
+                with metrics.phase('transfer'):
+                    count = response.readinto(view)
+            except (OSError, http.client.HTTPException):
+                metrics.outcome(config.OUTCOME_DOWNLOAD_ERROR, response.status)
+                raise DownloadError(config.LOG_ERROR_DOWNLOADING, True)
+            if not count:
+                break
+            if self.bandwidth is not None:
+                with metrics.phase('transfer'):
+                    self.bandwidth.consume(count)
+            received = segment.position + count
+            if self.max_bytes is not None and received > self.max_bytes:
+                metrics.outcome(config.OUTCOME_TOO_LARGE, response.status)
+                raise DownloadError(config.LOG_TOO_LARGE)
+            if head is not None:
+                head += view[:min(count, config.SNIFF_LIMIT - len(head))]
+                if len(head) >= config.SNIFF_BYTES and self._inspect(head, False, response, length, received):
+                    head = None
+            with metrics.phase('write'):
+                os.pwrite(descriptor, view[:count], segment.position)
+            segment.position = received
+            if content_hash is not None:
+                content_hash.update(view[:count])
+        return head
+
+    @staticmethod
+    def _received(segments):
+        # the bytes received without a gap from the start of the image
+        received = segments[0].position
+        for segment in segments:
+            received = segment.position
+            if not segment.complete():
+                break
+        return received
+
+    def _digest(self, temporary):
+        """
+        Hashes a received file, for bodies not received in order.
+
+        :param temporary: path of the file
+        :type temporary: str
+        :return: the hash
+        :rtype: hashlib.sha256
+        """
+        content_hash = hashlib.sha256()
+        buffer = self._buffer()
+        with open(temporary, 'rb') as handle:
+            for count in iter(lambda: handle.readinto(buffer), 0):
+                content_hash.update(buffer[:count])
+        return content_hash
+
+    def _inspect(self, head, complete, url_response, length, received):
+        """
+        Checks the start of a response body by its magic bytes and format header, counting the bytes left untransferred
+        if it is rejected.
+
+        :param head: the first bytes of the body
+        :type head: bytearray
+        :param complete: flag whether the head is the whole body
+        :type complete: bool
+        :param url_response: the opened response
+        :type url_response: connectionpool.PooledResponse
+        :param length: the announced size of the body, None if unknown
+        :type length: int
+        :param received: the number of bytes received so far
+        :type received: int
+        :return: whether the check is done, False if more bytes may tell the dimensions needed for the size limits
+        :rtype: bool
+        :raises DownloadError: if the content is no image or its dimensions are outside the limits
+        """
+        header = imagesniff.sniff(head)
+        # binary content of an unknown format is taken for an image of the declared type, of unknown dimensions
+        if header is None and imagesniff.binary(head):
+            header = imagesniff.ImageHeader(None)
+        if header is None or not header.fits(self.min_size, self.max_size):
+            with self._lock:
+                self.rejected += 1
+                self.rejected_saved_bytes += max(length - received, 0) if length is not None else 0
+            if header is None:
+                metrics.outcome(config.OUTCOME_NOT_AN_IMAGE, url_response.status)
+                raise DownloadError(config.LOG_NOT_AN_IMAGE)
+            metrics.outcome(config.OUTCOME_DIMENSIONS, url_response.status)
+            raise DownloadError(config.LOG_DIMENSIONS)
+        return complete or header.width is not None or (self.min_size is None and self.max_size is None) or \
+            len(head) >= config.SNIFF_LIMIT
 
     def download_images(self, url_file, destination_dir, log_file):
         """
@@ -131,44 +1194,87 @@ class ImgCrawler:
         :return: a flag indicating whether the download is allowed
         :rtype: bool
         """
-        robot = urllib.robotparser.RobotFileParser('%s://%s/%s' % (scheme, netloc, config.ROBOTS))
-        try:
-            robot.read()
-        except ValueError:
-            raise urllib.error.URLError('<urlopen error no protocol given>')
+        entry = self.robots_cache.lookup(scheme, netloc, lambda: self.fetch_robots(scheme, netloc))
+        if not entry.reachable:
+            raise urllib.error.URLError('<urlopen error robots.txt unreachable>')
 
-        return robot.can_fetch(config.USER_AGENT, url)
+        return entry.parser().can_fetch(config.USER_AGENT, url)
+
+    def fetch_robots(self, scheme, netloc):
+        """
+        Retrieves the robots.txt of a host, retrying timeouts, refused connections and overloaded servers with backoff.
+        Unreachable hosts result in an entry without status, so that they are cached as well for a short while
+        instead of being requested again for each of their URLs.
+
+        :param scheme: the URL scheme
+        :type scheme: str
+        :param netloc: the URL netloc
+        :type netloc: str
+        :return: the outcome of the retrieval
+        :rtype: robotscache.RobotsEntry
+        """
+        attempt = 0
+        while True:
+            try:
+                with self.pool.urlopen('%s://%s/%s' % (scheme, netloc, config.ROBOTS)) as response:
+                    return robotscache.RobotsEntry(response.status, response.read().decode('utf-8', 'replace').splitlines())
+            except ValueError:
+                raise urllib.error.URLError('<urlopen error no protocol given>')
+            except urllib.error.HTTPError as error:
+                entry, failure = robotscache.RobotsEntry(error.code), error
+            except urllib.error.URLError as error:
+                entry, failure = robotscache.RobotsEntry(None), error
+            except (OSError, http.client.HTTPException) as error:
+                entry, failure = robotscache.RobotsEntry(None), urllib.error.URLError(error)
+            if attempt >= self.retries or not retry.transient(failure):
+                return entry
+            with self._lock:
+                self.retried += 1
+            time.sleep(self.backoff.delay(attempt))
+            attempt += 1
 
-        
     def setup_log(self, log_file):
         """
         Creates a log object for protocolizing the image downloads.
         The log file will be created unter the name and path given by the log_file argument.
+        With asynchronous logging the entries are queued and written in batches by a background thread.
 
         :param log_file: file name or path to the log file
         :type log_file: str
         :return: logger object enabling writing log entries
         :rtype: logging.Logger
         """
-        directory = os.path.dirname(log_file)
-        if directory:
-            os.makedirs(directory, exist_ok=True)
-
         logger = logging.getLogger(log_file)
-        formatter = logging.Formatter(config.LOG_FORMAT)
-
-        file_handler = logging.FileHandler(log_file, mode='a')
-        file_handler.setFormatter(formatter)
-
         logger.setLevel(logging.INFO)
-        logger.addHandler(file_handler)
+        logger.addHandler(self.log_handler(log_file))
 
         return logger
 
+    def log_handler(self, log_file):
+        """
+        Creates the handler appending the log entries to the log file, writing them in batches from a background thread
+        with asynchronous logging. The time spent logging is counted for the log stage.
+
+        :param log_file: file name or path to the log file
+        :type log_file: str
+        :return: the handler, to be closed when the log is complete
+        :rtype: logging.Handler
+        """
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if self.async_log:
+            file_handler = asynclog.BatchingHandler(log_file)
+        else:
+            file_handler = logging.FileHandler(log_file, mode='a')
+        file_handler.setFormatter(logging.Formatter(config.LOG_FORMAT))
+        return profiling.TimedHandler(file_handler, self.stages)
+
     def shutdown_log(self, logger):
         """
-        Releases the log file handle(s) for a given logger
-        
+        Releases the log file handle(s) for a given logger, writing the queued entries of asynchronous logging first.
+
         :param logger: logger object with resource handles
         :type logger: logging.Logger
         :return:
@@ -178,29 +1284,147 @@ class ImgCrawler:
             handler.close()
 
     def truncate_middle(self, string, limit):
-        if len(string) <= limit:
-            return string
-        right = limit // 2 - 2
-        left = limit - right - 3
-        return '%s...%s' % (string[:left], string[-right:])
+        return str(asynclog.Truncated(string, limit))
+
+
+def positive(convert):
+    """
+    Returns an argument type converting a value and rejecting zero and negative numbers.
+
+    :param convert: the conversion of the value, e.g. int or float
+    :type convert: callable
+    :return: the argument type
+    :rtype: callable
+    """
+    def parse(value):
+        number = convert(value)
+        if number <= 0:
+            raise argparse.ArgumentTypeError(config.POSITIVE_ARGUMENT % value)
+        return number
+    # argparse names the conversion in its message for unconvertible values
+    parse.__name__ = convert.__name__
+    return parse
+
+
+def non_negative(convert):
+    """
+    Returns an argument type converting a value and rejecting negative numbers.
+
+    :param convert: the conversion of the value, e.g. int or float
+    :type convert: callable
+    :return: the argument type
+    :rtype: callable
+    """
+    def parse(value):
+        number = convert(value)
+        if number < 0:
+            raise argparse.ArgumentTypeError(config.NON_NEGATIVE_ARGUMENT % value)
+        return number
+    parse.__name__ = convert.__name__
+    return parse
 
 
 def make_parser():
     """
     Create an argument parser.
     The positional argument is the URLs text file.
-    The optional arguments are the destination directory and the log file, defaulting to current working directory and 'download.log' respectively.
+    The optional arguments are the destination directory and the log file, defaulting to current working directory and 'download.log' respectively,
+    as well as the global and per-host number of concurrent downloads and the delay between requests to a host, the robots.txt cache, the DNS cache and the connection pool settings,
+    the timeouts, retries and the number of failures after which a host is skipped, the shard or number of shards to crawl,
+    the files for metrics, whether to write the log asynchronously,
+    and the maximal image size in bytes and the limits of the image dimensions, whether to resume an interrupted crawl, the storage for the images and the manifest
+    for conditional re-crawls. Instead of the URLs text file, a spool directory or socket may be given to run as a service.
 
     :return: a parser object
     :rtype: argparse.ArgumentParser
     """
     parser = argparse.ArgumentParser(description=config.DESCRIPTION)
-    parser.add_argument('url_file', metavar='URL_FILE', type=str,
+    parser.add_argument('url_file', metavar='URL_FILE', type=str, nargs='?',
                         help=config.HELP_URL_FILE)
     parser.add_argument('-d', metavar='DEST_DIR', dest='destination_dir', default=config.DEFAULT_DESTINATION_DIR, type=str,
                         help=config.HELP_DESTINATION_DIR)
     parser.add_argument('-l', metavar='LOG_FILE', dest='log_file', default=config.DEFAULT_LOG_FILE, type=str,
                         help=config.HELP_LOG_FILE % config.DEFAULT_LOG_FILE)
+    parser.add_argument('-j', '--workers', metavar='WORKERS', dest='workers', default=config.DEFAULT_WORKERS, type=positive(int),
+                        help=config.HELP_WORKERS % config.DEFAULT_WORKERS)
+    parser.add_argument('--host-workers', metavar='HOST_WORKERS', dest='host_workers', default=config.DEFAULT_HOST_WORKERS, type=positive(int),
+                        help=config.HELP_HOST_WORKERS % config.DEFAULT_HOST_WORKERS)
+    parser.add_argument('--delay', metavar='SECONDS', dest='delay', default=config.DEFAULT_CRAWL_DELAY, type=non_negative(float),
+                        help=config.HELP_DELAY % config.DEFAULT_CRAWL_DELAY)
+    parser.add_argument('--robots-cache', metavar='CACHE_FILE', dest='robots_cache', default=None, type=str,
+                        help=config.HELP_ROBOTS_CACHE)
+    parser.add_argument('--robots-ttl', metavar='SECONDS', dest='robots_ttl', default=config.ROBOTS_CACHE_TTL, type=non_negative(float),
+                        help=config.HELP_ROBOTS_TTL % config.ROBOTS_CACHE_TTL)
+    parser.add_argument('--robots-cache-size', metavar='HOSTS', dest='robots_cache_size', default=config.ROBOTS_CACHE_SIZE, type=positive(int),
+                        help=config.HELP_ROBOTS_CACHE_SIZE % config.ROBOTS_CACHE_SIZE)
+    parser.add_argument('--pool-size', metavar='CONNECTIONS', dest='pool_size', default=config.DEFAULT_POOL_SIZE, type=non_negative(int),
+                        help=config.HELP_POOL_SIZE % config.DEFAULT_POOL_SIZE)
+    parser.add_argument('--idle-timeout', metavar='SECONDS', dest='idle_timeout', default=config.DEFAULT_IDLE_TIMEOUT, type=non_negative(float),
+                        help=config.HELP_IDLE_TIMEOUT % config.DEFAULT_IDLE_TIMEOUT)
+    parser.add_argument('--dns-ttl', metavar='SECONDS', dest='dns_ttl', default=config.DNS_CACHE_TTL, type=non_negative(float),
+                        help=config.HELP_DNS_TTL % config.DNS_CACHE_TTL)
+    parser.add_argument('--connect-timeout', metavar='SECONDS', dest='connect_timeout', default=config.DEFAULT_CONNECT_TIMEOUT, type=positive(float),
+                        help=config.HELP_CONNECT_TIMEOUT % config.DEFAULT_CONNECT_TIMEOUT)
+    parser.add_argument('--read-timeout', metavar='SECONDS', dest='read_timeout', default=config.DEFAULT_READ_TIMEOUT, type=positive(float),
+                        help=config.HELP_READ_TIMEOUT % config.DEFAULT_READ_TIMEOUT)
+    parser.add_argument('--retries', metavar='RETRIES', dest='retries', default=config.DEFAULT_RETRIES, type=non_negative(int),
+                        help=config.HELP_RETRIES % config.DEFAULT_RETRIES)
+    parser.add_argument('--breaker-threshold', metavar='FAILURES', dest='breaker_threshold', default=config.BREAKER_THRESHOLD, type=non_negative(int),
+                        help=config.HELP_BREAKER_THRESHOLD % config.BREAKER_THRESHOLD)
+    parser.add_argument('--max-bytes', metavar='BYTES', dest='max_bytes', default=None, type=non_negative(int),
+                        help=config.HELP_MAX_BYTES)
+    parser.add_argument('--min-size', metavar='WIDTHxHEIGHT', dest='min_size', default=None, type=imagesniff.parse_dimensions,
+                        help=config.HELP_MIN_SIZE)
+    parser.add_argument('--max-size', metavar='WIDTHxHEIGHT', dest='max_size', default=None, type=imagesniff.parse_dimensions,
+                        help=config.HELP_MAX_SIZE)
+    parser.add_argument('--shard', metavar='I/N', dest='shard', default=None, type=sharding.parse_shard,
+                        help=config.HELP_SHARD)
+    parser.add_argument('--shards', metavar='N', dest='shards', default=None, type=positive(int),
+                        help=config.HELP_SHARDS)
+    parser.add_argument('--processes', metavar='PROCESSES', dest='processes', default=None, type=positive(int),
+                        help=config.HELP_PROCESSES)
+    parser.add_argument('--metrics', metavar='METRICS_FILE', dest='metrics', default=None, type=str,
+                        help=config.HELP_METRICS)
+    parser.add_argument('--prometheus', metavar='TEXTFILE', dest='prometheus', default=None, type=str,
+                        help=config.HELP_PROMETHEUS)
+    parser.add_argument('--async-log', dest='async_log', action='store_true',
+                        help=config.HELP_ASYNC_LOG)
+    parser.add_argument('--segments', metavar='SEGMENTS', dest='segments', default=config.DEFAULT_SEGMENTS, type=positive(int),
+                        help=config.HELP_SEGMENTS % config.DEFAULT_SEGMENTS)
+    parser.add_argument('--segment-threshold', metavar='BYTES', dest='segment_threshold', default=config.DEFAULT_SEGMENT_THRESHOLD, type=non_negative(int),
+                        help=config.HELP_SEGMENT_THRESHOLD % config.DEFAULT_SEGMENT_THRESHOLD)
+    parser.add_argument('--adaptive', dest='adaptive', action='store_true',
+                        help=config.HELP_ADAPTIVE)
+    parser.add_argument('--max-bandwidth', metavar='BYTES', dest='max_bandwidth', default=None, type=positive(int),
+                        help=config.HELP_MAX_BANDWIDTH)
+    parser.add_argument('--near-duplicates', metavar='BITS', dest='near_duplicates', default=None, type=int,
+                        help=config.HELP_NEAR_DUPLICATES)
+    parser.add_argument('--skip-near-duplicates', dest='skip_near_duplicates', action='store_true',
+                        help=config.HELP_SKIP_NEAR_DUPLICATES)
+    parser.add_argument('--perceptual-hash', dest='perceptual_hash', default=config.DEFAULT_PERCEPTUAL_HASH, choices=perceptual.HASHES,
+                        help=config.HELP_PERCEPTUAL_HASH % config.DEFAULT_PERCEPTUAL_HASH)
+    parser.add_argument('--hash-index', metavar='INDEX_FILE', dest='hash_index', default=None, type=str,
+                        help=config.HELP_HASH_INDEX)
+    parser.add_argument('--profile', metavar='PSTATS_FILE', dest='profile', default=None, type=str,
+                        help=config.HELP_PROFILE)
+    parser.add_argument('--trace-memory', metavar='SECONDS', dest='trace_memory', default=None, type=float,
+                        help=config.HELP_TRACE_MEMORY)
+    parser.add_argument('--spool', metavar='SPOOL_DIR', dest='spool', default=None, type=str,
+                        help=config.HELP_SPOOL)
+    parser.add_argument('--socket', metavar='SOCKET', dest='socket', default=None, type=str,
+                        help=config.HELP_SOCKET)
+    parser.add_argument('--resume', dest='resume', action='store_true',
+                        help=config.HELP_RESUME % config.JOURNAL_SUFFIX)
+    parser.add_argument('--storage', metavar='STORAGE', dest='storage', default=config.STORAGE_FLAT, choices=sorted(storage.STORAGES),
+                        help=config.HELP_STORAGE % config.STORAGE_FLAT)
+    parser.add_argument('--manifest', metavar='MANIFEST_FILE', dest='manifest', default=None, type=str,
+                        help=config.HELP_MANIFEST)
+    parser.add_argument('--dedup', metavar='MODE', dest='dedup', default=config.DEDUP_OFF, choices=urldedup.DEDUPLICATORS,
+                        help=config.HELP_DEDUP % config.DEDUP_OFF)
+    parser.add_argument('--dedup-capacity', metavar='URLS', dest='dedup_capacity', default=config.DEDUP_CAPACITY, type=positive(int),
+                        help=config.HELP_DEDUP_CAPACITY % config.DEDUP_CAPACITY)
+    parser.add_argument('--dedup-error-rate', metavar='RATE', dest='dedup_error_rate', default=config.DEDUP_ERROR_RATE, type=float,
+                        help=config.HELP_DEDUP_ERROR_RATE % config.DEDUP_ERROR_RATE)
 
     return parser
 
@@ -220,9 +1444,109 @@ def parse_arguments(argv=None, parser=None):
     if parser is None:
         parser = make_parser()
 
-    return parser.parse_args(argv)
+    arguments = parser.parse_args(argv)
+    # a service receives its urls in batches instead of from a file
+    if (arguments.url_file is None) == (arguments.spool is None and arguments.socket is None):
+        parser.error(config.SERVICE_ARGUMENTS)
+    # a service neither has a journal to resume nor a URL file to sort
+    if arguments.url_file is None and (arguments.resume or arguments.dedup == config.DEDUP_SORT):
+        parser.error(config.SERVICE_OPTIONS)
+    if arguments.near_duplicates is not None and (perceptual.numpy is None or perceptual.Image is None or not 0 <= arguments.near_duplicates <= 64):
+        parser.error(config.NEAR_DUPLICATE_ARGUMENTS)
+    if arguments.trace_memory is not None and arguments.trace_memory <= 0:
+        parser.error(config.TRACE_MEMORY_ARGUMENTS)
+    if not 0 < arguments.dedup_error_rate < 1:
+        parser.error(config.DEDUP_ARGUMENTS)
+    return arguments
+
+
+def create_crawler(arguments):
+    """
+    Creates a crawler with the robots.txt cache, DNS cache, connection pool, manifest, circuit breaker, metrics and
+    concurrency and bandwidth limits configured by the command line arguments.
+
+    :param arguments: the parsed command line arguments
+    :type arguments: argparse.Namespace
+    :return: the crawler
+    :rtype: ImgCrawler
+    """
+    robots_cache = robotscache.RobotsCache(arguments.robots_ttl, arguments.robots_cache_size, arguments.robots_cache)
+    resolver = dnscache.DnsCache(arguments.dns_ttl)
+    pool = connectionpool.ConnectionPool(arguments.pool_size, arguments.idle_timeout, arguments.read_timeout, arguments.connect_timeout, resolver)
+    images = manifest.Manifest(arguments.manifest) if arguments.manifest else None
+    breaker = retry.CircuitBreaker(arguments.breaker_threshold)
+    recorder = metrics.MetricsRecorder(arguments.metrics, arguments.prometheus) if arguments.metrics or arguments.prometheus else None
+    controller = pacing.AimdController(arguments.workers, arguments.host_workers) if arguments.adaptive else None
+    bandwidth = pacing.TokenBucket(arguments.max_bandwidth) if arguments.max_bandwidth else None
+    profiler = profiling.Profiler(arguments.profile) if arguments.profile else None
+    near_duplicates = perceptual.NearDuplicates(arguments.near_duplicates, arguments.perceptual_hash, arguments.skip_near_duplicates,
+                                                arguments.hash_index) if arguments.near_duplicates is not None else None
+    return ImgCrawler(arguments.workers, arguments.host_workers, robots_cache=robots_cache, pool=pool,
+                      max_bytes=arguments.max_bytes, resume=arguments.resume, storage=arguments.storage, manifest=images,
+                      dedup=arguments.dedup, dedup_capacity=arguments.dedup_capacity, dedup_error_rate=arguments.dedup_error_rate,
+                      delay=arguments.delay, retries=arguments.retries, breaker=breaker, shard=arguments.shard, metrics=recorder,
+                      async_log=arguments.async_log, min_size=arguments.min_size, max_size=arguments.max_size,
+                      controller=controller, bandwidth=bandwidth, segments=arguments.segments,
+                      segment_threshold=arguments.segment_threshold, near_duplicates=near_duplicates, profiler=profiler,
+                      trace_memory=arguments.trace_memory)
+
+def main(argv=None):
+    """
+    Crawls the URL file given by the command line arguments, launches the crawls of its shards, or runs as a service.
+
+    :param argv: optional arguments, defaults to sys.argv[1:]
+    :type argv: list of str
+    :return: the exit status
+    :rtype: int
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    arguments = parse_arguments(argv)
+    if arguments.spool or arguments.socket:
+        crawler = create_crawler(arguments)
+        crawl_service = service.CrawlService(crawler, arguments.destination_dir, arguments.log_file, arguments.spool, arguments.socket)
+        # finish the accepted batches before exiting
+        signal.signal(signal.SIGTERM, lambda signum, frame: crawl_service.stop())
+        signal.signal(signal.SIGUSR1, lambda signum, frame: crawler.stages.dump())
+        if crawler.profiler is not None:
+            crawler.profiler.start()
+        try:
+            crawl_service.run()
+        finally:
+            if crawler.profiler is not None:
+                crawler.profiler.stop()
+            crawler.pool.close()
+            if crawler.manifest is not None:
+                crawler.manifest.close()
+            if crawler.near_duplicates is not None:
+                crawler.near_duplicates.close()
+        return 0
+
+    if arguments.shards:
+        processes = arguments.processes or min(arguments.shards, os.cpu_count() or 1)
+        return sharding.launch(os.path.abspath(__file__), argv, arguments.shards, processes, arguments.log_file, arguments.manifest)
+
+    # a shard keeps its own files, so shards do not write the same files concurrently
+    if arguments.shard is not None:
+        for name in ('log_file', 'manifest', 'robots_cache', 'metrics', 'prometheus', 'hash_index', 'profile'):
+            if getattr(arguments, name):
+                setattr(arguments, name, sharding.shard_path(getattr(arguments, name), *arguments.shard))
+    crawler = create_crawler(arguments)
+    # report where the time goes while crawling
+    signal.signal(signal.SIGUSR1, lambda signum, frame: crawler.stages.dump())
+    if crawler.profiler is not None:
+        crawler.profiler.start()
+    try:
+        crawler.download_images(arguments.url_file, arguments.destination_dir, arguments.log_file)
+    finally:
+        if crawler.profiler is not None:
+            crawler.profiler.stop()
+        crawler.pool.close()
+        if crawler.manifest is not None:
+            crawler.manifest.close()
+        if crawler.near_duplicates is not None:
+            crawler.near_duplicates.close()
+    return 0
 
 
 if __name__ == '__main__':
-    arguments = parse_arguments()
-    ImgCrawler().download_images(arguments.url_file, arguments.destination_dir, arguments.log_file)
+    sys.exit(main())
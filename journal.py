@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+
+import config
+
+
+class Journal:
+    """
+    Append-only record of the processed URLs of a crawl, allowing an interrupted crawl to be resumed.
+
+    Each processed URL is appended as a record of its line number, the byte offset behind the line,
+    a hash of the URL and the number of the stored image (if any). Every batch of records is followed by
+    a checkpoint holding the contiguous prefix of processed lines, the highest image number and the few
+    lines processed out of order behind the prefix, and is synced to disk. Resuming therefore only reads
+    the journal from its last checkpoint and seeks the URL file directly behind the prefix.
+    """
+    RECORD = 'U'
+    CHECKPOINT = 'C'
+
+    def __init__(self, path, resume=False, batch=config.JOURNAL_BATCH):
+        """
+        Journal constructor. Restores the state of the previous crawl if resuming, otherwise starts a new journal.
+
+        :param path: file name or path to the journal
+        :type path: str
+        :param resume: optional flag whether to continue an existing journal, defaults to False
+        :type resume: bool
+        :param batch: optional number of records after which a checkpoint is synced to disk, defaults to config.JOURNAL_BATCH
+        :type batch: int
+        :return:
+        """
+        self.path = path
+        self.batch = batch
+        self.lines = 0
+        self.offset = 0
+        self.count = 0
+        self.done = {}
+        self._unsynced = 0
+
+        if resume and os.path.exists(path):
+            self._restore()
+            self._handle = open(path, 'a')
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._handle = open(path, 'w')
+
+    @staticmethod
+    def hash(url):
+        return hashlib.sha1(url.encode('utf-8', 'replace')).hexdigest()[:config.JOURNAL_HASH_LENGTH]
+
+    def _tail(self):
+        """
+        Returns the complete lines of the journal starting with its last checkpoint, reading backwards in chunks.
+
+        :return: journal lines
+        :rtype: list of str
+        """
+        with open(self.path, 'rb') as handle:
+            end = handle.seek(0, os.SEEK_END)
+            start = end
+            while True:
+                start = max(start - config.JOURNAL_TAIL, 0)
+                handle.seek(start)
+                lines = handle.read(end - start).split(b'\n')[:-1]
+                if start:
+                    # the first line is possibly cut
+                    lines = lines[1:]
+                for i in range(len(lines) - 1, -1, -1):
+                    if lines[i].startswith(self.CHECKPOINT.encode('ascii')):
+                        return [line.decode('utf-8') for line in lines[i:]]
+                if not start:
+                    return [line.decode('utf-8') for line in lines]
+
+    def _restore(self):
+        for line in self._tail():
+            fields = line.split('\t')
+            try:
+                if fields[0] == self.CHECKPOINT:
+                    self.lines, self.offset, self.count = int(fields[1]), int(fields[2]), int(fields[3])
+                    self.done = {}
+                    for entry in filter(None, fields[4].split(',')):
+                        number, offset, digest = entry.split(':')
+                        self.done[int(number)] = (int(offset), digest)
+                elif fields[0] == self.RECORD:
+                    self._apply(int(fields[1]), int(fields[2]), fields[3], None if fields[4] == '-' else int(fields[4]))
+            except (IndexError, ValueError):
+                # a record cut by the interruption
+                continue
+
+    def _apply(self, line, offset, digest, number):
+        if number is not None:
+            self.count = max(self.count, number)
+        if line < self.lines:
+            return
+        self.done[line] = (offset, digest)
+        while self.lines in self.done:
+            self.offset = self.done.pop(self.lines)[0]
+            self.lines += 1
+
+    def completed(self, line, url):
+        """
+        Checks whether a line behind the contiguous prefix was already processed. The URL hash guards
+        against resuming with a different URL file.
+
+        :param line: the zero-based line number
+        :type line: int
+        :param url: the URL read from the line
+        :type url: str
+        :return: a flag indicating whether the URL can be skipped
+        :rtype: bool
+        """
+        entry = self.done.get(line)
+        return entry is not None and entry[1] == self.hash(url)
+
+    def record(self, line, offset, url, number=None):
+        """
+        Appends the outcome of a processed URL, writing and syncing a checkpoint after each batch.
+
+        :param line: the zero-based line number
+        :type line: int
+        :param offset: the byte offset behind the line
+        :type offset: int
+        :param url: the URL read from the line
+        :type url: str
+        :param number: optional number of the stored image, None if no image was stored
+        :type number: int
+        :return:
+        """
+        digest = self.hash(url)
+        self._handle.write('%s\t%d\t%d\t%s\t%s\n' % (self.RECORD, line, offset, digest, '-' if number is None else number))
+        self._apply(line, offset, digest, number)
+        self._unsynced += 1
+        if self._unsynced >= self.batch:
+            self.checkpoint()
+
+    def skip(self, line, offset):
+        """
+        Passes a line which is not processed by this crawl (e.g. it belongs to another shard) without writing a record.
+        Skipped lines behind the prefix are not persisted, they are skipped again when resuming.
+
+        :param line: the zero-based line number
+        :type line: int
+        :param offset: the byte offset behind the line
+        :type offset: int
+        :return:
+        """
+        self._apply(line, offset, None, None)
+
+    def checkpoint(self):
+        """
+        Writes a checkpoint of the current state and syncs the journal to disk.
+
+        :return:
+        """
+        done = ','.join('%d:%d:%s' % (line, offset, digest) for line, (offset, digest) in sorted(self.done.items()) if digest)
+        self._handle.write('%s\t%d\t%d\t%d\t%s\n' % (self.CHECKPOINT, self.lines, self.offset, self.count, done))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        self.checkpoint()
+        self._handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import os.path
+import sqlite3
+import threading
+
+import config
+
+
+class ManifestEntry:
+    """
+    Validators and location of an image stored by a previous crawl.
+    """
+    __slots__ = ('etag', 'last_modified', 'size', 'path')
+
+    def __init__(self, etag, last_modified, size, path):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.size = size
+        self.path = path
+
+    def headers(self):
+        """
+        Returns the request headers asking the server to answer with 304 if the image did not change.
+
+        :return: conditional request headers
+        :rtype: dict
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class Manifest:
+    """
+    Thread-safe on-disk record of the ETag, Last-Modified, size, local path and number of each downloaded image URL,
+    kept in an SQLite database so lookups stay cheap for lists of millions of URLs.
+    Changes are committed in batches.
+    """
+    def __init__(self, path, batch=config.MANIFEST_BATCH):
+        """
+        Manifest constructor. Opens or creates the database.
+
+        :param path: file name or path to the manifest database
+        :type path: str
+        :param batch: optional number of changes after which they are committed, defaults to config.MANIFEST_BATCH
+        :type batch: int
+        :return:
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.batch = batch
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS images (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                                 'size INTEGER, path TEXT, number INTEGER) WITHOUT ROWID')
+        # manifests of earlier versions lack the image numbers
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(images)')]
+        if 'number' not in columns:
+            self._connection.execute('ALTER TABLE images ADD COLUMN number INTEGER')
+        self._connection.commit()
+
+    def get(self, url):
+        """
+        Returns the entry of an URL, None if it was not recorded.
+
+        :param url: the URL of the image
+        :type url: str
+        :return: the recorded entry
+        :rtype: ManifestEntry
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT etag, last_modified, size, path FROM images WHERE url = ?', (url,)).fetchone()
+        return ManifestEntry(*row) if row else None
+
+    def put(self, url, etag, last_modified, size, path, number=None):
+        """
+        Records the validators and location of a downloaded image.
+
+        :param url: the URL of the image
+        :type url: str
+        :param etag: the ETag response header, None if missing
+        :type etag: str
+        :param last_modified: the Last-Modified response header, None if missing
+        :type last_modified: str
+        :param size: the image size in bytes
+        :type size: int
+        :param path: path of the stored image
+        :type path: str
+        :param number: optional number in the image name, defaults to none, the number is then read from the path
+        :type number: int
+        :return:
+        """
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)', (url, etag, last_modified, size, path, number))
+            self._uncommitted += 1
+            if self._uncommitted >= self.batch:
+                self._connection.commit()
+                self._uncommitted = 0
+
+    def merge(self, path):
+        """
+        Adds the entries of another manifest (e.g. of a shard of the crawl), replacing the entries of the same URLs.
+
+        :param path: file name or path to the other manifest database
+        :type path: str
+        :return:
+        """
+        with self._lock:
+            self._connection.commit()
+            self._connection.execute('ATTACH DATABASE ? AS other', (path,))
+            try:
+                columns = [row[1] for row in self._connection.execute('PRAGMA other.table_info(images)')]
+                number = 'number' if 'number' in columns else 'NULL'
+                self._connection.execute('INSERT OR REPLACE INTO images SELECT url, etag, last_modified, size, path, %s FROM other.images' % number)
+                self._connection.commit()
+            finally:
+                self._connection.execute('DETACH DATABASE other')
+            self._uncommitted = 0
+
+    def highest_number(self):
+        """
+        Returns the highest number of the recorded images, so a new crawl numbers its images behind them instead of
+        overwriting the images kept as not modified. Images recorded without a number are numbered by their file name.
+
+        :return: the highest image number, 0 if there is none
+        :rtype: int
+        """
+        with self._lock:
+            highest = self._connection.execute('SELECT MAX(number) FROM images').fetchone()[0] or 0
+            for path, in self._connection.execute('SELECT path FROM images WHERE number IS NULL'):
+                prefix = os.path.basename(path).split('_', 1)[0]
+                if prefix.isdigit():
+                    highest = max(highest, int(prefix))
+        return highest
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def commit(self):
+        with self._lock:
+            self._connection.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        with self._lock:
+            self._connection.close()
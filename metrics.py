@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import contextlib
+import json
+import os
+import os.path
+import random
+import tempfile
+import threading
+import time
+
+import config
+
+
+PHASES = ('robots', 'dns', 'connect', 'ttfb', 'transfer', 'write')
+QUANTILES = (('0.5', 'p50'), ('0.9', 'p90'), ('0.99', 'p99'))
+
+_current = threading.local()
+
+
+class Timing:
+    """
+    Phase timings and outcome of the processing of a single URL.
+    """
+    __slots__ = ('url', 'host', 'started', 'phases', 'status', 'size', 'outcome', 'inner')
+
+    def __init__(self, url, host, outcome=None):
+        self.url = url
+        self.host = host
+        self.started = time.time()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.status = None
+        self.size = 0
+        self.outcome = outcome
+        # seconds spent in nested phases, which are not counted for the enclosing phase
+        self.inner = 0.0
+
+    def total(self):
+        return sum(self.phases.values())
+
+    def record(self):
+        """
+        Returns the timing as a JSON-serializable record.
+
+        :return: the record
+        :rtype: dict
+        """
+        return {'time': round(self.started, 3), 'url': self.url, 'host': self.host, 'outcome': self.outcome,
+                'status': self.status, 'bytes': self.size,
+                'seconds': {name: round(seconds, 6) for name, seconds in self.phases.items()}}
+
+
+def current():
+    """
+    Returns the timing of the URL processed by the calling thread, None if the URL is not timed.
+
+    :return: the current timing
+    :rtype: Timing
+    """
+    return getattr(_current, 'timing', None)
+
+
+def start(url, host):
+    """
+    Starts timing an URL processed by the calling thread.
+
+    :param url: the URL
+    :type url: str
+    :param host: the host (netloc) of the URL
+    :type host: str
+    :return: the timing
+    :rtype: Timing
+    """
+    timing = _current.timing = Timing(url, host)
+    return timing
+
+
+def stop():
+    """
+    Ends timing the URL processed by the calling thread.
+
+    :return:
+    """
+    _current.timing = None
+
+
+@contextlib.contextmanager
+def phase(name, opaque=False):
+    """
+    Adds the time spent in the block to a phase of the current timing. The time of phases nested in the block is
+    only counted for them, unless the phase is opaque: then the nested phases are not timed separately.
+
+    :param name: one of PHASES
+    :type name: str
+    :param opaque: optional flag whether nested phases count for this phase, defaults to False
+    :type opaque: bool
+    :return:
+    """
+    timing = current()
+    if timing is None:
+        yield
+        return
+
+    inner = timing.inner
+    if opaque:
+        _current.timing = None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        if opaque:
+            _current.timing = timing
+        timing.phases[name] += elapsed - (timing.inner - inner)
+        timing.inner = inner + elapsed
+
+
+def outcome(category, status=None, size=None):
+    """
+    Sets the outcome category (and HTTP status and image size) of the current timing.
+
+    :param category: the outcome, one of the config.OUTCOME_* categories
+    :type category: str
+    :param status: optional HTTP status of the response
+    :type status: int
+    :param size: optional size of the received image in bytes
+    :type size: int
+    :return:
+    """
+    timing = current()
+    if timing is not None:
+        timing.outcome = category
+        if status is not None:
+            timing.status = status
+        if size is not None:
+            timing.size = size
+
+
+class Reservoir:
+    """
+    Uniform sample of a bounded size from a stream of values, for percentiles with memory independent of the crawl size.
+    """
+    __slots__ = ('size', 'count', 'sum', 'values')
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.sum = 0.0
+        self.values = []
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            index = random.randrange(self.count)
+            if index < self.size:
+                self.values[index] = value
+
+    def percentile(self, fraction):
+        if not self.values:
+            return 0.0
+        values = sorted(self.values)
+        return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class MetricsRecorder:
+    """
+    Thread-safe recorder of the URL timings of a crawl. Each timing is written as a JSON line, and aggregated into
+    throughput, latency percentiles per phase and per host (the hosts beyond config.METRICS_HOSTS combined),
+    and counts of outcomes and HTTP statuses. The summary is
+    written as the last JSON line and optionally as a Prometheus textfile.
+    """
+    def __init__(self, path=None, prometheus=None):
+        """
+        Metrics recorder constructor.
+
+        :param path: optional file for the JSON lines of the timings and the summary
+        :type path: str
+        :param prometheus: optional file for the summary in the Prometheus text format
+        :type prometheus: str
+        :return:
+        """
+        self.path = path
+        self.prometheus = prometheus
+        self._lock = threading.Lock()
+        self._handle = None
+        self.begin()
+
+    def begin(self):
+        """
+        Starts the metrics of a crawl, appending to the JSON lines file.
+
+        :return:
+        """
+        with self._lock:
+            self.started = time.monotonic()
+            self.finished = None
+            self.urls = 0
+            self.bytes = 0
+            self.outcomes = collections.Counter()
+            self.statuses = collections.Counter()
+            self.phases = {name: Reservoir(config.METRICS_SAMPLES) for name in PHASES}
+            self.hosts = {}
+            if self.path and self._handle is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._handle = open(self.path, 'a')
+
+    def record(self, timing):
+        """
+        Records the timing of an URL.
+
+        :param timing: the timing
+        :type timing: Timing
+        :return:
+        """
+        line = json.dumps(timing.record()) if self._handle is not None else None
+        with self._lock:
+            self.urls += 1
+            self.bytes += timing.size
+            self.outcomes[timing.outcome] += 1
+            if timing.status is not None:
+                self.statuses[timing.status] += 1
+            for name, seconds in timing.phases.items():
+                if seconds:
+                    self.phases[name].add(seconds)
+            if timing.outcome not in config.METRICS_UNTIMED:
+                # hosts beyond the limit share a reservoir, so memory stays bounded for crawls of many hosts
+                host = self.hosts.get(timing.host)
+                if host is None:
+                    name = timing.host if len(self.hosts) < config.METRICS_HOSTS else config.METRICS_OTHER_HOSTS
+                    host = self.hosts.get(name)
+                    if host is None:
+                        host = self.hosts[name] = Reservoir(config.METRICS_HOST_SAMPLES)
+                host.add(timing.total())
+            if line is not None:
+                self._handle.write(line + '\n')
+
+    def summary(self):
+        """
+        Returns the summary of the crawl: throughput, latency percentiles per phase and of the slowest hosts,
+        and counts of outcomes and HTTP statuses.
+
+        :return: the summary
+        :rtype: dict
+        """
+        with self._lock:
+            elapsed = max((self.finished or time.monotonic()) - self.started, 1e-9)
+            latency = lambda reservoir: {'count': reservoir.count, 'mean': round(reservoir.sum / reservoir.count, 6) if reservoir.count else 0.0,
+                                         'p50': round(reservoir.percentile(0.5), 6), 'p90': round(reservoir.percentile(0.9), 6),
+                                         'p99': round(reservoir.percentile(0.99), 6)}
+            slowest = sorted(self.hosts.items(), key=lambda item: item[1].percentile(0.9), reverse=True)[:config.METRICS_SLOWEST_HOSTS]
+            return {'urls': self.urls,
+                    'bytes': self.bytes,
+                    'seconds': round(elapsed, 3),
+                    'urls_per_second': round(self.urls / elapsed, 3),
+                    'megabytes_per_second': round(self.bytes / elapsed / 1e6, 6),
+                    'outcomes': dict(self.outcomes),
+                    'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                    'phases': {name: latency(reservoir) for name, reservoir in self.phases.items()},
+                    'slowest_hosts': {host: latency(reservoir) for host, reservoir in slowest}}
+
+    def finish(self):
+        """
+        Ends the crawl, writing the summary as the last JSON line and to the Prometheus textfile.
+
+        :return: the summary
+        :rtype: dict
+        """
+        with self._lock:
+            self.finished = time.monotonic()
+        summary = self.summary()
+        with self._lock:
+            if self._handle is not None:
+                self._handle.write(json.dumps({'summary': summary}) + '\n')
+                self._handle.close()
+                self._handle = None
+        if self.prometheus:
+            self.write_prometheus(summary)
+        return summary
+
+    def write_prometheus(self, summary):
+        """
+        Writes the summary in the Prometheus text format, replacing the file atomically as expected by the
+        textfile collector of the node exporter.
+
+        :param summary: the summary of the crawl
+        :type summary: dict
+        :return:
+        """
+        lines = []
+
+        def metric(name, kind, text, samples):
+            lines.append('# HELP %s%s %s' % (config.METRICS_PREFIX, name, text))
+            lines.append('# TYPE %s%s %s' % (config.METRICS_PREFIX, name, kind))
+            for labels, value in samples:
+                label_text = ','.join('%s="%s"' % (key, str(label).replace('\\', '\\\\').replace('"', '\\"')) for key, label in labels)
+                lines.append('%s%s%s %s' % (config.METRICS_PREFIX, name, '{%s}' % label_text if label_text else '', repr(float(value))))
+
+        metric('urls_total', 'counter', 'URLs processed by outcome.',
+               [((('outcome', outcome),), count) for outcome, count in sorted(summary['outcomes'].items(), key=lambda item: str(item[0]))])
+        metric('http_responses_total', 'counter', 'HTTP responses by status.',
+               [((('status', status),), count) for status, count in summary['statuses'].items()])
+        metric('bytes_total', 'counter', 'Bytes of received images.', [((), summary['bytes'])])
+        metric('duration_seconds', 'gauge', 'Duration of the crawl.', [((), summary['seconds'])])
+        metric('urls_per_second', 'gauge', 'URLs processed per second.', [((), summary['urls_per_second'])])
+        metric('megabytes_per_second', 'gauge', 'Megabytes of images received per second.', [((), summary['megabytes_per_second'])])
+        samples = []
+        for name, latency in summary['phases'].items():
+            samples += [((('phase', name), ('quantile', quantile)), latency[key]) for quantile, key in QUANTILES]
+        metric('phase_seconds', 'gauge', 'Latency quantiles of the phases of processing an URL.', samples)
+        samples = []
+        for host, latency in summary['slowest_hosts'].items():
+            samples += [((('host', host), ('quantile', quantile)), latency[key]) for quantile, key in QUANTILES]
+        metric('host_seconds', 'gauge', 'Latency quantiles of the slowest hosts.', samples)
+
+        directory = os.path.dirname(self.prometheus) or os.curdir
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(suffix=config.PARTIAL_SUFFIX, prefix='.', dir=directory)
+        with open(descriptor, 'w') as handle:
+            handle.write('\n'.join(lines) + '\n')
+        os.replace(temporary, self.prometheus)
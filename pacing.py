@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+import time
+
+import config
+
+
+class _HostState:
+    __slots__ = ('limit', 'latency', 'baseline', 'decreased')
+
+    def __init__(self):
+        self.limit = 1.0
+        self.latency = None
+        self.baseline = None
+        self.decreased = 0.0
+
+
+class AimdController:
+    """
+    Thread-safe adaptive concurrency by additive increase and multiplicative decrease (AIMD), per host and for the
+    whole crawl. Each successful request raises the limit of its host by about one request per round of requests,
+    up to the maximal number of requests per host. Overload of a host (429 and 503 answers, timeouts and other
+    transient failures, or a time to first byte grown far above the fastest seen) halves its limit, at most once per
+    round trip of the host. The limit of the whole crawl grows the same way up to the number of workers, and is
+    halved when the recent requests fail too often.
+    """
+    def __init__(self, workers=config.DEFAULT_WORKERS, host_workers=config.DEFAULT_HOST_WORKERS, initial=config.AIMD_INITIAL,
+                 max_hosts=config.AIMD_HOSTS):
+        """
+        Controller constructor.
+
+        :param workers: optional maximal number of concurrent requests, defaults to config.DEFAULT_WORKERS
+        :type workers: int
+        :param host_workers: optional maximal number of concurrent requests per host, defaults to config.DEFAULT_HOST_WORKERS
+        :type host_workers: int
+        :param initial: optional number of concurrent requests to start with, defaults to config.AIMD_INITIAL
+        :type initial: int
+        :param max_hosts: optional maximal number of hosts whose limits are kept, defaults to config.AIMD_HOSTS
+        :type max_hosts: int
+        :return:
+        """
+        if workers < 1 or host_workers < 1 or initial < 1 or max_hosts < 1:
+            raise ValueError('concurrency limits must be positive')
+
+        self.workers = workers
+        self.host_workers = host_workers
+        self.max_hosts = max_hosts
+        self.increases = 0
+        self.decreases = 0
+
+        self._limit = float(min(initial, workers))
+        self._decreased = 0.0
+        self._recent = collections.deque(maxlen=config.AIMD_WINDOW)
+        self._hosts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = _HostState()
+            while len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(host)
+        return state
+
+    def limit(self):
+        """
+        Returns the number of concurrent requests of the whole crawl.
+
+        :return: the limit, at least 1
+        :rtype: int
+        """
+        return int(self._limit)
+
+    def host_limit(self, host):
+        """
+        Returns the number of concurrent requests to a host.
+
+        :param host: the host (netloc)
+        :type host: str
+        :return: the limit, at least 1
+        :rtype: int
+        """
+        with self._lock:
+            state = self._hosts.get(host)
+            return int(state.limit) if state is not None else 1
+
+    def _decrease(self, state, now):
+        # once per round trip of the host, the requests started before still answer from the overload
+        if now - state.decreased < (state.latency or 0.0):
+            return
+        state.limit = max(state.limit * config.AIMD_DECREASE, 1.0)
+        state.decreased = now
+        self.decreases += 1
+
+    def success(self, host, seconds=None):
+        """
+        Reports a request answered by a host.
+
+        :param host: the host (netloc)
+        :type host: str
+        :param seconds: optional time to the first byte of the answer, defaults to no measurement
+        :type seconds: float
+        :return:
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._host(host)
+            self._recent.append(False)
+            if seconds is not None:
+                state.latency = seconds if state.latency is None else \
+                    state.latency + config.AIMD_SMOOTHING * (seconds - state.latency)
+                state.baseline = seconds if state.baseline is None else min(state.baseline, seconds)
+                # a queue building up at the host shows in the latency before requests fail
+                if state.latency > max(state.baseline * config.AIMD_LATENCY_FACTOR, config.AIMD_LATENCY_FLOOR):
+                    self._decrease(state, now)
+                    return
+            if state.limit < self.host_workers:
+                state.limit = min(state.limit + 1.0 / state.limit, float(self.host_workers))
+                self.increases += 1
+            if self._limit < self.workers:
+                self._limit = min(self._limit + 1.0 / self._limit, float(self.workers))
+
+    def congestion(self, host):
+        """
+        Reports an overloaded host: a 429 or 503 answer, a timeout or another transient failure.
+
+        :param host: the host (netloc)
+        :type host: str
+        :return:
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._decrease(self._host(host), now)
+            self._recent.append(True)
+            # many hosts failing at once point to the own link or machine
+            if len(self._recent) == self._recent.maxlen and sum(self._recent) > config.AIMD_ERROR_RATE * len(self._recent) \
+                    and now - self._decreased >= config.AIMD_GLOBAL_COOLDOWN:
+                self._limit = max(self._limit * config.AIMD_DECREASE, 1.0)
+                self._decreased = now
+                self._recent.clear()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the bytes received per second by all workers together. Received bytes are taken
+    from the bucket, which is refilled at the rate up to the burst size; a worker taking more than is left waits until
+    its debt is refilled, slowing down reading from the connection and so the sender.
+    """
+    def __init__(self, rate, burst=None):
+        """
+        Token bucket constructor.
+
+        :param rate: the bytes per second
+        :type rate: int, float
+        :param burst: optional bytes which may be received at once after a pause, defaults to a quarter second of the
+                      rate but at least config.CHUNK_SIZE
+        :type burst: int, float
+        :return:
+        """
+        if rate <= 0 or (burst is not None and burst <= 0):
+            raise ValueError('bandwidth and burst must be positive')
+
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else max(self.rate / 4, config.CHUNK_SIZE)
+        self.waited = 0.0
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """
+        Takes received bytes from the bucket, waiting until the bucket allows them.
+
+        :param amount: the number of bytes
+        :type amount: int
+        :return:
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst) - amount
+            self._updated = now
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
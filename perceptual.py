@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import threading
+
+import config
+
+# optional dependencies, only needed for the near-duplicate detection
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+HASHES = ('ahash', 'dhash', 'phash')
+
+
+def _pixels(path, width, height):
+    # decoding a JPEG at a fraction of its size is much faster than decoding and shrinking it
+    with Image.open(path) as image:
+        image.draft('L', (width * 4, height * 4))
+        return numpy.asarray(image.convert('L').resize((width, height), Image.LANCZOS), dtype=numpy.float64)
+
+
+def _dct_matrix(size):
+    rows = numpy.arange(size).reshape(-1, 1)
+    return numpy.cos(numpy.pi * (2 * numpy.arange(size) + 1) * rows / (2 * size))
+
+
+def image_hash(path, method=config.DEFAULT_PERCEPTUAL_HASH):
+    """
+    Computes the 64-bit perceptual hash of an image: ahash compares the pixels of an 8x8 thumbnail to their mean,
+    dhash compares neighbouring pixels of a 9x8 thumbnail, phash compares the lowest frequencies of the discrete cosine
+    transform of a 32x32 thumbnail to their median. Similar images (re-encoded, resized, slightly retouched) get
+    hashes differing in few bits. Runs in the processes of the pool.
+
+    :param path: the image file
+    :type path: str
+    :param method: optional hash, one of HASHES, defaults to config.DEFAULT_PERCEPTUAL_HASH
+    :type method: str
+    :return: the hash, None if the image cannot be decoded
+    :rtype: int
+    """
+    try:
+        if method == 'ahash':
+            pixels = _pixels(path, 8, 8)
+            bits = pixels > pixels.mean()
+        elif method == 'dhash':
+            pixels = _pixels(path, 9, 8)
+            bits = pixels[:, 1:] > pixels[:, :-1]
+        else:
+            transform = _dct_matrix(32)
+            frequencies = (transform @ _pixels(path, 32, 32) @ transform.T)[:8, :8]
+            bits = frequencies > numpy.median(frequencies)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    return int.from_bytes(numpy.packbits(bits.ravel()).tobytes(), 'big')
+
+
+class HashIndex:
+    """
+    Index of 64-bit perceptual hashes in a growing NumPy array, with the number of the image of each hash.
+    The nearest hash is found by a vectorized Hamming distance to all hashes, a few milliseconds per million hashes.
+    Not thread-safe.
+    """
+    def __init__(self, capacity=config.HASH_INDEX_CAPACITY):
+        """
+        Index constructor.
+
+        :param capacity: optional number of hashes before the arrays grow, defaults to config.HASH_INDEX_CAPACITY
+        :type capacity: int
+        :return:
+        """
+        self._hashes = numpy.zeros(max(capacity, 1), dtype=numpy.uint64)
+        self._numbers = numpy.zeros(max(capacity, 1), dtype=numpy.int64)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, value, number=0):
+        """
+        Adds a hash.
+
+        :param value: the hash
+        :type value: int
+        :param number: optional number of the image, defaults to 0 until it is labelled
+        :type number: int
+        :return: the slot of the hash
+        :rtype: int
+        """
+        if self._count == len(self._hashes):
+            self._hashes = numpy.concatenate((self._hashes, numpy.zeros_like(self._hashes)))
+            self._numbers = numpy.concatenate((self._numbers, numpy.zeros_like(self._numbers)))
+        self._hashes[self._count] = value
+        self._numbers[self._count] = number
+        self._count += 1
+        return self._count - 1
+
+    def label(self, slot, number):
+        self._numbers[slot] = number
+
+    def nearest(self, value):
+        """
+        Finds the hash nearest to a hash, among the hashes labelled with the number of their image.
+
+        :param value: the hash
+        :type value: int
+        :return: the Hamming distance and the image number of the nearest hash, None and None if there is none
+        :rtype: tuple
+        """
+        numbers = self._numbers[:self._count]
+        labelled = numbers != 0
+        if not labelled.any():
+            return None, None
+        difference = self._hashes[:self._count] ^ numpy.uint64(value)
+        if hasattr(numpy, 'bitwise_count'):
+            distances = numpy.bitwise_count(difference)
+        else:
+            distances = numpy.unpackbits(difference.view(numpy.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        # a hash still being stored has no image to refer to yet, it is farther than any 64-bit distance
+        distances = numpy.where(labelled, distances, 65)
+        slot = int(numpy.argmin(distances))
+        return int(distances[slot]), int(numbers[slot])
+
+    def save(self, path):
+        """
+        Writes the index to a file, replacing it atomically.
+
+        :param path: the index file
+        :type path: str
+        :return:
+        """
+        temporary = path + config.PARTIAL_SUFFIX
+        with open(temporary, 'wb') as handle:
+            numpy.savez(handle, hashes=self._hashes[:self._count], numbers=self._numbers[:self._count])
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads an index written by save.
+
+        :param path: the index file
+        :type path: str
+        :return: the index
+        :rtype: HashIndex
+        """
+        with numpy.load(path) as arrays:
+            index = cls(max(len(arrays['hashes']), config.HASH_INDEX_CAPACITY))
+            index._count = len(arrays['hashes'])
+            index._hashes[:index._count] = arrays['hashes']
+            index._numbers[:index._count] = arrays['numbers']
+        return index
+
+
+class NearDuplicates:
+    """
+    Detects near duplicates among the downloaded images (the same image re-encoded, resized or slightly changed)
+    by the Hamming distance of their perceptual hashes. The hashes are computed by a pool of processes, so decoding
+    the images neither holds the interpreter lock of the download threads nor competes with them for a core.
+    Only skipping near duplicates makes a download wait for its hash, logged ones are compared in the background.
+    Thread-safe.
+    """
+    def __init__(self, threshold=config.DEFAULT_NEAR_DUPLICATE_BITS, method=config.DEFAULT_PERCEPTUAL_HASH, skip=False,
+                 index_path=None, processes=None):
+        """
+        Detector constructor.
+
+        :param threshold: optional maximal number of differing hash bits of near duplicates, defaults to config.DEFAULT_NEAR_DUPLICATE_BITS
+        :type threshold: int
+        :param method: optional hash, one of HASHES, defaults to config.DEFAULT_PERCEPTUAL_HASH
+        :type method: str
+        :param skip: optional flag whether near duplicates are not stored, defaults to only logging them
+        :type skip: bool
+        :param index_path: optional file keeping the hashes of the stored images between crawls, defaults to an index per crawler
+        :type index_path: str
+        :param processes: optional number of hashing processes, defaults to the number of CPUs
+        :type processes: int
+        :return:
+        :raises ImportError: if NumPy or Pillow is not installed
+        """
+        if numpy is None or Image is None:
+            raise ImportError('near-duplicate detection needs NumPy and Pillow')
+        if not 0 <= threshold <= 64 or method not in HASHES:
+            raise ValueError('the threshold must be between 0 and 64 bits and the hash one of %s' % ', '.join(HASHES))
+
+        self.threshold = threshold
+        self.method = method
+        self.skip = skip
+        self.index_path = index_path
+        self.processes = processes or os.cpu_count() or 1
+        self.index = HashIndex.load(index_path) if index_path and os.path.exists(index_path) else HashIndex()
+
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._compared = threading.Condition(self._lock)
+
+    def _hash(self, path):
+        """
+        Starts hashing an image in the pool of processes, creating the pool on first use.
+
+        :param path: the image file
+        :type path: str
+        :return: the future of the hash
+        :rtype: concurrent.futures.Future
+        """
+        with self._lock:
+            if self._pool is None:
+                # spawned, since forking copies the locks held by the download threads
+                self._pool = concurrent.futures.ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool.submit(image_hash, path, self.method)
+
+    def _compare(self, value, number=0):
+        """
+        Compares a hash to the indexed hashes and adds it with the number of its image in the same step,
+        unless it is a near duplicate which is skipped. Called with the lock held.
+
+        :param value: the hash
+        :type value: int
+        :param number: optional number of the image, defaults to 0 until it is labelled
+        :type number: int
+        :return: the number of the nearest image and the distance if it is a near duplicate (otherwise None), and the slot
+                 of the hash in the index (None if it was not added)
+        :rtype: tuple
+        """
+        distance, nearest = self.index.nearest(value)
+        match = (nearest, distance) if distance is not None and distance <= self.threshold else None
+        if match is not None and self.skip:
+            return match, None
+        return match, self.index.add(value, number)
+
+    def check(self, path):
+        """
+        Hashes an image, waiting for the hash, and compares it to the indexed images. The image is added to the index,
+        unless it is a near duplicate which is skipped; the index ignores it until it is labelled with its number.
+
+        :param path: the image file
+        :type path: str
+        :return: the number of the nearest image and the distance if it is a near duplicate (otherwise None), and the slot
+                 of the image in the index, to be labelled with its number (None if it was not added)
+        :rtype: tuple
+        """
+        value = self._hash(path).result()
+        if value is None:
+            return None, None
+        with self._lock:
+            return self._compare(value)
+
+    def submit(self, path, number, report):
+        """
+        Hashes a stored image in the background and adds it to the index with its number. The image is hashed from
+        a link to the file, so the storage may move or remove it meanwhile.
+
+        :param path: the image file, before it is stored
+        :type path: str
+        :param number: the image number
+        :type number: int
+        :param report: called with the number of the nearest image and the distance if the image is a near duplicate
+        :type report: callable
+        :return:
+        """
+        link = path + config.HASH_SUFFIX
+        try:
+            os.link(path, link)
+        except OSError:
+            shutil.copyfile(path, link)
+
+        def compared(future):
+            try:
+                value = future.result()
+            except Exception:
+                value = None
+            finally:
+                os.remove(link)
+            with self._lock:
+                match = self._compare(value, number)[0] if value is not None else None
+            try:
+                if match is not None:
+                    report(*match)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    self._compared.notify_all()
+
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._hash(link)
+        except BaseException:
+            os.remove(link)
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(compared)
+
+    def wait(self):
+        """
+        Waits until the images submitted for hashing in the background are compared and reported.
+
+        :return:
+        """
+        with self._lock:
+            self._compared.wait_for(lambda: not self._pending)
+
+    def label(self, slot, number):
+        """
+        Sets the number of an indexed image once it is stored.
+
+        :param slot: the slot returned by check
+        :type slot: int
+        :param number: the image number
+        :type number: int
+        :return:
+        """
+        with self._lock:
+            self.index.label(slot, number)
+
+    def save(self):
+        """
+        Writes the index to the index file, if there is one.
+
+        :return:
+        """
+        if self.index_path:
+            with self._lock:
+                self.index.save(self.index_path)
+
+    def close(self):
+        """
+        Waits for the images hashed in the background, writes the index and stops the hashing processes.
+
+        :return:
+        """
+        self.wait()
+        self.save()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import contextlib
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+import config
+import metrics
+
+
+# stages of the thread reading and scheduling the urls, of the download threads (the phases of the metrics)
+# and of writing the log entries in any thread
+STAGES = ('read', 'dedup', 'schedule', 'collect', 'progress', 'download') + metrics.PHASES + ('log',)
+
+
+class StageCounters:
+    """
+    Always-on counters of the calls and seconds spent in each stage of a crawl, cheap enough to keep for every URL.
+    Each thread counts into counters of its own, so the threads do not contend for a lock; a report adding them up
+    can be taken at any time, also from a signal handler.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self._local = threading.local()
+        # the added up counters of finished threads and the thread and counters of each running thread, replaced as a
+        # whole when a thread starts counting, so they can be read without the lock
+        self._threads = ({}, ())
+        self._lock = threading.Lock()
+
+    def _counters(self):
+        # calls, seconds and maximal seconds of each stage counted by the calling thread
+        counters = {name: [0, 0.0, 0.0] for name in STAGES}
+        with self._lock:
+            finished, running = self._threads
+            finished = {name: list(values) for name, values in finished.items()}
+            alive = []
+            for thread, stages in running:
+                if thread.is_alive():
+                    alive.append((thread, stages))
+                else:
+                    _combine(finished, stages)
+            alive.append((threading.current_thread(), counters))
+            self._threads = (finished, tuple(alive))
+        self._local.stages = counters
+        return counters
+
+    def add(self, name, seconds):
+        """
+        Counts a call of a stage.
+
+        :param name: one of STAGES
+        :type name: str
+        :param seconds: the seconds spent in the stage
+        :type seconds: float
+        :return:
+        """
+        stages = getattr(self._local, 'stages', None)
+        if stages is None:
+            stages = self._counters()
+        counters = stages[name]
+        counters[0] += 1
+        counters[1] += seconds
+        if seconds > counters[2]:
+            counters[2] = seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Counts the time spent in the block for a stage.
+
+        :param name: one of STAGES
+        :type name: str
+        :return:
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def record(self, timing):
+        """
+        Counts the phases of a processed URL and its total time for the download stage.
+
+        :param timing: the timing of the URL
+        :type timing: metrics.Timing
+        :return:
+        """
+        for name, seconds in timing.phases.items():
+            if seconds:
+                self.add(name, seconds)
+        self.add('download', max(time.time() - timing.started, 0.0))
+
+    def snapshot(self):
+        """
+        Returns the counters of all threads added up without taking the lock, so a signal handler interrupting a thread
+        holding it does not wait forever. A stage counted at the same time may lag one call behind.
+
+        :return: calls, seconds and maximal seconds of each stage
+        :rtype: dict
+        """
+        finished, running = self._threads
+        totals = {name: [0, 0.0, 0.0] for name in STAGES}
+        _combine(totals, finished)
+        for thread, stages in running:
+            _combine(totals, stages)
+        return {name: tuple(counters) for name, counters in totals.items()}
+
+    def report(self):
+        """
+        Returns the counters as a table, one line per stage.
+
+        :return: the report
+        :rtype: str
+        """
+        lines = [config.STAGE_REPORT % (time.monotonic() - self.started)]
+        for name, (calls, seconds, longest) in self.snapshot().items():
+            lines.append(config.STAGE_REPORT_LINE % (name, calls, seconds, 1000 * seconds / calls if calls else 0.0, 1000 * longest))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, descriptor=None):
+        """
+        Writes the report to a file descriptor with a single unbuffered write, which is safe in a signal handler.
+
+        :param descriptor: optional file descriptor, defaults to the standard error
+        :type descriptor: int
+        :return:
+        """
+        os.write(sys.stderr.fileno() if descriptor is None else descriptor, self.report().encode())
+
+
+def _combine(totals, stages):
+    # adds the counters of a thread to the totals
+    for name, (calls, seconds, longest) in stages.items():
+        counters = totals.setdefault(name, [0, 0.0, 0.0])
+        counters[0] += calls
+        counters[1] += seconds
+        if longest > counters[2]:
+            counters[2] = longest
+
+
+class TimedHandler(logging.Handler):
+    """
+    Log handler counting the time spent by the logging threads in another handler for the log stage.
+    """
+    def __init__(self, handler, stages):
+        """
+        Timed handler constructor.
+
+        :param handler: the handler writing the log
+        :type handler: logging.Handler
+        :param stages: the counters of the stages
+        :type stages: StageCounters
+        :return:
+        """
+        super().__init__()
+        self.handler = handler
+        self.stages = stages
+
+    def handle(self, record):
+        started = time.perf_counter()
+        try:
+            return self.handler.handle(record)
+        finally:
+            self.stages.add('log', time.perf_counter() - started)
+
+    def emit(self, record):
+        self.handler.emit(record)
+
+    def flush(self):
+        self.handler.flush()
+
+    def close(self):
+        self.handler.close()
+        super().close()
+
+
+class Profiler:
+    """
+    Profiles a run with cProfile, the main thread as well as the download threads, and writes the combined
+    statistics in the pstats format.
+    """
+    def __init__(self, path):
+        """
+        Profiler constructor.
+
+        :param path: the file of the statistics
+        :type path: str
+        :return:
+        """
+        self.path = path
+        self._main = cProfile.Profile()
+        self._profiles = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts profiling the calling thread.
+
+        :return:
+        """
+        self._main.enable()
+
+    def wrap(self, function):
+        """
+        Returns a function profiling the calls of another function in the calling thread, for the download threads.
+
+        :param function: the function
+        :type function: callable
+        :return: the profiled function
+        :rtype: callable
+        """
+        @functools.wraps(function)
+        def profiled(*args, **kwargs):
+            profile = getattr(self._local, 'profile', None)
+            if profile is None:
+                profile = self._local.profile = cProfile.Profile()
+                with self._lock:
+                    self._profiles.append(profile)
+            try:
+                profile.enable()
+            except ValueError:
+                # since Python 3.12 the profile of the main thread observes all threads and no other may be enabled
+                return function(*args, **kwargs)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profile.disable()
+        return profiled
+
+    def stop(self):
+        """
+        Stops profiling and writes the statistics of all threads.
+
+        :return: the statistics, None if nothing was profiled
+        :rtype: pstats.Stats
+        """
+        self._main.disable()
+        with self._lock:
+            profiles = [profile for profile in [self._main] + self._profiles if profile.getstats()]
+        if not profiles:
+            return None
+        statistics = pstats.Stats(*profiles)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        statistics.dump_stats(self.path)
+        return statistics
+
+
+class MemoryTracer:
+    """
+    Traces the memory allocations with tracemalloc and logs the lines of code allocating the most at intervals,
+    with their growth since the previous snapshot, from a background thread.
+    """
+    def __init__(self, interval, logger, top=config.TRACE_MEMORY_TOP):
+        """
+        Memory tracer constructor.
+
+        :param interval: seconds between snapshots
+        :type interval: float
+        :param logger: the log receiving the snapshots
+        :type logger: logging.Logger
+        :param top: optional number of lines logged per snapshot, defaults to config.TRACE_MEMORY_TOP
+        :type top: int
+        :return:
+        """
+        if interval <= 0 or top < 1:
+            raise ValueError('the interval and number of lines must be positive')
+
+        self.interval = interval
+        self.logger = logger
+        self.top = top
+        self.snapshots = 0
+        self._previous = None
+        self._tracing = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts tracing, unless tracemalloc is already tracing, and the thread taking the snapshots.
+
+        :return:
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self._thread = threading.Thread(target=self._run, name='memory', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.snapshot()
+
+    def snapshot(self):
+        """
+        Takes a snapshot and logs the total traced memory and the lines allocating the most.
+
+        :return:
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        if self._previous is None:
+            statistics = snapshot.statistics('lineno')
+        else:
+            statistics = sorted(snapshot.compare_to(self._previous, 'lineno'), key=lambda statistic: statistic.size, reverse=True)
+        self._previous = snapshot
+        self.snapshots += 1
+        self.logger.info(config.LOG_MEMORY, sum(statistic.size for statistic in statistics) / 1e6,
+                         sum(statistic.count for statistic in statistics))
+        for statistic in statistics[:self.top]:
+            frame = statistic.traceback[0]
+            self.logger.info(config.LOG_MEMORY_LINE, frame.filename, frame.lineno, statistic.size / 1024,
+                             getattr(statistic, 'size_diff', statistic.size) / 1024, statistic.count)
+
+    def stop(self):
+        """
+        Stops the snapshots after a last one, and the tracing if it was started by the tracer.
+
+        :return:
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.snapshot()
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
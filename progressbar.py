@@ -1,11 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import logging
 import math
+import sys
+import threading
 import time
 
 import config
 
+
 class ProgressBar:
     """
     Displays progress bar, current value, and percentage (presuming count from 0 to max_value).
@@ -20,15 +24,26 @@ class ProgressBar:
         :type width: int
         :return:
         """
-        self.max_value = float(max_value)
         self.bar_width = width
-        self.digits = math.ceil(math.log10(self.max_value + 1))
-        self.text_format = '[%%0%dd / %d] |%%s%%s| %%.1f%%%%' % (self.digits, self.max_value)
         self.printed_characters = 0
+        self.resize(max_value)
 
         self.current_value = 0.0
         self.set(0.0)
 
+    def resize(self, max_value):
+        """
+        Changes the value at which the bar reaches 100 percent, e.g. when the total is only estimated.
+        The bar is redrawn with the next call of set.
+
+        :param max_value: maximal (numerical) value at which the bar will reach 100 percent completion
+        :type max_value: int, float
+        :return:
+        """
+        self.max_value = float(max_value)
+        self.digits = max(math.ceil(math.log10(self.max_value + 1)), 1)
+        self.text_format = '[%%0%dd / %d] |%%s%%s| %%.1f%%%%' % (self.digits, self.max_value)
+
     def set(self, value=1.0):
         """
         Updates the printed progress bar and counters by returning the carriage to the beginning of the line 
@@ -45,13 +60,24 @@ class ProgressBar:
         print(self.printed_characters * '\r', end='', flush=True)
 
         # print the current status
-        percentage = min(self.current_value / self.max_value * 100, 100.0)
-        bars = int(math.floor(percentage * self.bar_width / 100.0))
-        output = self.text_format % (self.current_value, bars * '=', (self.bar_width - bars) * '-', percentage)
-
+        output = self.text()
         print(output, end='', flush=True)
         self.printed_characters = len(output)
 
+    def percentage(self):
+        return min(self.current_value / self.max_value * 100, 100.0) if self.max_value else 100.0
+
+    def text(self):
+        """
+        Returns the bar, current value and percentage as printed.
+
+        :return: the progress text
+        :rtype: str
+        """
+        percentage = self.percentage()
+        bars = int(math.floor(percentage * self.bar_width / 100.0))
+        return self.text_format % (self.current_value, bars * '=', (self.bar_width - bars) * '-', percentage)
+
     def complete(self, text=config.PROGRESS_COMPLETE):
         """
         Sets the progress to 100 percent and a comment upon completion
@@ -64,6 +90,160 @@ class ProgressBar:
         print(' %s' % text)
 
 
+class Dashboard(ProgressBar):
+    """
+    Thread-safe progress display of a crawl, which is redrawn on a fixed interval by a background thread instead of on
+    every update. Besides the bar it shows the URLs and megabytes per second, the estimated time left, the active
+    downloads and the number of errors. On a terminal the line is redrawn in place, otherwise a status line is printed
+    once per interval.
+    """
+    def __init__(self, max_value, start=0, width=config.PROGRESS_BAR_WIDTH, interval=None, stream=None):
+        """
+        Dashboard constructor. Starts the thread drawing the progress.
+
+        :param max_value: maximal (numerical) value at which the bar will reach 100 percent completion
+        :type max_value: int, float
+        :param start: optional value at which the progress starts, e.g. when resuming, defaults to 0
+        :type start: int, float
+        :param width: optional width of the progress bar, defaults to config.PROGRESS_BAR_WIDTH
+        :type width: int
+        :param interval: optional seconds between redraws, defaults to config.PROGRESS_INTERVAL on a terminal
+                         and config.PROGRESS_LINE_INTERVAL otherwise
+        :type interval: float
+        :param stream: optional output, defaults to the standard output
+        :type stream: file
+        :return:
+        """
+        self.stream = sys.stdout if stream is None else stream
+        try:
+            self.terminal = self.stream.isatty()
+        except (AttributeError, ValueError):
+            self.terminal = False
+        if interval is None:
+            interval = config.PROGRESS_INTERVAL if self.terminal else config.PROGRESS_LINE_INTERVAL
+        self.interval = interval
+        self.start = float(start)
+        self.bytes = 0
+        self.errors = 0
+        self.active = 0
+
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stopped = threading.Event()
+        super().__init__(max_value, width)
+        self.set(start)
+        if self.terminal:
+            self._draw()
+        self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+        self._thread.start()
+
+    def resize(self, max_value):
+        with self._lock:
+            super().resize(max_value)
+
+    def set(self, value=1.0, active=None):
+        """
+        Sets the current value and the number of active downloads, which are drawn with the next redraw.
+
+        :param value: optional current value, defaults to 1.0
+        :type value: int, float
+        :param active: optional number of active downloads, defaults to keeping the number
+        :type active: int
+        :return:
+        """
+        value = max(min(float(value), self.max_value), 0.0)
+        with self._lock:
+            self.current_value = value
+            if active is not None:
+                self.active = active
+
+    def add(self, size=0, errors=0):
+        """
+        Counts received bytes and errors, may be called by many threads.
+
+        :param size: optional number of received bytes, defaults to 0
+        :type size: int
+        :param errors: optional number of errors, defaults to 0
+        :type errors: int
+        :return:
+        """
+        with self._lock:
+            self.bytes += size
+            self.errors += errors
+
+    def count_errors(self, record):
+        """
+        Log filter counting the error entries of a logger, passes all entries.
+
+        :param record: a log entry
+        :type record: logging.LogRecord
+        :return: True
+        :rtype: bool
+        """
+        if record.levelno >= logging.ERROR:
+            self.add(errors=1)
+        return True
+
+    def status(self):
+        """
+        Returns the progress with the rates, the estimated time left, the active downloads and the errors.
+
+        :return: the status text, with the bar on a terminal
+        :rtype: str
+        """
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started, 1e-9)
+            done = self.current_value - self.start
+            rate = done / elapsed
+            if rate > 0:
+                seconds = int((self.max_value - self.current_value) / rate)
+                eta = '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+            else:
+                eta = '-:--:--'
+            progress = self.text() if self.terminal else '%d / %d urls (%.1f%%)' % (self.current_value, self.max_value, self.percentage())
+            return config.PROGRESS_STATUS % (progress, rate, self.bytes / elapsed / 1e6, eta, self.active, self.errors)
+
+    def _draw(self):
+        output = self.status()
+        if self.terminal:
+            # overwrite the previous line, blanking what is left of a longer one
+            self.stream.write('\r' + output + max(self.printed_characters - len(output), 0) * ' ')
+            self.printed_characters = len(output)
+        else:
+            self.stream.write(output + '\n')
+        self.stream.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._draw()
+
+    def close(self):
+        """
+        Stops redrawing the progress.
+
+        :return:
+        """
+        self._stopped.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def complete(self, text=config.PROGRESS_COMPLETE):
+        """
+        Stops redrawing, draws the final progress at 100 percent and a comment upon completion.
+
+        :param text: optional comment or message to be printed, defaults to "completed"
+        :type text: str, any printable
+        :return:
+        """
+        self.close()
+        self.set(self.max_value, 0)
+        output = self.status()
+        if self.terminal:
+            output = '\r' + output + max(self.printed_characters - len(output), 0) * ' '
+        self.stream.write('%s %s\n' % (output, text))
+        self.stream.flush()
+
+
 if __name__ == '__main__':
     lines = 15
     bar = ProgressBar(lines)
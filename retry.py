@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import errno
+import http.client
+import random
+import ssl
+import threading
+import time
+import urllib.error
+
+import config
+
+
+# like the statuses, only the errors of the connection itself are retried, not those of the name, URL or certificate
+RETRY_ERRORS = (TimeoutError, ConnectionError, ssl.SSLEOFError, ssl.SSLZeroReturnError, http.client.IncompleteRead,
+                http.client.BadStatusLine)
+RETRY_ERRNOS = (errno.ECONNRESET, errno.ECONNREFUSED, errno.ECONNABORTED, errno.EPIPE, errno.ETIMEDOUT,
+                errno.ENETDOWN, errno.ENETUNREACH, errno.EHOSTDOWN, errno.EHOSTUNREACH)
+
+
+def transient(error):
+    """
+    Checks whether a failed request may succeed when repeated: timeouts, resets and refused connections,
+    unreachable networks, incomplete bodies and the HTTP statuses of overloaded or failing servers.
+    Name resolution failures, certificate verification failures and other HTTP errors are final.
+
+    :param error: the error of the request
+    :type error: Exception
+    :return: a flag indicating whether the request should be retried
+    :rtype: bool
+    """
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code in config.RETRY_STATUSES
+    if isinstance(error, urllib.error.URLError):
+        error = error.reason
+    if isinstance(error, RETRY_ERRORS):
+        return True
+    if isinstance(error, OSError) and not isinstance(error, ssl.SSLError):
+        return error.errno in RETRY_ERRNOS
+    return bool(getattr(error, 'transient', False))
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time up to base * 2 ** n seconds,
+    bounded by cap, so clients failing together do not retry in lockstep.
+    """
+    def __init__(self, base=config.RETRY_BACKOFF, cap=config.RETRY_BACKOFF_CAP):
+        """
+        Backoff constructor.
+
+        :param base: optional seconds of the first backoff, defaults to config.RETRY_BACKOFF
+        :type base: int, float
+        :param cap: optional maximal seconds of a backoff, defaults to config.RETRY_BACKOFF_CAP
+        :type cap: int, float
+        :return:
+        """
+        if base < 0 or cap < 0:
+            raise ValueError('backoff must not be negative')
+
+        self.base = base
+        self.cap = cap
+
+    def delay(self, attempt):
+        """
+        Returns the seconds to wait before a retry.
+
+        :param attempt: the zero-based number of the failed attempt
+        :type attempt: int
+        :return: the backoff in seconds
+        :rtype: float
+        """
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Thread-safe per-host circuit breaker. A host failing threshold times in a row is opened, its requests are
+    rejected without being sent until the cooldown passed. Then a single trial request is let through, which
+    closes the circuit on success or opens it again on failure.
+    """
+    def __init__(self, threshold=config.BREAKER_THRESHOLD, cooldown=config.BREAKER_COOLDOWN):
+        """
+        Circuit breaker constructor.
+
+        :param threshold: optional number of consecutive failures opening the circuit of a host, 0 disables the breaker,
+                          defaults to config.BREAKER_THRESHOLD
+        :type threshold: int
+        :param cooldown: optional seconds a circuit stays open, defaults to config.BREAKER_COOLDOWN
+        :type cooldown: int, float
+        :return:
+        """
+        if threshold < 0 or cooldown < 0:
+            raise ValueError('threshold and cooldown must not be negative')
+
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.opened = 0
+        self.rejected = 0
+
+        self._failures = {}
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        """
+        Checks whether a request to a host may be sent.
+
+        :param host: the host (netloc) of the request
+        :type host: str
+        :return: a flag indicating whether the request may be sent
+        :rtype: bool
+        """
+        with self._lock:
+            opened = self._open.get(host)
+            if opened is None:
+                return True
+            now = time.monotonic()
+            if now - opened >= self.cooldown:
+                # half open, further requests wait for the outcome of this trial
+                self._open[host] = now
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._open.pop(host, None)
+
+    def failure(self, host):
+        """
+        Counts a failed request to a host, opening its circuit at the threshold.
+
+        :param host: the host (netloc) of the request
+        :type host: str
+        :return:
+        """
+        if not self.threshold:
+            return
+        with self._lock:
+            failures = self._failures[host] = self._failures.get(host, 0) + 1
+            if host in self._open:
+                # the trial request failed
+                self._open[host] = time.monotonic()
+            elif failures >= self.threshold:
+                self._open[host] = time.monotonic()
+                self.opened += 1
+
+    def is_open(self, host):
+        with self._lock:
+            return host in self._open
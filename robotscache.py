@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import json
+import os
+import os.path
+import threading
+import time
+import urllib.robotparser
+
+import config
+
+
+class RobotsEntry:
+    """
+    Cached outcome of fetching the robots.txt of a host: the HTTP status and the rule lines on success,
+    or no status at all if the host was unreachable.
+    """
+    __slots__ = ('fetched', 'status', 'lines', '_parser')
+
+    def __init__(self, status, lines=None, fetched=None):
+        """
+        Robots entry constructor.
+
+        :param status: HTTP status of the robots.txt request, None if the host could not be reached
+        :type status: int, None
+        :param lines: the lines of the robots.txt, if it was retrieved
+        :type lines: list of str
+        :param fetched: time stamp of the retrieval, defaults to now
+        :type fetched: float
+        :return:
+        """
+        self.fetched = time.time() if fetched is None else fetched
+        self.status = status
+        self.lines = lines or []
+        self._parser = None
+
+    @property
+    def reachable(self):
+        return self.status is not None
+
+    @property
+    def transient(self):
+        # unreachable hosts and failing or overloaded servers may answer soon, their entries expire early
+        return self.status is None or self.status in config.RETRY_STATUSES or self.status >= 500
+
+    def parser(self):
+        """
+        Returns the parsed rules, mirroring the status handling of urllib.robotparser.RobotFileParser.read():
+        access restrictions and server errors disallow everything, other client errors (e.g. 404) allow everything.
+
+        :return: the parsed robots.txt
+        :rtype: urllib.robotparser.RobotFileParser
+        """
+        if self._parser is None:
+            parser = urllib.robotparser.RobotFileParser()
+            if self.status in (401, 403) or self.status >= 500:
+                parser.disallow_all = True
+            elif self.status >= 400:
+                parser.allow_all = True
+            else:
+                parser.parse(self.lines)
+            self._parser = parser
+        return self._parser
+
+
+class RobotsCache:
+    """
+    Thread-safe cache of robots.txt rules keyed on scheme and netloc, with an expiry time and
+    least-recently-used eviction once the maximal number of entries is reached. Transient failures (unreachable hosts,
+    server errors) expire after a short negative time to live.
+    Optionally persisted as a JSON file without the transient failures, so repeated crawls start with the rules already known.
+    """
+    def __init__(self, ttl=config.ROBOTS_CACHE_TTL, max_entries=config.ROBOTS_CACHE_SIZE, path=None,
+                 negative_ttl=config.ROBOTS_NEGATIVE_TTL):
+        """
+        Robots cache constructor. Loads the persisted entries if a path is given and the file exists.
+
+        :param ttl: optional number of seconds an entry stays valid, defaults to config.ROBOTS_CACHE_TTL
+        :type ttl: int, float
+        :param max_entries: optional maximal number of cached hosts, defaults to config.ROBOTS_CACHE_SIZE
+        :type max_entries: int
+        :param path: optional file in which the cache is persisted
+        :type path: str
+        :param negative_ttl: optional number of seconds an entry of a transient failure stays valid, defaults to config.ROBOTS_NEGATIVE_TTL
+        :type negative_ttl: int, float
+        :return:
+        """
+        if max_entries < 1:
+            raise ValueError('robots cache size must be positive')
+
+        self.ttl = ttl
+        self.negative_ttl = min(negative_ttl, ttl)
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # the error of loading a corrupt cache file, for the crawl log
+        self.load_error = None
+
+        self._entries = collections.OrderedDict()
+        self._fetching = {}
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(scheme, netloc):
+        return '%s://%s' % (scheme.lower(), netloc.lower())
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry.fetched > (self.negative_ttl if entry.transient else self.ttl):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, scheme, netloc):
+        """
+        Returns the valid entry of a host without fetching it, None if there is none.
+
+        :param scheme: the URL scheme
+        :type scheme: str
+        :param netloc: the URL netloc
+        :type netloc: str
+        :return: the cached entry
+        :rtype: RobotsEntry
+        """
+        with self._lock:
+            return self._get(self.key(scheme, netloc), time.time())
+
+    def put(self, scheme, netloc, entry):
+        """
+        Stores the entry of a host, evicting the least recently used entries beyond the maximal size.
+
+        :param scheme: the URL scheme
+        :type scheme: str
+        :param netloc: the URL netloc
+        :type netloc: str
+        :param entry: the entry to be cached
+        :type entry: RobotsEntry
+        :return:
+        """
+        with self._lock:
+            self._put(self.key(scheme, netloc), entry)
+
+    def lookup(self, scheme, netloc, fetch):
+        """
+        Returns the entry of a host, calling fetch on a miss. Concurrent lookups of the same host wait
+        for a single fetch instead of requesting the robots.txt several times.
+
+        :param scheme: the URL scheme
+        :type scheme: str
+        :param netloc: the URL netloc
+        :type netloc: str
+        :param fetch: callable without arguments retrieving the robots.txt of the host
+        :type fetch: callable returning RobotsEntry
+        :return: the cached or fetched entry
+        :rtype: RobotsEntry
+        """
+        key = self.key(scheme, netloc)
+        while True:
+            with self._lock:
+                entry = self._get(key, time.time())
+                if entry is not None:
+                    self.hits += 1
+                    return entry
+                event = self._fetching.get(key)
+                if event is None:
+                    event = self._fetching[key] = threading.Event()
+                    self.misses += 1
+                    break
+            event.wait()
+
+        try:
+            entry = fetch()
+            with self._lock:
+                self._put(key, entry)
+        finally:
+            with self._lock:
+                del self._fetching[key]
+            event.set()
+        return entry
+
+    def load(self):
+        """
+        Reads the persisted entries, skipping the expired ones. A truncated or corrupt file is ignored, keeping its error
+        in load_error, so the cache starts empty.
+
+        :return:
+        """
+        try:
+            with open(self.path, 'r') as handle:
+                stored = json.load(handle)
+            entries = [(key, RobotsEntry(status, lines, fetched)) for key, (fetched, status, lines) in stored.items()]
+        except (OSError, ValueError, TypeError, AttributeError) as error:
+            self.load_error = error
+            return
+        now = time.time()
+        with self._lock:
+            for key, entry in entries:
+                if now - entry.fetched <= self.ttl:
+                    self._put(key, entry)
+
+    def save(self):
+        """
+        Persists the entries in least recently used order, if the cache has a path. Transient failures are not persisted.
+        The file is replaced atomically so an interrupted save keeps the previous state.
+
+        :return:
+        """
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            stored = collections.OrderedDict((key, (entry.fetched, entry.status, entry.lines))
+                                             for key, entry in self._entries.items() if not entry.transient)
+        temporary = '%s.tmp' % self.path
+        with open(temporary, 'w') as handle:
+            json.dump(stored, handle)
+        os.replace(temporary, self.path)
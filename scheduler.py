@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import heapq
+
+import config
+
+
+class HostScheduler:
+    """
+    Queues URLs per host and hands them out by the earliest time their host may be requested again, so requests
+    interleave across hosts instead of following the file order. Each host gets at most host_workers concurrent
+    requests, and successive requests to a host start at least its delay apart. Until the first request of a host
+    finished and reported the delay of the host (e.g. from its robots.txt), the host gets a single request at a time.
+    Hosts ready at the same time are served round-robin. With a controller, the concurrent requests of a host are further
+    limited by the limit the controller adapted for it. Not thread-safe, it is driven by the thread dispatching
+    the downloads.
+    """
+    def __init__(self, host_workers=config.DEFAULT_HOST_WORKERS, default_delay=config.DEFAULT_CRAWL_DELAY, controller=None):
+        """
+        Scheduler constructor.
+
+        :param host_workers: optional number of concurrent requests per host, defaults to config.DEFAULT_HOST_WORKERS
+        :type host_workers: int
+        :param default_delay: optional seconds between requests to a host without own delay, defaults to config.DEFAULT_CRAWL_DELAY
+        :type default_delay: int, float
+        :param controller: optional adaptive limits of the concurrent requests per host, defaults to host_workers for every host
+        :type controller: pacing.AimdController
+        :return:
+        """
+        if host_workers < 1 or default_delay < 0:
+            raise ValueError('host workers must be positive and the delay must not be negative')
+
+        self.host_workers = host_workers
+        self.default_delay = default_delay
+        self.controller = controller
+        self.queued = 0
+
+        self._queues = {}
+        self._in_flight = collections.Counter()
+        self._last_start = {}
+        self._delays = {}
+        self._ready = []
+        self._scheduled = set()
+        self._sequence = 0
+
+    def __len__(self):
+        return self.queued
+
+    def delay(self, host):
+        return self._delays.get(host, self.default_delay)
+
+    def delay_known(self, host):
+        return host in self._delays
+
+    def _ready_time(self, host):
+        last_start = self._last_start.get(host)
+        return 0.0 if last_start is None else last_start + self.delay(host)
+
+    def _capacity(self, host):
+        if host not in self._delays:
+            return 1
+        if self.controller is None:
+            return self.host_workers
+        return min(self.host_workers, self.controller.host_limit(host))
+
+    def _schedule(self, host):
+        if host in self._scheduled or not self._queues.get(host) or self._in_flight[host] >= self._capacity(host):
+            return
+        self._sequence += 1
+        heapq.heappush(self._ready, (self._ready_time(host), self._sequence, host))
+        self._scheduled.add(host)
+
+    def add(self, host, item):
+        """
+        Queues an item for a host.
+
+        :param host: the host (netloc) of the URL
+        :type host: str
+        :param item: the item to be handed out, e.g. the URL
+        :type item: any
+        :return:
+        """
+        queue = self._queues.get(host)
+        if queue is None:
+            queue = self._queues[host] = collections.deque()
+        queue.append(item)
+        self.queued += 1
+        self._schedule(host)
+
+    def pop(self, now):
+        """
+        Hands out the next item of the host which is ready the longest.
+
+        :param now: the current time (time.monotonic())
+        :type now: float
+        :return: host and item, or None and the seconds until the next host is ready (None if nothing is waiting)
+        :rtype: tuple
+        """
+        while self._ready:
+            ready, sequence, host = self._ready[0]
+            if ready > now:
+                return None, ready - now
+            heapq.heappop(self._ready)
+
+            # the delay of the host may have grown since it was scheduled
+            actual = self._ready_time(host)
+            if actual > now:
+                self._sequence += 1
+                heapq.heappush(self._ready, (actual, self._sequence, host))
+                continue
+
+            self._scheduled.discard(host)
+            queue = self._queues[host]
+            item = queue.popleft()
+            if not queue:
+                del self._queues[host]
+            self.queued -= 1
+            self._in_flight[host] += 1
+            self._last_start[host] = now
+            self._schedule(host)
+            return host, item
+        return None, None
+
+    def done(self, host, delay=None):
+        """
+        Releases a request slot of a host, optionally setting the delay of the host (e.g. from its robots.txt).
+
+        :param host: the host (netloc) of the finished URL
+        :type host: str
+        :param delay: optional seconds between requests to the host
+        :type delay: int, float
+        :return:
+        """
+        if delay is not None:
+            self._delays[host] = delay
+        self._in_flight[host] -= 1
+        if self._in_flight[host] <= 0:
+            del self._in_flight[host]
+            # forget idle hosts which need no spacing of their requests
+            if host not in self._queues and not self.delay(host):
+                self._last_start.pop(host, None)
+                self._delays.pop(host, None)
+        self._schedule(host)
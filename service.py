@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import os.path
+import socketserver
+import threading
+import time
+
+import config
+import storage
+
+
+class _BatchHandler(socketserver.StreamRequestHandler):
+    # a batch is the urls sent until the client shuts down writing or sends an empty line
+    timeout = config.SOCKET_TIMEOUT
+
+    def handle(self):
+        urls = []
+        for line in self.rfile:
+            if not line.strip():
+                break
+            urls.append(line.decode('utf-8', 'replace'))
+        self.server.service.socket_batch(urls, self.wfile)
+
+
+class _BatchServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # closing the server waits for the accepted batches
+    daemon_threads = False
+    block_on_close = True
+
+
+class CrawlService:
+    """
+    Resident crawler taking URL batches from a spool directory and a Unix domain socket, so the connection pool,
+    DNS and robots.txt caches, storage and manifest stay warm between batches. Batches are crawled one at a time
+    by the same crawler. Each batch gets a log and a results file (a JSON line per URL) in the batches directory
+    next to the service log.
+
+    A URL file is handed to the spool by moving it into the spool directory once it is complete (names starting
+    with a dot are ignored). It is claimed by moving it into the .work subdirectory and moved to the batches
+    directory when it is crawled. A socket client sends the URLs one per line and shuts down writing (or sends an empty
+    line), then receives the result of each URL as a JSON line as soon as it is processed.
+
+    A batch failing with an error is logged and gets an error file in the batches directory (a socket client
+    receives the error as the last JSON line), and the service goes on with the next batch.
+
+    Stopping finishes the batches already accepted, URL files left in the spool are crawled by the next service.
+    """
+    def __init__(self, crawler, destination_dir, log_file, spool=None, socket_path=None, poll=config.SPOOL_POLL):
+        """
+        Service constructor.
+
+        :param crawler: the crawler of the batches
+        :type crawler: imgcrawl.ImgCrawler
+        :param destination_dir: directory in which to store the images of all batches
+        :type destination_dir: str
+        :param log_file: file name or path to the log of the service, the batch files are written next to it
+        :type log_file: str
+        :param spool: optional directory watched for URL files, defaults to no spool
+        :type spool: str
+        :param socket_path: optional path of the Unix domain socket receiving URLs, defaults to no socket
+        :type socket_path: str
+        :param poll: optional seconds between looks into the spool, defaults to config.SPOOL_POLL
+        :type poll: float
+        :return:
+        """
+        if spool is None and socket_path is None:
+            raise ValueError('a spool directory or a socket is needed')
+
+        self.crawler = crawler
+        self.destination_dir = destination_dir
+        self.log_file = log_file
+        self.spool = spool
+        self.socket_path = socket_path
+        self.poll = poll
+        self.batches = 0
+        self.batch_dir = os.path.join(os.path.dirname(log_file), config.BATCH_DIRECTORY)
+        # set by a signal handler, so it is a plain flag instead of an event
+        self.stopping = False
+
+        self._store = None
+        self._server = None
+        self._received = 0
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """
+        Stops taking new batches, run returns once the accepted batches are crawled. Safe to call from a signal handler.
+
+        :return:
+        """
+        self.stopping = True
+
+    def run(self):
+        """
+        Crawls the batches of the spool and the socket until stopped.
+
+        :return:
+        """
+        os.makedirs(self.batch_dir, exist_ok=True)
+        logger = self.crawler.setup_log(self.log_file)
+        self._store = storage.create(self.crawler.storage, self.destination_dir)
+        try:
+            if self.socket_path is not None:
+                if os.path.exists(self.socket_path):
+                    os.remove(self.socket_path)
+                self._server = _BatchServer(self.socket_path, _BatchHandler)
+                self._server.service = self
+                threading.Thread(target=self._server.serve_forever, args=(config.SPOOL_POLL,), name='socket', daemon=True).start()
+            if self.spool is not None:
+                self._requeue()
+            logger.info(config.LOG_SERVICE_STARTED, self.spool, self.socket_path)
+
+            while not self.stopping:
+                if self.spool is not None:
+                    for name in self._spooled():
+                        if self.stopping:
+                            break
+                        self._spool_batch(name, logger)
+                time.sleep(self.poll)
+        finally:
+            if self._server is not None:
+                self._server.shutdown()
+                self._server.server_close()
+                os.remove(self.socket_path)
+            self._store.close()
+            logger.info(config.LOG_SERVICE_STOPPED, self.batches)
+            self.crawler.shutdown_log(logger)
+
+    def _requeue(self):
+        # batches interrupted by a crash are crawled again
+        work = os.path.join(self.spool, config.SPOOL_WORK)
+        os.makedirs(work, exist_ok=True)
+        for name in os.listdir(work):
+            os.replace(os.path.join(work, name), os.path.join(self.spool, name))
+
+    def _spooled(self):
+        with os.scandir(self.spool) as entries:
+            return sorted(entry.name for entry in entries if entry.is_file() and not entry.name.startswith('.'))
+
+    def _spool_batch(self, name, logger):
+        claimed = os.path.join(self.spool, config.SPOOL_WORK, name)
+        try:
+            os.rename(os.path.join(self.spool, name), claimed)
+        except FileNotFoundError:
+            # taken by another service sharing the spool
+            return
+        with open(claimed, encoding='utf-8', errors='replace') as handle:
+            self.batch(name, (url for url in handle if url.strip()), logger=logger)
+        os.replace(claimed, os.path.join(self.batch_dir, config.BATCH_URLS % name))
+
+    def socket_batch(self, urls, output):
+        """
+        Crawls a batch received by the socket, sending the results back. Runs in the thread of the connection.
+
+        :param urls: the URLs of the batch
+        :type urls: list of str
+        :param output: the connection to the client
+        :type output: file
+        :return:
+        """
+        with self._lock:
+            self._received += 1
+            name = config.BATCH_SOCKET % (time.strftime('%Y%m%d-%H%M%S'), self._received)
+        self.batch(name, urls, output, logging.getLogger(self.log_file))
+
+    def batch(self, name, urls, output=None, logger=None):
+        """
+        Crawls a batch of URLs into the destination directory, writing the log and results of the batch.
+        Batches are crawled one at a time.
+
+        :param name: the name of the batch
+        :type name: str
+        :param urls: the URLs
+        :type urls: iterable of str
+        :param output: optional binary file receiving each result as a JSON line, defaults to the results file only
+        :type output: file
+        :param logger: optional log of the service, defaults to none
+        :type logger: logging.Logger
+        :return: the number of URLs and of stored images
+        :rtype: tuple
+        """
+        with self._lock:
+            started = time.monotonic()
+            count = stored = 0
+            error = None
+            batch_log = logging.getLogger(config.LOG_NAME)
+            batch_log.setLevel(logging.INFO)
+            handler = self.crawler.log_handler(os.path.join(self.batch_dir, config.BATCH_LOG % name))
+            batch_log.addHandler(handler)
+            try:
+                with open(os.path.join(self.batch_dir, config.BATCH_RESULTS % name), 'w') as results:
+                    for result in self.crawler.crawl(urls, self._store):
+                        count += 1
+                        stored += result.stored
+                        line = json.dumps(result.record()) + '\n'
+                        results.write(line)
+                        if output is not None:
+                            try:
+                                output.write(line.encode())
+                                output.flush()
+                            except OSError:
+                                # the client left, the batch is still crawled
+                                output = None
+            except Exception as exception:
+                # a failing batch must not stop the service, which would only fail on it again when restarted
+                error = '%s: %s' % (type(exception).__name__, exception)
+                with open(os.path.join(self.batch_dir, config.BATCH_ERROR % name), 'w') as marker:
+                    marker.write(error + '\n')
+                if output is not None:
+                    try:
+                        output.write((json.dumps({'error': error}) + '\n').encode())
+                        output.flush()
+                    except OSError:
+                        pass
+            finally:
+                batch_log.removeHandler(handler)
+                handler.close()
+            self.batches += 1
+        if logger is not None:
+            if error is not None:
+                logger.error(config.LOG_SERVICE_FAILED, name, count, error)
+            else:
+                logger.info(config.LOG_SERVICE_BATCH, name, count, stored, time.monotonic() - started)
+        return count, stored
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import hashlib
+import heapq
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+
+import config
+import manifest
+import progressbar
+
+
+def parse_shard(value):
+    """
+    Parses a shard given as i/N, the zero-based index of the shard and the number of shards.
+
+    :param value: the shard argument
+    :type value: str
+    :return: index and count of the shard
+    :rtype: tuple
+    :raises argparse.ArgumentTypeError: if the value is no valid shard
+    """
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('shard must be given as i/N: %s' % value)
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError('shard index must be between 0 and %d: %s' % (count - 1, value))
+    return index, count
+
+
+def shard_of(url, count):
+    """
+    Returns the shard of an URL by a stable hash of its host, so all URLs of a host are crawled by the same shard.
+
+    :param url: the URL
+    :type url: str
+    :param count: the number of shards
+    :type count: int
+    :return: the zero-based index of the shard
+    :rtype: int
+    """
+    host = urllib.parse.urlparse(url).netloc.lower()
+    return int.from_bytes(hashlib.md5(host.encode('utf-8', 'replace')).digest()[:8], 'big') % count
+
+
+def shard_path(path, index, count):
+    """
+    Returns the path of a file (log, manifest, robots.txt cache) of a shard.
+
+    :param path: the path of the file of the whole crawl
+    :type path: str
+    :param index: the zero-based index of the shard
+    :type index: int
+    :param count: the number of shards
+    :type count: int
+    :return: the path for the shard
+    :rtype: str
+    """
+    return path + config.SHARD_SUFFIX % (index, count)
+
+
+def strip_options(argv, names):
+    """
+    Removes options with a value from command line arguments.
+
+    :param argv: the command line arguments
+    :type argv: list of str
+    :param names: the names of the options to be removed
+    :type names: tuple of str
+    :return: the remaining arguments
+    :rtype: list of str
+    """
+    remaining = []
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument in names:
+            next(arguments, None)
+        elif not argument.startswith(tuple('%s=' % name for name in names)):
+            remaining.append(argument)
+    return remaining
+
+
+def _template(template):
+    # a pattern matching the messages of a log template, with the %(name)d fields as named groups
+    parts, position = [], 0
+    for field in re.finditer(r'%\((\w+)\)d|%s', template):
+        parts.append(re.escape(template[position:field.start()]))
+        parts.append(r'(?P<%s>\d+)' % field.group(1) if field.group(1) else '.*')
+        position = field.end()
+    parts.append(re.escape(template[position:]))
+    return re.compile(''.join(parts) + '$')
+
+
+def merge(log_file, count, manifest_path=None):
+    """
+    Merges the logs of the shards of a crawl in time order into the log file, with a single initial message and
+    a single summary adding up the counters of the shards, and the shard manifests into the manifest.
+    The shard logs are removed, their journals are kept.
+
+    :param log_file: file name or path to the log file of the whole crawl
+    :type log_file: str
+    :param count: the number of shards
+    :type count: int
+    :param manifest_path: optional file name or path to the manifest of the whole crawl
+    :type manifest_path: str
+    :return:
+    """
+    initial, summary = _template(config.LOG_INITIAL_MESSAGE), _template(config.LOG_SUMMARY)
+    paths = [path for path in (shard_path(log_file, index, count) for index in range(count)) if os.path.exists(path)]
+    logs = [open(path, 'r') for path in paths]
+    totals = collections.Counter()
+    started = False
+    last = None
+    try:
+        with open(log_file, 'a') as merged:
+            # the log lines start with their time, so the lines of the shards are merged by their text
+            for line in heapq.merge(*logs):
+                # config.LOG_FORMAT: the date and time are followed by the message
+                fields = line.rstrip('\n').split(' ', 2)
+                timestamp, message = ' '.join(fields[:2]), fields[2] if len(fields) > 2 else ''
+                match = summary.match(message)
+                if match:
+                    totals.update({name: int(value) for name, value in match.groupdict().items()})
+                    last = timestamp
+                    continue
+                if initial.match(message):
+                    if started:
+                        continue
+                    started = True
+                merged.write(line if line.endswith('\n') else line + '\n')
+            if last is not None:
+                merged.write('%s %s\n' % (last, config.LOG_SUMMARY % totals))
+    finally:
+        for log in logs:
+            log.close()
+    for path in paths:
+        os.remove(path)
+
+    if manifest_path:
+        images = manifest.Manifest(manifest_path)
+        try:
+            for index in range(count):
+                if os.path.exists(shard_path(manifest_path, index, count)):
+                    images.merge(shard_path(manifest_path, index, count))
+        finally:
+            images.close()
+
+
+def _marker(log_file, index, count, kind):
+    return shard_path(log_file, index, count) + kind
+
+
+def _stale(path):
+    """
+    Returns the owner recorded in a claim whose launcher is gone: a launcher on this machine which is not running
+    any more, or any launcher which did not refresh its claim for config.SHARD_STALE seconds.
+
+    :param path: the marker file of the claim
+    :type path: str
+    :return: the content of the stale claim, None if the claim is held or gone
+    :rtype: str
+    """
+    try:
+        with open(path, 'r') as marker:
+            owner = marker.read()
+        age = time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return None
+    if age > config.SHARD_STALE:
+        return owner
+    fields = owner.split()
+    if len(fields) < 2 or not fields[0].isdigit() or fields[1] != socket.gethostname():
+        return None
+    try:
+        os.kill(int(fields[0]), 0)
+    except ProcessLookupError:
+        return owner
+    except PermissionError:
+        pass
+    return None
+
+
+def _claim(path):
+    """
+    Claims a shard or the merge by creating its marker file, which fails if another launcher (possibly on another
+    machine) claimed it before. The marker records the process id and host of the launcher, so the claim of a crashed
+    launcher is taken over.
+
+    :param path: the marker file of the claim
+    :type path: str
+    :return: True if the claim was made
+    :rtype: bool
+    """
+    for attempt in range(2):
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            owner = _stale(path)
+            if owner is None or attempt:
+                return False
+            # move the stale claim aside, of several launchers taking it over only one moves it
+            aside = '%s.%s-%d' % (path, socket.gethostname(), os.getpid())
+            try:
+                os.rename(path, aside)
+            except FileNotFoundError:
+                return False
+            with open(aside, 'r') as marker:
+                moved = marker.read()
+            if moved != owner:
+                # another launcher took it over and claimed it meanwhile
+                try:
+                    os.link(aside, path)
+                except FileExistsError:
+                    pass
+                os.remove(aside)
+                return False
+            os.remove(aside)
+            continue
+        with open(descriptor, 'w') as marker:
+            marker.write('%d %s %.6f\n' % (os.getpid(), socket.gethostname(), time.time()))
+        return True
+    return False
+
+
+def launch(script, argv, count, processes, log_file, manifest_path=None):
+    """
+    Crawls all shards by starting a process per shard, at most processes at a time, and merges their logs and
+    manifests once all shards are crawled. Each shard is claimed by a marker file next to the log file before it is
+    started, so the same command run on several machines sharing the file system divides the shards among them;
+    the machine finishing the last shard merges. A finished shard is marked done until the merge, so a launcher
+    started again continues with the shards not crawled yet. The claims are refreshed while the shards run, so the
+    shards and the merge of a crashed launcher are taken over by the next launcher.
+
+    :param script: path of the crawler script
+    :type script: str
+    :param argv: command line arguments of the launcher, passed on to the shards
+    :type argv: list of str
+    :param count: the number of shards
+    :type count: int
+    :param processes: the maximal number of shards crawled at a time on this machine
+    :type processes: int
+    :param log_file: file name or path to the log file of the whole crawl
+    :type log_file: str
+    :param manifest_path: optional file name or path to the manifest of the whole crawl
+    :type manifest_path: str
+    :return: the exit status, 1 if a shard failed
+    :rtype: int
+    """
+    directory = os.path.dirname(log_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    command = [sys.executable, script] + strip_options(argv, ('--shards', '--processes'))
+    candidates = collections.deque(range(count))
+    running = {}
+    refreshed = time.monotonic()
+    failed = False
+    bar = progressbar.ProgressBar(count)
+    while candidates or running:
+        # start the next shards nobody claimed
+        while candidates and len(running) < processes:
+            index = candidates.popleft()
+            if os.path.exists(_marker(log_file, index, count, config.SHARD_DONE)) or \
+                    not _claim(_marker(log_file, index, count, config.SHARD_CLAIM)):
+                continue
+            shard = subprocess.Popen(command + ['--shard', '%d/%d' % (index, count)], stdout=subprocess.DEVNULL)
+            running[shard] = index
+        if not running:
+            break
+
+        time.sleep(config.SHARD_POLL)
+        if time.monotonic() - refreshed > config.SHARD_HEARTBEAT:
+            for index in running.values():
+                os.utime(_marker(log_file, index, count, config.SHARD_CLAIM))
+            refreshed = time.monotonic()
+        for shard in [shard for shard in running if shard.poll() is not None]:
+            index = running.pop(shard)
+            if shard.returncode:
+                failed = True
+            else:
+                open(_marker(log_file, index, count, config.SHARD_DONE), 'w').close()
+            os.remove(_marker(log_file, index, count, config.SHARD_CLAIM))
+        bar.set(sum(os.path.exists(_marker(log_file, index, count, config.SHARD_DONE)) for index in range(count)))
+
+    # the launcher seeing all shards done merges them, unless another one does so already
+    if all(os.path.exists(_marker(log_file, index, count, config.SHARD_DONE)) for index in range(count)) and \
+            _claim(log_file + config.SHARD_MERGE):
+        try:
+            merge(log_file, count, manifest_path)
+            for index in range(count):
+                os.remove(_marker(log_file, index, count, config.SHARD_DONE))
+        finally:
+            os.remove(log_file + config.SHARD_MERGE)
+        bar.complete(config.PROGRESS_COMPLETE)
+    else:
+        bar.complete(config.SHARD_INCOMPLETE)
+    return 1 if failed else 0
@@ -0,0 +1,613 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import mmap
+import os
+import os.path
+import shutil
+import struct
+import tempfile
+import threading
+
+import config
+
+
+# length of the URL and of the content in front of each image of a pack segment
+PACK_HEADER = struct.Struct('>IQ')
+# segment (counted from 1, 0 for no image) and offset of each image in the pack index
+PACK_RECORD = struct.Struct('>IQ')
+# hash of the key (0 for a free slot) and offset of the image in each slot of the lookup table of a pack segment
+PACK_SLOT = struct.Struct('>QQ')
+# kinds of keys of the lookup tables
+PACK_URL_KEY = b'u'
+PACK_NAME_KEY = b'n'
+
+
+class FlatStorage:
+    """
+    Stores every image as a file of its own directly in the destination directory.
+    """
+    needs_digest = False
+
+    def __init__(self, directory):
+        """
+        Storage constructor.
+
+        :param directory: path to directory in which to store the images
+        :type directory: str
+        :return:
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def temporary(self):
+        """
+        Creates a temporary file receiving an image, on the same file system as the stored images
+        so it can be moved into place atomically.
+
+        :return: an open file descriptor and the path of the temporary file
+        :rtype: tuple
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.mkstemp(suffix=config.PARTIAL_SUFFIX, prefix='.', dir=self.directory)
+
+    def location(self, name):
+        """
+        Returns the path under which an image is stored, as recorded in the manifest.
+
+        :param name: the file name of the image
+        :type name: str
+        :return: the path of the image
+        :rtype: str
+        """
+        return os.path.join(self.directory, name)
+
+    def exists(self, path):
+        """
+        Returns whether an image recorded in the manifest is still stored.
+
+        :param path: the path of the image returned by location
+        :type path: str
+        :return: True if the image is stored
+        :rtype: bool
+        """
+        return os.path.exists(path)
+
+    def remove(self, path):
+        """
+        Removes an image recorded in the manifest, once a changed version of it is stored under another name.
+
+        :param path: the path of the image returned by location
+        :type path: str
+        :return:
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def highest_number(self):
+        """
+        Returns the highest sequence number of the images kept by the storage, so a new crawl numbers its images behind
+        them. Storages replacing images of the same name return 0.
+
+        :return: the highest sequence number, 0 if there is none
+        :rtype: int
+        """
+        return 0
+
+    def store(self, temporary, name, url, digest, size, number=None):
+        """
+        Moves a completely received image into place.
+
+        :param temporary: path of the temporary file holding the image
+        :type temporary: str
+        :param name: the file name for the image
+        :type name: str
+        :param url: the URL of the image
+        :type url: str
+        :param digest: hex digest of the image content, None if the storage does not need it
+        :type digest: str
+        :param size: the image size in bytes
+        :type size: int
+        :param number: optional sequence number of the image, defaults to none
+        :type number: int
+        :return: a flag indicating whether the content was already stored before
+        :rtype: bool
+        """
+        os.replace(temporary, self.location(name))
+        return False
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ContentStorage(FlatStorage):
+    """
+    Content-addressed storage keeping each distinct image content once, under a path sharded by the hash of the
+    content (objects/ab/cd/abcd...). The URL, image name and content hash of every stored image are appended to an
+    index file, and the image name is hard linked to the content if the file system allows it, otherwise the
+    index serves as the manifest of the image names.
+    """
+    needs_digest = True
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.objects = os.path.join(directory, config.CONTENT_OBJECTS)
+        self._index = None
+
+    def path(self, digest):
+        """
+        Returns the path of a content in the storage.
+
+        :param digest: hex digest of the content
+        :type digest: str
+        :return: the sharded path
+        :rtype: str
+        """
+        return os.path.join(self.objects, digest[:2], digest[2:4], digest)
+
+    def temporary(self):
+        os.makedirs(self.objects, exist_ok=True)
+        return tempfile.mkstemp(suffix=config.PARTIAL_SUFFIX, prefix='.', dir=self.objects)
+
+    def store(self, temporary, name, url, digest, size, number=None):
+        path = self.path(digest)
+        with self._lock:
+            duplicate = os.path.exists(path)
+            if duplicate:
+                os.remove(temporary)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temporary, path)
+
+            if self._index is None:
+                self._index = open(os.path.join(self.directory, config.CONTENT_INDEX), 'a')
+            self._index.write('%s\t%d\t%s\t%s\n' % (digest, size, name, url))
+
+        link = os.path.join(self.directory, name)
+        try:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.link(path, link)
+        except OSError:
+            # no hard links on this file system, the index names the content of the image
+            pass
+        return duplicate
+
+    def close(self):
+        with self._lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+
+class CallbackStorage(FlatStorage):
+    """
+    Hands each image to a function instead of keeping it, e.g. to process the images in memory. The function is called
+    by the worker threads with the URL, the image name and the content of each image.
+    """
+    def __init__(self, callback, directory=None):
+        """
+        Callback storage constructor.
+
+        :param callback: function called with the URL, image name and content (bytes) of each image
+        :type callback: callable
+        :param directory: optional directory for the images while they are received, defaults to the temporary directory
+        :type directory: str
+        :return:
+        """
+        super().__init__(tempfile.gettempdir() if directory is None else directory)
+        self.callback = callback
+
+    def location(self, name):
+        return name
+
+    def exists(self, path):
+        # the images are not kept, so they are downloaded again
+        return False
+
+    def remove(self, path):
+        pass
+
+    def store(self, temporary, name, url, digest, size, number=None):
+        try:
+            with open(temporary, 'rb') as image_file:
+                content = image_file.read()
+        finally:
+            os.remove(temporary)
+        self.callback(url, name, content)
+        return False
+
+
+class ShardedStorage(FlatStorage):
+    """
+    Stores every image as a file of its own in a directory tree sharded by the hash of the image name (ab/cd/name),
+    so no directory holds more than a few hundred files even for crawls of millions of images.
+    """
+    def location(self, name):
+        digest = hashlib.md5(name.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:4], name)
+
+    def store(self, temporary, name, url, digest, size, number=None):
+        path = self.location(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temporary, path)
+        return False
+
+
+def _pack_key(kind, text):
+    # 64-bit hash of an URL or image name in the lookup tables, never 0 which marks a free slot
+    digest = hashlib.blake2b(kind + text.encode('utf-8', 'surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') or 1
+
+
+def _pack_lookup(descriptor, key):
+    # offset of the image stored under a key in the lookup table of a segment, None if there is none
+    capacity = os.fstat(descriptor).st_size // PACK_SLOT.size
+    slot = key & (capacity - 1)
+    for probe in range(capacity):
+        stored, offset = PACK_SLOT.unpack(os.pread(descriptor, PACK_SLOT.size, slot * PACK_SLOT.size))
+        if stored == key:
+            return offset
+        if not stored:
+            return None
+        slot = (slot + 1) & (capacity - 1)
+    return None
+
+
+class _PackTable:
+    """
+    Lookup table of the URLs and image names of a pack segment, written by the writer of the segment.
+    A hash table with open addressing over slots of fixed size, kept at most half full by doubling it,
+    so a lookup reads one or a few slots of the file.
+    """
+    def __init__(self, path, capacity=config.PACK_TABLE_CAPACITY):
+        self.path = path
+        self.count = 0
+        self._slots = bytearray(capacity * PACK_SLOT.size)
+        self._descriptor = None
+        self._write()
+
+    def _write(self):
+        # replace the file atomically, so readers see the old or the new table
+        temporary = self.path + config.PARTIAL_SUFFIX
+        with open(temporary, 'wb') as table:
+            table.write(self._slots)
+        os.replace(temporary, self.path)
+        if self._descriptor is not None:
+            os.close(self._descriptor)
+        self._descriptor = os.open(self.path, os.O_WRONLY)
+
+    def _insert(self, key, offset):
+        capacity = len(self._slots) // PACK_SLOT.size
+        slot = key & (capacity - 1)
+        while True:
+            stored = PACK_SLOT.unpack_from(self._slots, slot * PACK_SLOT.size)[0]
+            if not stored:
+                self.count += 1
+                break
+            if stored == key:
+                break
+            slot = (slot + 1) & (capacity - 1)
+        PACK_SLOT.pack_into(self._slots, slot * PACK_SLOT.size, key, offset)
+        return slot
+
+    def put(self, key, offset):
+        """
+        Points a key to an image, replacing an earlier image of the same key.
+
+        :param key: the hashed URL or image name
+        :type key: int
+        :param offset: the offset of the image in the segment
+        :type offset: int
+        :return:
+        """
+        if 2 * (self.count + 1) > len(self._slots) // PACK_SLOT.size:
+            slots = self._slots
+            self._slots = bytearray(2 * len(slots))
+            self.count = 0
+            for stored, position in PACK_SLOT.iter_unpack(slots):
+                if stored:
+                    self._insert(stored, position)
+            self._insert(key, offset)
+            self._write()
+        else:
+            slot = self._insert(key, offset)
+            os.pwrite(self._descriptor, self._slots[slot * PACK_SLOT.size:(slot + 1) * PACK_SLOT.size], slot * PACK_SLOT.size)
+
+    def close(self):
+        os.close(self._descriptor)
+
+
+class PackStorage(FlatStorage):
+    """
+    Append-only storage packing the images into large segment files, a new segment is started once a segment reaches
+    the segment size. Each image is appended with its URL and located by a record of fixed size in the index file,
+    at the position of its sequence number, so readers find it in constant time through a memory map of the index.
+    Next to each segment a hashed lookup table points the URLs and image names to their images, and a text file lists
+    the sequence number, name and URL of its images. Segments are claimed by creating them exclusively, so shards
+    crawling into the same pack write their own segments, and later crawls append to the pack.
+    """
+    def __init__(self, directory, segment_size=config.PACK_SEGMENT_SIZE):
+        """
+        Pack storage constructor.
+
+        :param directory: path to directory in which to store the pack
+        :type directory: str
+        :param segment_size: optional size in bytes at which a new segment is started, defaults to config.PACK_SEGMENT_SIZE
+        :type segment_size: int
+        :return:
+        """
+        if segment_size < 1:
+            raise ValueError('pack segment size must be positive')
+        super().__init__(directory)
+        self.segment_size = segment_size
+        self._segment = None
+        self._segment_number = None
+        self._urls = None
+        self._table = None
+        self._index = None
+
+    def _rotate(self):
+        # claim the next free segment
+        if self._segment is not None:
+            self._segment.close()
+            self._urls.close()
+            self._table.close()
+        number = 0
+        while True:
+            try:
+                descriptor = os.open(os.path.join(self.directory, config.PACK_SEGMENT % number), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                number += 1
+        self._segment = open(descriptor, 'wb')
+        self._segment_number = number
+        self._urls = open(os.path.join(self.directory, config.PACK_URLS % number), 'a')
+        self._table = _PackTable(os.path.join(self.directory, config.PACK_TABLE % number))
+
+    def store(self, temporary, name, url, digest, size, number=None):
+        if number is None or number < 1:
+            raise ValueError('images of a pack need a positive sequence number')
+        encoded = url.encode('utf-8', 'surrogateescape')
+        with self._lock:
+            if self._index is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._index = os.open(os.path.join(self.directory, config.PACK_INDEX), os.O_CREAT | os.O_RDWR)
+            if self._segment is None or (self._segment.tell() and self._segment.tell() + size > self.segment_size):
+                self._rotate()
+            offset = self._segment.tell()
+            self._segment.write(PACK_HEADER.pack(len(encoded), size) + encoded)
+            with open(temporary, 'rb') as image_file:
+                shutil.copyfileobj(image_file, self._segment, config.CHUNK_SIZE)
+            self._segment.flush()
+            self._urls.write('%d\t%s\t%s\n' % (number, name, url))
+            self._urls.flush()
+            # the lookup table and index point to the image only once it is written
+            self._table.put(_pack_key(PACK_URL_KEY, url), offset)
+            self._table.put(_pack_key(PACK_NAME_KEY, name), offset)
+            os.pwrite(self._index, PACK_RECORD.pack(self._segment_number + 1, offset), (number - 1) * PACK_RECORD.size)
+        os.remove(temporary)
+        return False
+
+    def exists(self, path):
+        # the image of the number in the name must be the one stored under the name
+        name = os.path.basename(path)
+        prefix = name.split('_', 1)[0]
+        if not prefix.isdigit() or not int(prefix):
+            return False
+        try:
+            with open(os.path.join(self.directory, config.PACK_INDEX), 'rb') as index:
+                record = os.pread(index.fileno(), PACK_RECORD.size, (int(prefix) - 1) * PACK_RECORD.size)
+        except FileNotFoundError:
+            return False
+        if len(record) < PACK_RECORD.size:
+            return False
+        segment, offset = PACK_RECORD.unpack(record)
+        if not segment:
+            return False
+        try:
+            descriptor = os.open(os.path.join(self.directory, config.PACK_TABLE % (segment - 1)), os.O_RDONLY)
+        except FileNotFoundError:
+            # segments of packs written before the lookup tables
+            return any(entry == name for number, entry, url in _segment_entries(self.directory, segment - 1))
+        try:
+            return _pack_lookup(descriptor, _pack_key(PACK_NAME_KEY, name)) == offset
+        finally:
+            os.close(descriptor)
+
+    def remove(self, path):
+        # the pack is append-only, the older version stays readable by its number
+        pass
+
+    def highest_number(self):
+        try:
+            return os.path.getsize(os.path.join(self.directory, config.PACK_INDEX)) // PACK_RECORD.size
+        except FileNotFoundError:
+            return 0
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._urls.close()
+                self._table.close()
+                self._segment = self._urls = self._table = None
+            if self._index is not None:
+                os.close(self._index)
+                self._index = None
+
+
+def _segment_entries(directory, number):
+    # sequence number, image name and URL of the images listed next to a segment, in the order they were stored
+    path = os.path.join(directory, config.PACK_URLS % number)
+    if os.path.exists(path):
+        with open(path) as urls:
+            for line in urls:
+                fields = line.rstrip('\n').split('\t', 2)
+                if len(fields) == 3:
+                    yield int(fields[0]), fields[1], fields[2]
+
+
+def _pack_entries(directory):
+    # the entries of all segments
+    number = 0
+    while os.path.exists(os.path.join(directory, config.PACK_SEGMENT % number)):
+        yield from _segment_entries(directory, number)
+        number += 1
+
+
+class PackReader:
+    """
+    Reads images from a pack written by PackStorage without unpacking it. Images are found by their sequence number
+    through a memory map of the index, and by their URL through the lookup tables of the segments, newest first.
+    """
+    def __init__(self, directory):
+        """
+        Pack reader constructor. Maps the index into memory.
+
+        :param directory: path to directory holding the pack
+        :type directory: str
+        :return:
+        """
+        self.directory = directory
+        self._segments = {}
+        self._tables = {}
+        self._names = None
+        self._index = None
+        path = os.path.join(directory, config.PACK_INDEX)
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as index:
+                self._index = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        self._segment_count = 0
+        while os.path.exists(os.path.join(directory, config.PACK_SEGMENT % self._segment_count)):
+            self._segment_count += 1
+
+    def __len__(self):
+        if self._index is None:
+            return 0
+        records = memoryview(self._index)[:len(self._index) - len(self._index) % PACK_RECORD.size]
+        try:
+            return sum(1 for segment, offset in PACK_RECORD.iter_unpack(records) if segment)
+        finally:
+            records.release()
+
+    @property
+    def names(self):
+        # the image names by sequence number, read from the URL lists on first use
+        if self._names is None:
+            self._names = {number: name for number, name, url in _pack_entries(self.directory)}
+        return self._names
+
+    def _image(self, segment, offset):
+        # returns the URL and the content of the image at an offset of a segment
+        descriptor = self._segments.get(segment)
+        if descriptor is None:
+            descriptor = self._segments[segment] = os.open(os.path.join(self.directory, config.PACK_SEGMENT % segment), os.O_RDONLY)
+        url_length, size = PACK_HEADER.unpack(os.pread(descriptor, PACK_HEADER.size, offset))
+        data = os.pread(descriptor, url_length + size, offset + PACK_HEADER.size)
+        return data[:url_length].decode('utf-8', 'surrogateescape'), data[url_length:]
+
+    def _read(self, number):
+        # returns the URL and the content of the image with the sequence number, None if there is none
+        if self._index is None or number < 1 or number * PACK_RECORD.size > len(self._index):
+            return None
+        segment, offset = PACK_RECORD.unpack_from(self._index, (number - 1) * PACK_RECORD.size)
+        return self._image(segment - 1, offset) if segment else None
+
+    def _offset(self, segment, url):
+        # offset of the image of an URL in a segment, None if it is not stored there
+        if segment not in self._tables:
+            try:
+                self._tables[segment] = os.open(os.path.join(self.directory, config.PACK_TABLE % segment), os.O_RDONLY)
+            except FileNotFoundError:
+                # segments of packs written before the lookup tables
+                self._tables[segment] = None
+        descriptor = self._tables[segment]
+        if descriptor is not None:
+            return _pack_lookup(descriptor, _pack_key(PACK_URL_KEY, url))
+        image = None
+        for number, name, entry in _segment_entries(self.directory, segment):
+            if entry == url:
+                image = number
+        if image is None or self._index is None or image * PACK_RECORD.size > len(self._index):
+            return None
+        stored, offset = PACK_RECORD.unpack_from(self._index, (image - 1) * PACK_RECORD.size)
+        return offset if stored == segment + 1 else None
+
+    def get(self, number):
+        """
+        Returns the content of an image by its sequence number.
+
+        :param number: the sequence number of the image
+        :type number: int
+        :return: the content of the image, None if there is none
+        :rtype: bytes
+        """
+        image = self._read(number)
+        return image[1] if image is not None else None
+
+    def find(self, url):
+        """
+        Returns the content of the image last stored for an URL.
+
+        :param url: the URL of the image
+        :type url: str
+        :return: the content of the image, None if there is none
+        :rtype: bytes
+        """
+        for segment in reversed(range(self._segment_count)):
+            offset = self._offset(segment, url)
+            if offset is not None:
+                image = self._image(segment, offset)
+                # another URL of the same hash is not mistaken for it
+                if image[0] == url:
+                    return image[1]
+        return None
+
+    def close(self):
+        for descriptor in list(self._segments.values()) + list(self._tables.values()):
+            if descriptor is not None:
+                os.close(descriptor)
+        self._segments = {}
+        self._tables = {}
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+STORAGES = {config.STORAGE_FLAT: FlatStorage,
+            config.STORAGE_CONTENT: ContentStorage,
+            config.STORAGE_SHARDED: ShardedStorage,
+            config.STORAGE_PACK: PackStorage}
+
+
+def create(kind, directory):
+    """
+    Creates a storage of the given kind.
+
+    :param kind: name of the storage, one of STORAGES
+    :type kind: str
+    :param directory: path to directory in which to store the images
+    :type directory: str
+    :return: the storage
+    :rtype: FlatStorage
+    """
+    try:
+        return STORAGES[kind](directory)
+    except KeyError:
+        raise ValueError('unknown storage: %s' % kind)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import http.server
+import re
+import struct
+import threading
+import time
+
+
+class LocalServer:
+    """
+    Minimal threaded HTTP server on localhost serving a fixed set of routes, so crawling can be tested
+    without relying on resolvable hosts on the internet.
+    Routes map a path to a (status, content type, body) tuple, unknown paths are answered with 404.
+    The body may be a callable taking the request handler and returning a (status, headers, body) tuple.
+    Subclasses may answer the requests differently by overriding answer.
+    """
+    def __init__(self, routes=None):
+        self.routes = dict(routes or {})
+        self.requests = []
+        self.times = []
+        self.connections = 0
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_GET(self):
+                server.answer(self)
+
+            def do_CONNECT(self):
+                server.answer(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+
+    def answer(self, handler):
+        """
+        Records a request and answers it by the routes.
+
+        :param handler: the handler of the request
+        :type handler: http.server.BaseHTTPRequestHandler
+        :return:
+        """
+        with self._lock:
+            self.requests.append((handler.path, dict(handler.headers)))
+            self.times.append(time.monotonic())
+        status, content_type, body = self.routes.get(handler.path, (404, 'text/plain', b'not found'))
+        if callable(body):
+            status, headers, body = body(handler)
+        else:
+            headers = {}
+        # a custom (or omitted) content length ends the body by closing the connection
+        if 'Content-Length' in headers:
+            handler.close_connection = True
+            headers = dict(headers, Connection='close')
+        headers = dict({'Content-Type': content_type, 'Content-Length': len(body)}, **headers)
+        handler.send_response(status)
+        for name, value in headers.items():
+            if value is not None:
+                handler.send_header(name, str(value))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    @property
+    def netloc(self):
+        return '127.0.0.1:%d' % self.httpd.server_address[1]
+
+    def url(self, path):
+        return 'http://%s%s' % (self.netloc, path)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def png_image(width=16, height=16, size=256):
+    """
+    Creates PNG-like bytes with a valid signature and IHDR header, padded to size bytes (pixels are not decodable).
+    """
+    header = b'\x89PNG\r\n\x1a\n' + struct.pack('>I4sIIBBBBB', 13, b'IHDR', width, height, 8, 6, 0, 0, 0) + b'\0\0\0\0'
+    return header + b'\0' * max(size - len(header), 0)
+
+
+def ranged(content, etag='"1"', truncated=0):
+    """
+    Creates a route body answering requests for byte ranges (Range, validated by If-Range) of the content,
+    the first truncated answers being cut off after half of their body.
+    """
+    answers = []
+
+    def respond(handler):
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+        requested = re.match(r'bytes=(\d+)-(\d*)$', handler.headers.get('Range', ''))
+        if requested is not None and handler.headers.get('If-Range', etag) == etag:
+            start = int(requested.group(1))
+            end = int(requested.group(2)) + 1 if requested.group(2) else len(content)
+            status, body = 206, content[start:end]
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end - 1, len(content))
+        else:
+            status, body = 200, content
+        answers.append(status)
+        if len(answers) <= truncated:
+            headers['Content-Length'] = len(body)
+            body = body[:len(body) // 2]
+        return status, headers, body
+    return respond
@@ -25,7 +25,7 @@ class TestParseArguments(unittest.TestCase):
         self.parser.error = exit_without_message
         self.parser.print_help = print_no_help
 
-        self.ARGUMENT_COUNT = 3
+        self.ARGUMENT_COUNT = 43
         self.URL_FILE = 'links.txt'
         self.DOWNLOAD_DIR = 'download_dir/images/'
         self.LOG_FILE = 'download_dir/images.log'
@@ -55,6 +55,55 @@ class TestParseArguments(unittest.TestCase):
         self.assertEqual(arguments.destination_dir, self.DOWNLOAD_DIR)
         self.assertEqual(arguments.log_file, self.LOG_FILE)
 
+    def test_parse_arguments_service(self):
+        # testing a service without url file
+        arguments = imgcrawl.parse_arguments(['--spool', 'spool', '--socket', 'crawl.sock'])
+        self.assertEqual(len(vars(arguments)), self.ARGUMENT_COUNT)
+        self.assertIsNone(arguments.url_file)
+        self.assertEqual((arguments.spool, arguments.socket), ('spool', 'crawl.sock'))
+
+    def test_parse_arguments_workers(self):
+        # testing default concurrency
+        arguments = imgcrawl.parse_arguments([self.URL_FILE])
+        self.assertEqual(arguments.workers, config.DEFAULT_WORKERS)
+        self.assertEqual(arguments.host_workers, config.DEFAULT_HOST_WORKERS)
+
+        # testing short and long option for the global and per host worker count
+        arguments = imgcrawl.parse_arguments([self.URL_FILE, '-j', '8', '--host-workers', '2'])
+        self.assertEqual(arguments.workers, 8)
+        self.assertEqual(arguments.host_workers, 2)
+        arguments = imgcrawl.parse_arguments(['--workers', '16', self.URL_FILE])
+        self.assertEqual(arguments.workers, 16)
+
+        # testing non numerical worker count
+        with self.assertRaises(SystemExit):
+            imgcrawl.parse_arguments([self.URL_FILE, '-j', 'many'], self.parser)
+
+    def test_parse_arguments_numbers(self):
+        # testing counts and sizes which must be positive
+        for option in ('-j', '--host-workers', '--robots-cache-size', '--shards', '--processes', '--segments', '--max-bandwidth',
+                       '--dedup-capacity', '--connect-timeout', '--read-timeout'):
+            for value in ('0', '-1'):
+                with self.subTest(option=option, value=value):
+                    with self.assertRaises(SystemExit) as context:
+                        imgcrawl.parse_arguments([self.URL_FILE, option, value], self.parser)
+                    self.assertEqual(context.exception.code, errno.ENOENT)
+
+        # testing delays, times to live, retries and limits which must not be negative, zero being allowed
+        for option in ('--delay', '--robots-ttl', '--dns-ttl', '--retries', '--max-bytes', '--pool-size', '--idle-timeout',
+                       '--breaker-threshold', '--segment-threshold'):
+            with self.subTest(option=option):
+                with self.assertRaises(SystemExit) as context:
+                    imgcrawl.parse_arguments([self.URL_FILE, option, '-1'], self.parser)
+                self.assertEqual(context.exception.code, errno.ENOENT)
+                arguments = imgcrawl.parse_arguments([self.URL_FILE, option, '0'], self.parser)
+                self.assertEqual(vars(arguments)[option[2:].replace('-', '_')], 0)
+
+        # testing numbers of the wrong type
+        for option, value in (('--retries', '1.5'), ('--delay', 'slow')):
+            with self.assertRaises(SystemExit):
+                imgcrawl.parse_arguments([self.URL_FILE, option, value], self.parser)
+
     def test_parse_arguments_help(self):
         # testing help
         with self.assertRaises(SystemExit) as context:
@@ -76,6 +125,33 @@ class TestParseArguments(unittest.TestCase):
         with self.assertRaises(TypeError):
             imgcrawl.parse_arguments([self.URL_FILE, '-d', 404], self.parser)
 
+        # testing a url file given to a service
+        with self.assertRaises(SystemExit) as context:
+            imgcrawl.parse_arguments([self.URL_FILE, '--spool', 'spool'], self.parser)
+        self.assertEqual(context.exception.code, errno.ENOENT)
+
+        # testing options a service cannot use
+        for option in (['--resume'], ['--dedup', 'sort']):
+            with self.assertRaises(SystemExit) as context:
+                imgcrawl.parse_arguments(['--spool', 'spool'] + option, self.parser)
+            self.assertEqual(context.exception.code, errno.ENOENT)
+
+        # testing more differing bits than a perceptual hash has
+        with self.assertRaises(SystemExit) as context:
+            imgcrawl.parse_arguments([self.URL_FILE, '--near-duplicates', '65'], self.parser)
+        self.assertEqual(context.exception.code, errno.ENOENT)
+
+        # testing a memory tracing interval which is not positive
+        with self.assertRaises(SystemExit) as context:
+            imgcrawl.parse_arguments([self.URL_FILE, '--trace-memory', '0'], self.parser)
+        self.assertEqual(context.exception.code, errno.ENOENT)
+
+        # testing a Bloom filter error rate which is no probability
+        for rate in ('0', '1'):
+            with self.assertRaises(SystemExit) as context:
+                imgcrawl.parse_arguments([self.URL_FILE, '--dedup-error-rate', rate], self.parser)
+            self.assertEqual(context.exception.code, errno.ENOENT)
+
         # testing faulty non-list argument
         with self.assertRaises(SystemExit) as context:
             imgcrawl.parse_arguments(self.URL_FILE, self.parser)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import re
+import threading
+import unittest
+
+import asynclog
+import config
+
+
+class TestAsyncLog(unittest.TestCase):
+    def setUp(self):
+        self.log_file = 'test_async.log'
+
+    def logger(self, handler):
+        logger = logging.getLogger('test_async_log')
+        logger.setLevel(logging.INFO)
+        handler.setFormatter(logging.Formatter(config.LOG_FORMAT))
+        logger.addHandler(handler)
+        return logger
+
+    def test_truncated(self):
+        self.assertEqual(str(asynclog.Truncated('short', 10)), 'short')
+        text = str(asynclog.Truncated('http://example.com/a/long/path/to/an/image.png', 20))
+        self.assertEqual(len(text), 20)
+        self.assertEqual(text, 'http://ex...mage.png')
+
+    def test_batched_writes(self):
+        # records of concurrent threads are all written in the format of the synchronous log, in fewer writes
+        handler = asynclog.BatchingHandler(self.log_file, capacity=10, batch=50)
+        logger = self.logger(handler)
+
+        def log(thread):
+            for number in range(200):
+                logger.info('%s %d', asynclog.Truncated('thread %d' % thread, 20), number)
+        threads = [threading.Thread(target=log, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        handler.flush()
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(len(lines), 800)
+        self.assertTrue(all(re.match(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3} thread \d \d+\n$', line) for line in lines))
+        self.assertEqual(sum(line.endswith(' thread 2 199\n') for line in lines), 1)
+        self.assertLess(handler.writes, 800)
+
+        # closing writes the queued records and releases the file
+        logger.info('last')
+        logger.removeHandler(handler)
+        handler.close()
+        with open(self.log_file) as log:
+            self.assertTrue(log.read().endswith(' last\n'))
+        handler.close()
+
+    def test_invalid_sizes(self):
+        with self.assertRaises(ValueError):
+            asynclog.BatchingHandler(self.log_file, capacity=0)
+        with self.assertRaises(ValueError):
+            asynclog.BatchingHandler(self.log_file, batch=0)
+
+    def tearDown(self):
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
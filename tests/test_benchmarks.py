@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import unittest
+
+import config
+from benchmarks import run, server
+
+
+class TestBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.results = 'test_benchmark_results.jsonl'
+
+    def test_profile(self):
+        profile = server.Profile(sizes='uniform:1000:2000', error_rate=0.5, non_image_rate=0.2, crawl_delay=1)
+        answers = [profile.respond('/img/%d.png' % i) for i in range(1000)]
+        self.assertEqual(answers, [profile.respond('/img/%d.png' % i) for i in range(1000)])
+        self.assertTrue(400 < sum(status == 500 for status, content_type, body in answers) < 600)
+        self.assertTrue(all(1000 <= len(body) <= 2000 for status, content_type, body in answers if content_type == 'image/png'))
+        self.assertIn(b'Crawl-delay: 1', profile.respond('/robots.txt')[2])
+        self.assertEqual(profile.respond('/other')[0], 404)
+        with self.assertRaises(ValueError):
+            server.Profile(sizes='normal:1:2')
+
+    def test_run(self):
+        profile = server.Profile(sizes='fixed:1000', non_image_rate=0.1, disallow_rate=0.1)
+        reports = run.run((200,), hosts=2, workers=4, profile=profile, results=self.results)
+        measurements = reports[0]['measurements']
+        self.assertEqual(measurements['urls'], 200)
+        self.assertEqual(measurements['bytes'], 1000 * measurements['downloaded'])
+        self.assertTrue(150 < measurements['downloaded'] < 200)
+        self.assertGreater(measurements['outcomes'][config.OUTCOME_DISALLOWED], 0)
+        self.assertGreater(measurements['urls_per_second'], 0)
+        # the server saw the requests and connections of the crawler
+        self.assertEqual(measurements['server_requests'], measurements['requests'])
+        self.assertEqual(measurements['server_connections'], measurements['connections'])
+        self.assertIn('urls/s', run.describe(reports[0]))
+
+        with open(self.results) as handle:
+            saved = [json.loads(line) for line in handle]
+        self.assertEqual(saved[0]['parameters']['urls'], 200)
+        saved[0]['version'] = 'older'
+        with open(self.results, 'w') as handle:
+            handle.write(json.dumps(saved[0]) + '\n')
+        self.assertEqual(run.previous(self.results, saved[0]['parameters'], 'current')['version'], 'older')
+
+    def tearDown(self):
+        if os.path.exists(self.results):
+            os.remove(self.results)
+
+
+if __name__ == '__main__':
+    unittest.main()
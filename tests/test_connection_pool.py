@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import urllib.error
+
+import connectionpool
+from tests.server import LocalServer, png_image
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.image = png_image()
+        routes = {'/image.png': (200, 'image/png', self.image),
+                  '/stalled.png': (200, 'image/png', lambda handler: (time.sleep(0.5), (200, {}, self.image))[1]),
+                  '/moved': (200, 'text/plain', lambda handler: (302, {'Location': '/image.png'}, b''))}
+        self.server = LocalServer(routes).__enter__()
+        self.pool = connectionpool.ConnectionPool(max_idle=2, idle_timeout=30)
+
+    def test_connection_reuse(self):
+        # sequential requests to one host share a single connection
+        for i in range(50):
+            with self.pool.urlopen(self.server.url('/image.png')) as response:
+                self.assertEqual(response.status, 200)
+                self.assertEqual(response.info().get_content_maintype(), 'image')
+                self.assertEqual(response.read(), self.image)
+        self.assertEqual(self.pool.opened, 1)
+        self.assertEqual(self.pool.requests, 50)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_cached_resolution(self):
+        # new connections to a host resolve it once
+        responses = [self.pool.urlopen(self.server.url('/image.png').replace('127.0.0.1', 'localhost')) for i in range(3)]
+        for response in responses:
+            response.close()
+        self.assertEqual(self.pool.opened, 3)
+        self.assertEqual((self.pool.resolver.misses, self.pool.resolver.hits), (1, 2))
+
+    def test_unread_response_closes_connection(self):
+        with self.pool.urlopen(self.server.url('/image.png')) as response:
+            response.read(4)
+        with self.pool.urlopen(self.server.url('/image.png')) as response:
+            response.read()
+        self.assertEqual(self.pool.opened, 2)
+
+    def test_pool_size(self):
+        responses = [self.pool.urlopen(self.server.url('/image.png')) for i in range(4)]
+        for response in responses:
+            response.read()
+            response.close()
+        self.assertEqual(self.pool.opened, 4)
+
+        # only two of the connections were kept
+        for i in range(4):
+            with self.pool.urlopen(self.server.url('/image.png')) as response:
+                response.read()
+        self.assertEqual(self.pool.opened, 4)
+        responses = [self.pool.urlopen(self.server.url('/image.png')) for i in range(3)]
+        for response in responses:
+            response.close()
+        self.assertEqual(self.pool.opened, 5)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0.05
+        with self.pool.urlopen(self.server.url('/image.png')) as response:
+            response.read()
+        time.sleep(0.1)
+        with self.pool.urlopen(self.server.url('/image.png')) as response:
+            response.read()
+        self.assertEqual(self.pool.opened, 2)
+
+    def test_stale_connection(self):
+        # a kept connection closed by the server is replaced transparently
+        with self.pool.urlopen(self.server.url('/image.png')) as response:
+            response.read()
+        for connection, released in next(iter(self.pool._idle.values())):
+            connection.sock.shutdown(2)
+        with self.pool.urlopen(self.server.url('/image.png')) as response:
+            self.assertEqual(response.read(), self.image)
+
+    def test_redirect_and_errors(self):
+        with self.pool.urlopen(self.server.url('/moved')) as response:
+            self.assertEqual(response.read(), self.image)
+            self.assertEqual(response.url, self.server.url('/image.png'))
+        self.assertEqual(self.pool.opened, 1)
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.pool.urlopen(self.server.url('/missing.png'))
+        self.assertEqual(context.exception.code, 404)
+
+        with self.assertRaises(urllib.error.URLError):
+            self.pool.urlopen('ftp://%s/image.png' % self.server.netloc)
+        with self.assertRaises(urllib.error.URLError):
+            self.pool.urlopen('http:///image.png')
+        with self.assertRaises(urllib.error.URLError):
+            self.pool.urlopen('http://127.0.0.1:1/image.png')
+
+        with self.assertRaises(ValueError):
+            connectionpool.ConnectionPool(max_idle=-1)
+
+    def test_read_timeout(self):
+        # a server not answering in time fails the request instead of stalling it
+        pool = connectionpool.ConnectionPool(timeout=0.1, connect_timeout=1)
+        started = time.monotonic()
+        with self.assertRaises(urllib.error.URLError):
+            pool.urlopen(self.server.url('/stalled.png'))
+        self.assertLess(time.monotonic() - started, 0.4)
+        with pool.urlopen(self.server.url('/image.png')) as response:
+            self.assertEqual(response.read(), self.image)
+        pool.close()
+
+        with self.assertRaises(ValueError):
+            connectionpool.ConnectionPool(timeout=0)
+
+    def test_proxy(self):
+        # HTTP requests are sent to the proxy, HTTPS requests ask it for a tunnel, no_proxy hosts are requested directly
+        with LocalServer({'http://images.invalid/image.png': (200, 'image/png', self.image)}) as proxy:
+            pool = connectionpool.ConnectionPool(proxies={'http': 'http://user:secret@%s' % proxy.netloc,
+                                                          'https': proxy.url(''), 'no': 'localhost'})
+            for i in range(2):
+                with pool.urlopen('http://images.invalid/image.png') as response:
+                    self.assertEqual(response.read(), self.image)
+            self.assertEqual((pool.opened, proxy.connections), (1, 1))
+            path, headers = proxy.requests[0]
+            self.assertEqual((path, headers['Host']), ('http://images.invalid/image.png', 'images.invalid'))
+            self.assertEqual(headers['Proxy-Authorization'], 'Basic dXNlcjpzZWNyZXQ=')
+
+            with self.assertRaises(urllib.error.URLError):
+                pool.urlopen('https://images.invalid/image.png')
+            self.assertEqual(proxy.requests[-1][0], 'images.invalid:443')
+
+            with pool.urlopen(self.server.url('/image.png').replace('127.0.0.1', 'localhost')) as response:
+                self.assertEqual(response.read(), self.image)
+            self.assertEqual(len(proxy.requests), 3)
+            pool.close()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.__exit__(None, None, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
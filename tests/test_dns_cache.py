@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import socket
+import time
+import unittest
+import unittest.mock
+
+import dnscache
+from tests.server import LocalServer
+
+
+class TestDnsCache(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.resolve = socket.getaddrinfo
+
+        def getaddrinfo(host, port, *args, **kwargs):
+            self.calls.append(host)
+            if host.endswith('.invalid'):
+                raise socket.gaierror(socket.EAI_NONAME, 'name unknown')
+            return self.resolve('127.0.0.1', port, *args, **kwargs)
+        self.patch = unittest.mock.patch('socket.getaddrinfo', getaddrinfo)
+        self.patch.start()
+
+    def test_hits_and_misses(self):
+        cache = dnscache.DnsCache()
+        for i in range(3):
+            self.assertEqual(cache.resolve('Example.com', 80)[0][4], ('127.0.0.1', 80))
+        cache.resolve('example.com', 443)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertEqual(self.calls, ['example.com', 'example.com'])
+
+    def test_expiry_and_eviction(self):
+        cache = dnscache.DnsCache(ttl=0.05, max_entries=2)
+        cache.resolve('a.com', 80)
+        time.sleep(0.06)
+        cache.resolve('a.com', 80)
+        self.assertEqual(len(self.calls), 2)
+
+        # the least recently used host is evicted
+        cache.resolve('b.com', 80)
+        cache.resolve('a.com', 80)
+        cache.resolve('c.com', 80)
+        self.assertEqual(len(cache), 2)
+        cache.resolve('a.com', 80)
+        cache.resolve('b.com', 80)
+        self.assertEqual(self.calls, ['a.com', 'a.com', 'b.com', 'c.com', 'b.com'])
+
+        # a cache without time to live resolves every time
+        cache = dnscache.DnsCache(ttl=0)
+        cache.resolve('a.com', 80)
+        cache.resolve('a.com', 80)
+        self.assertEqual(len(cache), 0)
+
+    def test_negative_caching(self):
+        cache = dnscache.DnsCache(negative_ttl=30)
+        for i in range(2):
+            with self.assertRaises(socket.gaierror):
+                cache.resolve('unknown.invalid', 80)
+        self.assertEqual(self.calls, ['unknown.invalid'])
+
+    def test_prefetch(self):
+        cache = dnscache.DnsCache()
+        for host in ('a.com', 'b.com', 'a.com'):
+            cache.prefetch(host, 80)
+        deadline = time.monotonic() + 5
+        while len(cache) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(self.calls), ['a.com', 'b.com'])
+
+        # prefetched hosts are resolved from the cache
+        cache.resolve('a.com', 80)
+        cache.prefetch('a.com', 80)
+        self.assertEqual(cache.prefetched, 2)
+        self.assertEqual(len(self.calls), 2)
+        cache.close()
+
+    def test_create_connection(self):
+        cache = dnscache.DnsCache()
+        with LocalServer() as server:
+            port = server.httpd.server_address[1]
+            for i in range(2):
+                sock = cache.create_connection(('server.test', port), 1)
+                self.assertEqual(sock.gettimeout(), 1)
+                sock.close()
+        self.assertEqual(self.calls, ['server.test'])
+        with self.assertRaises(socket.gaierror):
+            cache.create_connection(('unknown.invalid', 80))
+
+        with self.assertRaises(ValueError):
+            dnscache.DnsCache(max_entries=0)
+
+    def tearDown(self):
+        self.patch.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
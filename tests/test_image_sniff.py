@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import struct
+import unittest
+
+import imagesniff
+from tests.server import png_image
+
+
+def dimensions(data):
+    header = imagesniff.sniff(data)
+    return (header.kind, header.width, header.height) if header is not None else None
+
+
+class TestImageSniff(unittest.TestCase):
+    def test_formats(self):
+        self.assertEqual(dimensions(png_image(640, 480)), ('png', 640, 480))
+        self.assertEqual(dimensions(b'GIF89a' + struct.pack('<HH', 32, 16) + b'\0' * 20), ('gif', 32, 16))
+
+        # the frame header of a JPEG follows application segments such as Exif
+        exif = b'\xff\xe1' + struct.pack('>H', 1002) + b'\0' * 1000
+        frame = b'\xff\xc2' + struct.pack('>HBHHB', 17, 8, 600, 800, 3) + b'\0' * 9
+        self.assertEqual(dimensions(b'\xff\xd8' + exif + frame), ('jpeg', 800, 600))
+        self.assertEqual(dimensions(b'\xff\xd8' + exif), ('jpeg', None, None))
+
+        riff = lambda chunk, data: b'RIFF' + struct.pack('<I', 100) + b'WEBP' + chunk + struct.pack('<I', len(data)) + data
+        lossy = riff(b'VP8 ', b'\0\0\0\x9d\x01\x2a' + struct.pack('<HH', 300, 200))
+        lossless = riff(b'VP8L', b'\x2f' + ((300 - 1) | (200 - 1) << 14).to_bytes(4, 'little'))
+        extended = riff(b'VP8X', b'\0' * 4 + (300 - 1).to_bytes(3, 'little') + (200 - 1).to_bytes(3, 'little'))
+        for data in (lossy, lossless, extended):
+            self.assertEqual(dimensions(data), ('webp', 300, 200))
+
+        ftyp = struct.pack('>I', 24) + b'ftypavif' + b'\0\0\0\0' + b'mif1miaf'
+        ispe = struct.pack('>I', 20) + b'ispe' + b'\0' * 4 + struct.pack('>II', 1920, 1080)
+        self.assertEqual(dimensions(ftyp + b'\0' * 50 + ispe), ('avif', 1920, 1080))
+        self.assertIsNone(dimensions(struct.pack('>I', 20) + b'ftypisom' + b'\0\0\0\0' + b'mp41'))
+        heic = struct.pack('>I', 24) + b'ftypheic' + b'\0\0\0\0' + b'mif1heic'
+        self.assertEqual(dimensions(heic + ispe), ('heic', 1920, 1080))
+        self.assertEqual(dimensions(struct.pack('>I', 16) + b'ftypmif1' + b'\0\0\0\0'), ('heic', None, None))
+
+        svg = b'<?xml version="1.0"?>\n<!-- drawing -->\n<svg xmlns="http://www.w3.org/2000/svg" width="120px" height="80">'
+        self.assertEqual(dimensions(svg), ('svg', 120, 80))
+        self.assertEqual(dimensions(b'\xef\xbb\xbf<svg viewBox="0 0 50.5 25">'), ('svg', 50, 25))
+        self.assertEqual(dimensions(b'<svg width="100%" height="100%">'), ('svg', None, None))
+        doctype = b'<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">\n'
+        self.assertEqual(dimensions(b'<?xml version="1.0"?>' + doctype + b'<!-- <html> --><svg width="4" height="3"/>'), ('svg', 4, 3))
+
+        self.assertEqual(dimensions(b'BM' + b'\0' * 12 + struct.pack('<Iii', 40, 10, -20)), ('bmp', 10, 20))
+        self.assertEqual(dimensions(b'\0\0\1\0\1\0\0\x10'), ('ico', 256, 16))
+
+    def test_not_an_image(self):
+        # an HTML page with an inline SVG icon is no SVG image
+        icon = b'<html><body><svg width="16" height="16"><path d="M0 0h16v16z"/></svg></body></html>'
+        for data in (b'<!DOCTYPE html><html><body><img src="a.svg"></body></html>', b'{"error": "not found"}', b'', b'\x89PN', icon,
+                     b'<!-- <svg> --><html></html>'):
+            self.assertIsNone(imagesniff.sniff(data))
+
+    def test_binary(self):
+        # content of an unknown format is binary unless it is text, also if cut within a character
+        self.assertTrue(imagesniff.binary(b'\xff\x0a' + bytes(range(256))))
+        self.assertTrue(imagesniff.binary(b'\x00\x00\x00\x0cJXL \r\n\x87\n' + b'\0' * 20))
+        for data in (b'', b'\x89PN', b'<!DOCTYPE html><html lang="de"><title>Fehler</title></html>', b'Not found.\r\n' * 3,
+                     'Datei nicht gefunden: \u00fcber'.encode()[:-1]):
+            self.assertFalse(imagesniff.binary(data), data)
+
+    def test_fits(self):
+        header = imagesniff.ImageHeader('png', 640, 480)
+        self.assertTrue(header.fits())
+        self.assertTrue(header.fits((640, 480), (640, 480)))
+        self.assertFalse(header.fits(min_size=(800, 1)))
+        self.assertFalse(header.fits(max_size=(1000, 400)))
+        self.assertTrue(imagesniff.ImageHeader('jpeg').fits((800, 600), (10, 10)))
+
+    def test_parse_dimensions(self):
+        self.assertEqual(imagesniff.parse_dimensions('640x480'), (640, 480))
+        self.assertEqual(imagesniff.parse_dimensions('16X16'), (16, 16))
+        for value in ('640', '640x', 'axb', '-1x5'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                imagesniff.parse_dimensions(value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,13 @@
 # -*- coding: utf-8 -*-
 
 import errno
+import gzip
+import hashlib
 import io
+import json
 import os
 import os.path
+import shutil
 import sys
 import unittest
 import urllib.error
@@ -12,6 +16,15 @@ import urllib.parse
 
 import imgcrawl
 import config
+import manifest
+import metrics
+import pacing
+import perceptual
+import retry
+import storage
+from tests.server import LocalServer, png_image, ranged
+from tests.test_perceptual import photo
+from tests.test_sharding import other_shard
 
 
 class TestDownloadImages(unittest.TestCase):
@@ -128,11 +141,11 @@ class TestDownloadImages(unittest.TestCase):
 
         self.assertTrue(self.output.getvalue().endswith(' %s\n' % config.PROGRESS_COMPLETE))
 
-        #     testing consistency between urls count and log file length
+        #     testing consistency between urls count and log file length (initial message and robots cache summary)
         with open(self.log_file) as log:
             for i, l in enumerate(log):
                 pass
-        self.assertEqual(i, len(self.urls))
+        self.assertEqual(i, len(self.urls) + 1)
 
         #     testing number of downloaded images versus expected outcome
         self.assertEqual(len(os.listdir(self.download_dir)), self.downloadable)
@@ -152,10 +165,497 @@ class TestDownloadImages(unittest.TestCase):
             for image in os.listdir(self.download_dir):
                 os.remove(os.path.join(self.download_dir, image)) 
             os.rmdir(self.download_dir)
-        if os.path.exists(self.log_file):
-            os.remove(self.log_file)
-        if os.path.exists(self.url_file):
-            os.remove(self.url_file)
+        for path in (self.log_file, self.log_file + config.JOURNAL_SUFFIX, self.url_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class TestConcurrentDownload(unittest.TestCase):
+    """
+    Concurrent download testing against a local web server.
+    """
+    def setUp(self):
+        self.download_dir = os.path.join(os.curdir, 'test_concurrent_dir/')
+        self.log_file = os.path.join(os.curdir, 'test_concurrent.log')
+        self.url_file = 'test_concurrent_urls.txt'
+        self.manifest_file = 'test_concurrent_manifest.sqlite'
+        self.metrics_file = 'test_concurrent_metrics.jsonl'
+        self.images = 20
+        routes = {'/robots.txt': (200, 'text/plain', b'User-agent: *\nDisallow: /private/\n'),
+                  '/page.html': (200, 'text/html', b'<html></html>'),
+                  '/private/secret.png': (200, 'image/png', png_image()),
+                  '/large.png': (200, 'image/png', png_image(size=300000)),
+                  '/unsized.png': (200, 'image/png', lambda handler: (200, {'Content-Length': None}, png_image(size=300000))),
+                  '/truncated.png': (200, 'image/png', lambda handler: (200, {'Content-Length': 5000}, png_image(size=1000)))}
+        for i in range(self.images):
+            routes['/img/%d.png' % i] = (200, 'image/png', png_image(size=100 + i))
+        for i in range(5):
+            routes['/tagged/%d.png' % i] = (200, 'image/png', self.tagged(i))
+        self.server = LocalServer(routes).__enter__()
+
+        self.output = io.StringIO()
+        self.old_stdout, sys.stdout = sys.stdout, self.output
+
+    def tagged(self, i):
+        # image answering conditional requests, the version can be changed by the test
+        self.versions = {}
+
+        def respond(handler):
+            etag = '"%d-%d"' % (i, self.versions.get(i, 0))
+            if handler.headers.get('If-None-Match') == etag:
+                return 304, {'ETag': etag}, b''
+            return 200, {'ETag': etag}, png_image(size=1000 + self.versions.get(i, 0))
+        return respond
+
+    def crawl(self, urls, workers, host_workers=config.DEFAULT_HOST_WORKERS, **options):
+        with open(self.url_file, 'w') as handle:
+            handle.writelines('%s\n' % url for url in urls)
+        crawler = imgcrawl.ImgCrawler(workers, host_workers, **options)
+        crawler.download_images(self.url_file, self.download_dir, self.log_file)
+        return crawler
+
+    def image_requests(self):
+        return sum(path.startswith('/img/') for path, headers in self.server.requests)
+
+    def test_parallel_download(self):
+        urls = [self.server.url('/img/%d.png' % i) for i in range(self.images)]
+        urls += [self.server.url('/page.html'), self.server.url('/private/secret.png'), 'foo:bar']
+        crawler = self.crawl(urls, workers=8, host_workers=3)
+
+        # all images stored and numbered without gaps or duplicates
+        self.assertEqual(crawler.download_count, self.images)
+        names = os.listdir(self.download_dir)
+        self.assertEqual(sorted(int(name.split('_')[0]) for name in names), list(range(1, self.images + 1)))
+        sizes = sorted(os.path.getsize(os.path.join(self.download_dir, name)) for name in names)
+        self.assertEqual(sizes, [100 + i for i in range(self.images)])
+
+        # one log line per URL plus the initial message and the summary, progress bar completed
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(len(lines), len(urls) + 2)
+        self.assertEqual(sum(config.LOG_DOWNLOADED in line for line in lines), self.images)
+        self.assertTrue(self.output.getvalue().endswith(' %s\n' % config.PROGRESS_COMPLETE))
+
+        # robots.txt requested only once for the single host
+        robots_requests = [path for path, headers in self.server.requests if path == '/robots.txt']
+        self.assertEqual(len(robots_requests), 1)
+        self.assertIn('robots.txt cache %d hits, 1 misses' % (len(urls) - 2), lines[-1])
+
+        # connections to the host are kept alive and reused
+        self.assertLessEqual(self.server.connections, 3)
+        self.assertIn('over %d connections' % self.server.connections, lines[-1])
+
+    def test_streamed_download(self):
+        # images larger than the chunk size are stored completely, truncated bodies are discarded
+        urls = [self.server.url(path) for path in ('/large.png', '/unsized.png', '/truncated.png')]
+        crawler = self.crawl(urls, workers=2)
+        self.assertEqual(crawler.download_count, 2)
+        self.assertEqual(sorted(name.split('_', 1)[1] for name in os.listdir(self.download_dir)), ['large.png', 'unsized.png'])
+        for name in os.listdir(self.download_dir):
+            self.assertEqual(os.path.getsize(os.path.join(self.download_dir, name)), 300000)
+        with open(self.log_file) as log:
+            self.assertIn(config.LOG_ERROR_DOWNLOADING, log.read())
+
+    def test_maximal_size(self):
+        # images exceeding the maximal size by announced or received length leave no files behind
+        urls = [self.server.url(path) for path in ('/large.png', '/unsized.png', '/img/1.png')]
+        crawler = self.crawl(urls, workers=1, max_bytes=1000)
+        self.assertEqual(crawler.download_count, 1)
+        self.assertEqual(os.listdir(self.download_dir), ['1_1.png'])
+        with open(self.log_file) as log:
+            self.assertEqual(log.read().count(config.LOG_TOO_LARGE), 2)
+
+    def test_empty_and_compressed_url_file(self):
+        # an empty list completes without downloads
+        crawler = self.crawl([], workers=2)
+        self.assertEqual(crawler.download_count, 0)
+        self.assertTrue(self.output.getvalue().endswith(' %s\n' % config.PROGRESS_COMPLETE))
+
+        # a compressed list is read like a plaintext one
+        os.remove(self.url_file)
+        self.url_file = 'test_concurrent_urls.txt.gz'
+        with gzip.open(self.url_file, 'wt') as handle:
+            handle.write('\n'.join(self.server.url('/img/%d.png' % i) for i in range(5)))
+        crawler = imgcrawl.ImgCrawler(2)
+        crawler.download_images(self.url_file, self.download_dir, self.log_file)
+        self.assertEqual(crawler.download_count, 5)
+
+    def test_resume(self):
+        urls = [self.server.url('/img/%d.png' % i) for i in range(10)]
+        self.crawl(urls, workers=4)
+
+        # resuming skips the processed urls and continues the numbering
+        urls += [self.server.url('/img/%d.png' % i) for i in range(10, self.images)]
+        crawler = self.crawl(urls, workers=4, resume=True)
+        self.assertEqual(crawler.download_count, self.images)
+        self.assertEqual(self.image_requests(), self.images)
+        self.assertEqual(sorted(int(name.split('_')[0]) for name in os.listdir(self.download_dir)), list(range(1, self.images + 1)))
+        self.assertTrue(self.output.getvalue().endswith(' %s\n' % config.PROGRESS_COMPLETE))
+        self.assertTrue(self.output.getvalue().splitlines()[-1].startswith('%d / %d urls (100.0%%)' % (self.images, self.images)))
+
+        # without resuming everything is downloaded again
+        crawler = self.crawl(urls, workers=4)
+        self.assertEqual(crawler.download_count, self.images)
+        self.assertEqual(self.image_requests(), 2 * self.images)
+
+    def test_content_storage(self):
+        # the same images listed under different hosts are stored once
+        urls = [self.server.url('/img/%d.png' % i) for i in range(5)]
+        urls += [url.replace('127.0.0.1', 'localhost') for url in urls]
+        crawler = self.crawl(urls, workers=4, storage=config.STORAGE_CONTENT)
+        self.assertEqual((crawler.download_count, crawler.duplicates), (10, 5))
+        self.assertEqual(crawler.duplicate_bytes, sum(100 + i for i in range(5)))
+        with open(self.log_file) as log:
+            self.assertIn('5 duplicates (%d bytes)' % crawler.duplicate_bytes, log.readlines()[-1])
+
+    def test_pack_storage(self):
+        # images are packed into segments and found by number and URL, stored images are requested conditionally
+        urls = [self.server.url('/tagged/%d.png' % i) for i in range(5)]
+        images = manifest.Manifest(self.manifest_file)
+        self.crawl(urls, workers=2, storage=config.STORAGE_PACK, manifest=images)
+        crawler = self.crawl(urls, workers=2, storage=config.STORAGE_PACK, manifest=images)
+        images.close()
+        self.assertEqual(crawler.not_modified, 5)
+        with storage.PackReader(self.download_dir) as reader:
+            self.assertEqual(len(reader), 5)
+            self.assertEqual(len(reader.find(urls[2])), 1000)
+            self.assertEqual(reader.get(1), reader.find(self.server.url('/tagged/%s' % reader.names[1].split('_', 1)[1])))
+
+        # a crawl without manifest appends to the pack instead of replacing the images of the same numbers
+        crawler = self.crawl(urls[:2], workers=1, storage=config.STORAGE_PACK)
+        self.assertEqual(crawler.download_count, 7)
+        with storage.PackReader(self.download_dir) as reader:
+            self.assertEqual(len(reader), 7)
+            self.assertEqual(sorted(reader.names)[-2:], [6, 7])
+
+    def test_conditional_recrawl(self):
+        urls = [self.server.url('/tagged/%d.png' % i) for i in range(5)]
+        images = manifest.Manifest(self.manifest_file)
+        crawler = self.crawl(urls, workers=2, manifest=images)
+        self.assertEqual(crawler.download_count, 5)
+        self.assertEqual(len(images), 5)
+
+        # unchanged images are answered with 304 and not written again, changed ones are downloaded
+        self.versions[3] = 1
+        crawler = self.crawl(urls, workers=2, manifest=images)
+        images.close()
+        # the changed image is numbered behind the images of the first crawl and replaces its earlier version
+        self.assertEqual((crawler.download_count, crawler.not_modified, crawler.not_modified_bytes), (6, 4, 4000))
+        self.assertEqual(len(os.listdir(self.download_dir)), 5)
+        self.assertTrue(os.path.exists(os.path.join(self.download_dir, '6_3.png')))
+        self.assertFalse(any(name.endswith('_3.png') and name != '6_3.png' for name in os.listdir(self.download_dir)))
+        conditional = [headers for path, headers in self.server.requests if path.startswith('/tagged/') and 'If-None-Match' in headers]
+        self.assertEqual(len(conditional), 5)
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(sum(config.LOG_NOT_MODIFIED in line and ', url: ' in line for line in lines), 4)
+        self.assertIn('4 not modified (4000 bytes)', lines[-1])
+
+    def test_conditional_recrawl_same_names(self):
+        # a changed image does not overwrite the kept image of another url with the same name
+        versions = {'x': 0, 'y': 0}
+
+        def image(name):
+            def respond(handler):
+                etag = '"%s-%d"' % (name, versions[name])
+                if handler.headers.get('If-None-Match') == etag:
+                    return 304, {'ETag': etag}, b''
+                return 200, {'ETag': etag}, png_image(size=1000 + 10 * versions[name] + (name == 'y'))
+            return respond
+        self.server.routes['/x/img.png'] = (200, 'image/png', image('x'))
+        self.server.routes['/y/img.png'] = (200, 'image/png', image('y'))
+        urls = [self.server.url('/x/img.png'), self.server.url('/y/img.png')]
+        images = manifest.Manifest(self.manifest_file)
+        self.crawl(urls, workers=1, manifest=images)
+        versions['y'] = 1
+        crawler = self.crawl(urls, workers=1, manifest=images)
+        try:
+            self.assertEqual(crawler.not_modified, 1)
+            paths = {url: images.get(url).path for url in urls}
+            self.assertNotEqual(paths[urls[0]], paths[urls[1]])
+            self.assertEqual([os.path.getsize(paths[url]) for url in urls], [1000, 1011])
+            self.assertEqual(sorted(os.listdir(self.download_dir)), ['1_img.png', '3_img.png'])
+        finally:
+            images.close()
+
+    def test_unsolicited_not_modified(self):
+        # a 304 answering a request without validators is a failed download, not a crash
+        self.server.routes['/unchanged.png'] = (200, 'image/png', lambda handler: (304, {}, b''))
+        images = manifest.Manifest(self.manifest_file)
+        crawler = self.crawl([self.server.url('/unchanged.png'), self.server.url('/img/0.png')], workers=1, manifest=images)
+        images.close()
+        self.assertEqual((crawler.download_count, crawler.not_modified), (1, 0))
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(sum(config.LOG_ERROR_DOWNLOADING in line and 'unchanged.png' in line for line in lines), 1)
+
+    def test_repeated_urls(self):
+        urls = [self.server.url('/img/%d.png' % i) for i in range(5)]
+        urls += [url.replace('http:', 'HTTP:') + '#fragment' for url in urls]
+        for mode in (config.DEDUP_BLOOM, config.DEDUP_SORT):
+            crawler = self.crawl(urls, workers=2, dedup=mode)
+            self.assertEqual((crawler.download_count, crawler.duplicate_urls), (5, 5))
+        self.assertEqual(self.image_requests(), 10)
+        with open(self.log_file) as log:
+            self.assertIn('5 repeated urls skipped', log.readlines()[-1])
+
+    def test_crawl_delay(self):
+        # requests to a host asking for 10 requests per second are spaced, other hosts are not held up
+        routes = {'/robots.txt': (200, 'text/plain', b'User-agent: *\nRequest-rate: 10/1\n'),
+                  '/slow.png': (200, 'image/png', png_image())}
+        with LocalServer(routes) as polite:
+            urls = [polite.url('/slow.png')] * 5 + [self.server.url('/img/%d.png' % i) for i in range(self.images)]
+            crawler = self.crawl(urls, workers=4)
+            self.assertEqual(crawler.host_delay(polite.url('/slow.png')), 0.1)
+            self.assertEqual(crawler.host_delay(self.server.url('/img/0.png')), 0.0)
+        self.assertEqual(crawler.download_count, 5 + self.images)
+
+        started = [moment for (path, headers), moment in zip(polite.requests, polite.times) if path == '/slow.png']
+        self.assertEqual(len(started), 5)
+        for previous, following in zip(started, started[1:]):
+            self.assertGreaterEqual(following - previous, 0.09)
+        self.assertLess(self.server.times[-1], started[-1])
+
+    def test_retries(self):
+        # transient server errors are retried, final ones are not
+        failures = {'count': 0}
+
+        def flaky(handler):
+            failures['count'] += 1
+            if failures['count'] <= 2:
+                return 503, {}, b'unavailable'
+            return 200, {}, png_image()
+        self.server.routes['/flaky.png'] = (200, 'image/png', flaky)
+        urls = [self.server.url('/flaky.png'), self.server.url('/missing.png')]
+        crawler = self.crawl(urls, workers=1, retries=2, backoff=retry.Backoff(0.01))
+        self.assertEqual((crawler.download_count, crawler.retried), (1, 2))
+        self.assertEqual([path for path, headers in self.server.requests].count('/missing.png'), 1)
+        with open(self.log_file) as log:
+            self.assertIn('; 2 retries;', log.readlines()[-1])
+
+    def test_robots_retries(self):
+        # an overloaded server is asked for its robots.txt again instead of disallowing its images for the whole crawl
+        failures = {'count': 0}
+
+        def overloaded(handler):
+            failures['count'] += 1
+            if failures['count'] <= 1:
+                return 503, {}, b'unavailable'
+            return 200, {}, b'User-agent: *\n'
+        self.server.routes['/robots.txt'] = (200, 'text/plain', overloaded)
+        crawler = self.crawl([self.server.url('/img/0.png')], workers=1, retries=1, backoff=retry.Backoff(0.01))
+        self.assertEqual((crawler.download_count, crawler.retried), (1, 1))
+        self.assertEqual([path for path, headers in self.server.requests].count('/robots.txt'), 2)
+
+    def test_circuit_breaker(self):
+        # the remaining urls of a failing host are skipped without requests (including the pending retry of the
+        # url opening the circuit), other hosts are not affected
+        self.server.routes['/broken.png'] = (200, 'image/png', lambda handler: (500, {}, b'error'))
+        urls = [self.server.url('/broken.png')] * 6 + [self.server.url('/img/%d.png' % i) for i in range(5)]
+        urls += [url.replace('127.0.0.1', 'localhost') for url in urls[6:]]
+        crawler = self.crawl(urls, workers=1, retries=1, backoff=retry.Backoff(0), breaker=retry.CircuitBreaker(threshold=3))
+        self.assertEqual(crawler.download_count, 5)
+        self.assertEqual([path for path, headers in self.server.requests].count('/broken.png'), 3)
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(sum(config.LOG_HOST_FAILING in line for line in lines), 10)
+        self.assertIn('; 10 urls of failing hosts skipped', lines[-1])
+
+    def test_range_resume(self):
+        # a transfer failing midway is continued by the retry, an image without validator starts over
+        content = png_image(size=64) + bytes(range(256)) * 400
+        self.server.routes['/panorama.png'] = (200, 'image/png', ranged(content, truncated=1))
+        self.server.routes['/untagged.png'] = (200, 'image/png', lambda handler: (200, {'Content-Length': 5000}, png_image(size=4000)))
+        urls = [self.server.url('/panorama.png'), self.server.url('/untagged.png')]
+        crawler = self.crawl(urls, workers=1, retries=1, backoff=retry.Backoff(0), storage=config.STORAGE_CONTENT)
+        self.assertEqual((crawler.download_count, crawler.resumed, crawler.resumed_bytes), (1, 1, len(content) // 2))
+        ranges = [headers.get('Range') for path, headers in self.server.requests if path == '/panorama.png']
+        self.assertEqual(ranges, [None, 'bytes=%d-' % (len(content) // 2)])
+        with open(storage.create(config.STORAGE_CONTENT, self.download_dir).path(hashlib.sha256(content).hexdigest()), 'rb') as image:
+            self.assertEqual(image.read(), content)
+        self.assertEqual([name for name in os.listdir(os.path.join(self.download_dir, config.CONTENT_OBJECTS))
+                          if name.endswith(config.PARTIAL_SUFFIX)], [])
+        with open(self.log_file) as log:
+            self.assertIn('; 1 transfers resumed (%d bytes kept)' % (len(content) // 2), log.readlines()[-1])
+
+    def test_segmented_download(self):
+        # a large image is fetched in parallel ranges and assembled in order
+        content = png_image(size=64) + bytes(range(256)) * 400
+        self.server.routes['/panorama.png'] = (200, 'image/png', ranged(content))
+        crawler = self.crawl([self.server.url('/panorama.png'), self.server.url('/img/1.png')], workers=1, segments=4,
+                             segment_threshold=50000)
+        self.assertEqual((crawler.download_count, crawler.segmented), (2, 1))
+        ranges = sorted(headers['Range'] for path, headers in self.server.requests if 'Range' in headers)
+        self.assertEqual(ranges, ['bytes=25616-51231', 'bytes=51232-76847', 'bytes=76848-102463'])
+        with open(os.path.join(self.download_dir, '1_panorama.png'), 'rb') as image:
+            self.assertEqual(image.read(), content)
+
+    def test_adaptive_concurrency(self):
+        # overload answers of a host halve its concurrency, the images of the other host are downloaded at full speed
+        self.server.routes['/busy.png'] = (200, 'image/png', lambda handler: (429, {}, b'slow down'))
+        urls = [self.server.url('/busy.png')] * 3 + [self.server.url('/img/%d.png' % i).replace('127.0.0.1', 'localhost')
+                                                     for i in range(self.images)]
+        controller = pacing.AimdController(workers=8, host_workers=4)
+        crawler = self.crawl(urls, workers=8, host_workers=4, retries=1, backoff=retry.Backoff(0), controller=controller)
+        self.assertEqual(crawler.download_count, self.images)
+        self.assertEqual(controller.host_limit(urllib.parse.urlparse(self.server.url('/')).netloc), 1)
+        self.assertEqual(controller.host_limit(urllib.parse.urlparse(urls[-1]).netloc), 4)
+        self.assertGreater(controller.limit(), config.AIMD_INITIAL)
+
+    def test_bandwidth(self):
+        # the received bytes are spread over time by the rate
+        urls = [self.server.url('/large.png'), self.server.url('/unsized.png')]
+        bandwidth = pacing.TokenBucket(1000000, burst=100000)
+        crawler = self.crawl(urls, workers=2, bandwidth=bandwidth)
+        self.assertEqual(crawler.download_count, 2)
+        self.assertGreater(bandwidth.waited, 0.4)
+
+    @unittest.skipIf(perceptual.numpy is None or perceptual.Image is None, 'NumPy and Pillow are not installed')
+    def test_near_duplicates(self):
+        # a resized and re-encoded copy of a stored image is not stored, a different image is
+        self.server.routes['/photo.png'] = (200, 'image/png', photo())
+        self.server.routes['/copy.jpg'] = (200, 'image/jpeg', photo(128, 96, image_format='JPEG', quality=60))
+        self.server.routes['/other.png'] = (200, 'image/png', photo(seed=2))
+        urls = [self.server.url(path) for path in ('/photo.png', '/copy.jpg', '/other.png')]
+        crawler = self.crawl(urls, workers=1, near_duplicates=perceptual.NearDuplicates(skip=True, processes=1))
+        crawler.near_duplicates.close()
+        self.assertEqual(crawler.download_count, 2)
+        self.assertEqual(sorted(os.listdir(self.download_dir)), ['1_photo.png', '2_other.png'])
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(sum(config.LOG_NEAR_DUPLICATE % (1, 0) in line for line in lines), 1)
+        self.assertIn('1 near duplicates (%d bytes)' % len(self.server.routes['/copy.jpg'][2]), lines[-1])
+
+        # logged near duplicates are stored, and compared in the background before the summary
+        crawler = self.crawl(urls, workers=1, near_duplicates=perceptual.NearDuplicates(processes=1))
+        crawler.near_duplicates.close()
+        self.assertEqual(crawler.download_count, 3)
+        with open(self.log_file) as log:
+            lines = log.readlines()[len(lines):]
+        self.assertEqual(sum(config.LOG_NEAR_DUPLICATE % (1, 0) in line for line in lines), 1)
+        self.assertIn('1 near duplicates (%d bytes)' % len(self.server.routes['/copy.jpg'][2]), lines[-1])
+
+    def test_shards(self):
+        # shards crawl the hosts assigned to them into the same directory without name clashes
+        urls = [self.server.url('/img/%d.png' % i) for i in range(5)]
+        urls += [other_shard(url, 2) for url in urls]
+        counts = [self.crawl(urls, workers=2, shard=(index, 2)).download_count for index in range(2)]
+        self.assertEqual(sorted(counts), [5, 5])
+        self.assertEqual(sorted(int(name.split('_')[0]) for name in os.listdir(self.download_dir)), list(range(1, 11)))
+
+    def test_metrics(self):
+        # every url is reported with its outcome, downloads with their phase timings
+        urls = [self.server.url('/img/%d.png' % i) for i in range(5)]
+        urls += [self.server.url('/private/secret.png'), self.server.url('/page.html'), self.server.url('/missing.png'), 'foo:bar']
+        recorder = metrics.MetricsRecorder(self.metrics_file)
+        self.crawl(urls, workers=2, metrics=recorder)
+
+        with open(self.metrics_file) as handle:
+            records = [json.loads(line) for line in handle]
+        summary = records.pop()['summary']
+        self.assertEqual(sorted(record['url'] for record in records), sorted(urls))
+        outcomes = {record['url']: record['outcome'] for record in records}
+        self.assertEqual(outcomes[urls[0]], config.OUTCOME_DOWNLOADED)
+        self.assertEqual([outcomes[url] for url in urls[5:]],
+                         [config.OUTCOME_DISALLOWED, config.OUTCOME_NOT_AN_IMAGE, config.OUTCOME_OPEN_ERROR, config.OUTCOME_INVALID])
+        downloaded = [record for record in records if record['outcome'] == config.OUTCOME_DOWNLOADED]
+        self.assertTrue(all(record['seconds']['ttfb'] > 0 and record['seconds']['transfer'] > 0 for record in downloaded))
+        self.assertEqual(sum(record['seconds']['connect'] > 0 for record in records), self.server.connections - 1)
+        self.assertEqual(sum(record['bytes'] for record in downloaded), sum(100 + i for i in range(5)))
+        self.assertEqual(summary['statuses'], {'200': 6, '404': 1})
+        self.assertEqual(summary['outcomes'][config.OUTCOME_DOWNLOADED], 5)
+
+    def test_async_log(self):
+        # the same log lines as with synchronous logging, all written once the crawl returns
+        urls = [self.server.url('/img/%d.png' % i) for i in range(self.images)]
+        urls += [self.server.url('/page.html'), self.server.url('/private/secret.png'), 'foo:bar']
+        crawler = self.crawl(urls, workers=8, async_log=True)
+        self.assertEqual(crawler.download_count, self.images)
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(len(lines), len(urls) + 2)
+        self.assertEqual(sum(config.LOG_DOWNLOADED in line for line in lines), self.images)
+        self.assertIn(config.LOG_DISALLOWED, ''.join(lines))
+        self.assertTrue(lines[-1].split(' ', 2)[2].startswith('summary: '))
+
+    def test_content_check(self):
+        # mislabelled and unfitting images are aborted after their first bytes, counting the bytes not transferred
+        self.server.routes['/fake.png'] = (200, 'image/png', b'<html>' + b' ' * 200000 + b'</html>')
+        self.server.routes['/small.png'] = (200, 'image/png', png_image(8, 8, size=200000))
+        self.server.routes['/wide.png'] = (200, 'image/png', png_image(4000, 100, size=200000))
+        self.server.routes['/tiny.png'] = (200, 'image/png', b'\x89PN')
+        urls = [self.server.url(path) for path in ('/fake.png', '/small.png', '/wide.png', '/tiny.png', '/img/1.png')]
+        crawler = self.crawl(urls, workers=2, min_size=(16, 16), max_size=(2000, 2000))
+        self.assertEqual(crawler.download_count, 1)
+        self.assertEqual(os.listdir(self.download_dir), ['1_1.png'])
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(sum(config.LOG_NOT_AN_IMAGE in line for line in lines), 2)
+        self.assertEqual(sum(config.LOG_DIMENSIONS in line for line in lines), 2)
+        self.assertEqual(crawler.rejected, 4)
+        self.assertGreater(crawler.rejected_saved_bytes, 3 * 200000 - 3 * config.CHUNK_SIZE)
+        self.assertIn('4 transfers aborted by content (%d bytes saved)' % crawler.rejected_saved_bytes, lines[-1])
+
+    def test_unknown_image_format(self):
+        # binary content of an unknown format is stored as its declared image type, text is rejected
+        self.server.routes['/photo.jxl'] = (200, 'image/jxl', b'\xff\x0a' + bytes(range(256)) * 20)
+        self.server.routes['/icon.svg'] = (200, 'image/svg+xml', b'<html><body><svg width="16" height="16"></svg></body></html>')
+        self.server.routes['/error.png'] = (200, 'image/png', b'Image not found.\n' * 10)
+        urls = [self.server.url(path) for path in ('/photo.jxl', '/icon.svg', '/error.png')]
+        crawler = self.crawl(urls, workers=1)
+        self.assertEqual(os.listdir(self.download_dir), ['1_photo.jxl'])
+        self.assertEqual(crawler.rejected, 2)
+
+    def test_library_api(self):
+        # any iterable of urls, results yielded as they complete, images handed to a function
+        urls = [self.server.url('/img/%d.png' % i) for i in range(10)] + [self.server.url('/page.html'), 'foo:bar']
+        contents = {}
+        crawler = imgcrawl.ImgCrawler(4, dedup=config.DEDUP_BLOOM)
+        results = list(crawler.crawl((url for url in urls + urls[:2]), lambda url, name, content: contents.update({url: content})))
+        self.assertEqual(sorted(result.url for result in results), sorted(urls + urls[:2]))
+        outcomes = {result.url: result.outcome for result in results if result.outcome != config.OUTCOME_DUPLICATE_URL}
+        self.assertEqual([outcomes[url] for url in urls[-2:]], [config.OUTCOME_NOT_AN_IMAGE, config.OUTCOME_INVALID])
+        stored = [result for result in results if result.stored]
+        self.assertEqual(sorted(result.number for result in stored), list(range(1, 11)))
+        self.assertEqual({result.url: result.size for result in stored}, {url: len(content) for url, content in contents.items()})
+        self.assertTrue(all(result.name.endswith(os.path.basename(result.url)) and result.status == 200 for result in stored))
+        self.assertEqual(sum(result.outcome == config.OUTCOME_DUPLICATE_URL for result in results), 2)
+        self.assertFalse(os.path.exists(self.download_dir))
+        self.assertFalse(hasattr(results[0], '__dict__'))
+
+        # any storage as sink, stopping the iteration stops the crawl
+        requests = self.image_requests()
+        with storage.create(config.STORAGE_SHARDED, self.download_dir) as store:
+            for result in imgcrawl.ImgCrawler(2).crawl(iter(urls), store, self.log_file):
+                if result.stored:
+                    break
+        self.assertTrue(os.path.exists(result.location))
+        self.assertLessEqual(self.image_requests() - requests, 4)
+
+        # errors are raised instead of exiting
+        with self.assertRaises(ValueError):
+            list(imgcrawl.ImgCrawler(dedup=config.DEDUP_SORT).crawl(urls, lambda url, name, content: None))
+
+    def test_invalid_worker_count(self):
+        with self.assertRaises(ValueError):
+            imgcrawl.ImgCrawler(0)
+        with self.assertRaises(ValueError):
+            imgcrawl.ImgCrawler(4, 0)
+        with self.assertRaises(ValueError):
+            imgcrawl.ImgCrawler(max_bytes=-1)
+        with self.assertRaises(ValueError):
+            imgcrawl.ImgCrawler(retries=-1)
+        with self.assertRaises(ValueError):
+            imgcrawl.ImgCrawler(shard=(2, 2))
+
+    def tearDown(self):
+        sys.stdout = self.old_stdout
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self.download_dir, ignore_errors=True)
+        for path in (self.log_file, self.log_file + config.JOURNAL_SUFFIX, self.url_file, self.manifest_file, self.metrics_file,
+                     self.manifest_file + '-wal', self.manifest_file + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+import journal
+import urlinput
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.path = 'test_crawl.journal'
+        self.url_file = 'test_journal_urls.txt'
+        self.urls = ['http://host/%d.png' % i for i in range(10)]
+        with open(self.url_file, 'w') as handle:
+            handle.write('\n'.join(self.urls) + '\n')
+
+    def offsets(self):
+        with urlinput.UrlSource(self.url_file) as source:
+            return [source.offset for url in source]
+
+    def test_restore_prefix_and_out_of_order_lines(self):
+        offsets = self.offsets()
+        with journal.Journal(self.path, batch=3) as progress:
+            for line in (1, 0, 2, 3, 5, 7):
+                progress.record(line, offsets[line], self.urls[line], line + 1 if line % 2 else None)
+
+        restored = journal.Journal(self.path, resume=True)
+        self.assertEqual((restored.lines, restored.offset, restored.count), (4, offsets[3], 8))
+        self.assertTrue(restored.completed(5, self.urls[5]))
+        self.assertTrue(restored.completed(7, self.urls[7]))
+        self.assertFalse(restored.completed(6, self.urls[6]))
+
+        # a different URL on a processed line is not skipped
+        self.assertFalse(restored.completed(5, self.urls[6]))
+
+        # the prefix grows when continuing the journal
+        restored.record(4, offsets[4], self.urls[4])
+        restored.close()
+        restored = journal.Journal(self.path, resume=True)
+        self.assertEqual((restored.lines, restored.offset), (6, offsets[5]))
+        restored.close()
+
+        # seeking the url file behind the prefix
+        with urlinput.UrlSource(self.url_file) as source:
+            source.seek(restored.offset, restored.lines)
+            self.assertEqual([url.strip() for url in source], self.urls[6:])
+            self.assertEqual(source.lines, len(self.urls))
+
+    def test_records_behind_checkpoint_and_cut_record(self):
+        offsets = self.offsets()
+        progress = journal.Journal(self.path, batch=100)
+        for line in range(3):
+            progress.record(line, offsets[line], self.urls[line], line + 1)
+        progress._handle.write('U\t3\t')
+        progress._handle.flush()
+
+        restored = journal.Journal(self.path, resume=True)
+        self.assertEqual((restored.lines, restored.offset, restored.count), (3, offsets[2], 3))
+        restored.close()
+        progress._handle.close()
+
+    def test_new_journal(self):
+        with journal.Journal(self.path) as progress:
+            progress.record(0, 10, self.urls[0], 1)
+        with journal.Journal(self.path) as progress:
+            self.assertEqual((progress.lines, progress.count), (0, 0))
+        with journal.Journal(self.path, resume=True) as progress:
+            self.assertEqual((progress.lines, progress.count), (0, 0))
+
+    def test_skipped_lines(self):
+        offsets = self.offsets()
+        with journal.Journal(self.path, batch=100) as progress:
+            for line in (0, 2, 3):
+                progress.skip(line, offsets[line])
+            progress.record(4, offsets[4], self.urls[4])
+            # the skipped lines only advance the prefix once the lines before them are processed
+            self.assertEqual(progress.lines, 1)
+            progress.record(1, offsets[1], self.urls[1])
+            self.assertEqual((progress.lines, progress.offset), (5, offsets[4]))
+            progress.skip(6, offsets[6])
+            progress.record(7, offsets[7], self.urls[7])
+
+        restored = journal.Journal(self.path, resume=True)
+        self.assertEqual(restored.lines, 5)
+        self.assertFalse(restored.completed(6, self.urls[6]))
+        self.assertTrue(restored.completed(7, self.urls[7]))
+        restored.close()
+
+    def tearDown(self):
+        for path in (self.path, self.url_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import unittest
+
+import manifest
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.path = 'test_manifest.sqlite'
+
+    def test_entries(self):
+        images = manifest.Manifest(self.path, batch=2)
+        self.assertIsNone(images.get('http://host/a.png'))
+        images.put('http://host/a.png', '"abc"', None, 10, 'dir/1_a.png')
+        images.put('http://host/b.png', None, 'Wed, 21 Oct 2015 07:28:00 GMT', 20, 'dir/2_b.png')
+        images.put('http://host/a.png', '"def"', None, 30, 'dir/3_a.png')
+        images.close()
+
+        # entries are persisted, replaced entries are kept once
+        images = manifest.Manifest(self.path)
+        self.assertEqual(len(images), 2)
+        entry = images.get('http://host/a.png')
+        self.assertEqual((entry.etag, entry.size, entry.path), ('"def"', 30, 'dir/3_a.png'))
+        self.assertEqual(entry.headers(), {'If-None-Match': '"def"'})
+        self.assertEqual(images.get('http://host/b.png').headers(), {'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        images.close()
+
+    def test_highest_number(self):
+        # manifests without image numbers are migrated, their numbers read from the file names
+        connection = sqlite3.connect(self.path)
+        connection.execute('CREATE TABLE images (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, size INTEGER, path TEXT) WITHOUT ROWID')
+        connection.execute("INSERT INTO images VALUES ('http://host/a.png', '\"a\"', NULL, 10, 'dir/7_a.png')")
+        connection.commit()
+        connection.close()
+        images = manifest.Manifest(self.path)
+        self.assertEqual(images.highest_number(), 7)
+        images.put('http://host/b.png', '"b"', None, 10, 'dir/b.png', 12)
+        self.assertEqual(images.highest_number(), 12)
+        images.close()
+        self.assertEqual(manifest.Manifest(':memory:').highest_number(), 0)
+
+    def tearDown(self):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+import unittest
+
+import config
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.path = 'test_metrics.jsonl'
+        self.prometheus = 'test_metrics.prom'
+
+    def test_nested_phases(self):
+        recorder = metrics.MetricsRecorder()
+        timing = metrics.start('http://host/a.png', 'host')
+        with metrics.phase('connect'):
+            time.sleep(0.02)
+            with metrics.phase('dns'):
+                time.sleep(0.02)
+        # the phases nested in an opaque phase are not timed separately
+        with metrics.phase('robots', opaque=True):
+            with metrics.phase('ttfb'):
+                time.sleep(0.02)
+        metrics.outcome(config.OUTCOME_DOWNLOADED, 200, 1000)
+        metrics.stop()
+        recorder.record(timing)
+
+        self.assertIsNone(metrics.current())
+        self.assertTrue(0.015 < timing.phases['connect'] < 0.035)
+        self.assertTrue(0.015 < timing.phases['dns'] < 0.035)
+        self.assertTrue(0.015 < timing.phases['robots'])
+        self.assertEqual(timing.phases['ttfb'], 0.0)
+        self.assertEqual((timing.outcome, timing.status, timing.size), (config.OUTCOME_DOWNLOADED, 200, 1000))
+
+        # without a current timing phases and outcomes are ignored
+        with metrics.phase('dns'):
+            metrics.outcome(config.OUTCOME_INVALID)
+
+    def test_reservoir(self):
+        reservoir = metrics.Reservoir(100)
+        for value in range(1000):
+            reservoir.add(float(value))
+        self.assertEqual((reservoir.count, len(reservoir.values)), (1000, 100))
+        self.assertTrue(300 < reservoir.percentile(0.5) < 700)
+        self.assertEqual(metrics.Reservoir(10).percentile(0.5), 0.0)
+
+    def test_host_limit(self):
+        # the hosts beyond the limit share the latencies of the other hosts
+        recorder = metrics.MetricsRecorder()
+        for i in range(config.METRICS_HOSTS + 5):
+            timing = metrics.Timing('http://host%d/a.png' % i, 'host%d' % i, config.OUTCOME_DOWNLOADED)
+            timing.phases['ttfb'] = 1.0 if i >= config.METRICS_HOSTS else 0.1
+            recorder.record(timing)
+        self.assertEqual(len(recorder.hosts), config.METRICS_HOSTS + 1)
+        summary = recorder.summary()
+        self.assertEqual(list(summary['slowest_hosts'])[0], config.METRICS_OTHER_HOSTS)
+        self.assertEqual(summary['slowest_hosts'][config.METRICS_OTHER_HOSTS]['count'], 5)
+
+    def test_summary_and_reports(self):
+        recorder = metrics.MetricsRecorder(self.path, self.prometheus)
+        for i in range(10):
+            timing = metrics.Timing('http://host%d/%d.png' % (i % 2, i), 'host%d' % (i % 2))
+            timing.phases['ttfb'] = 0.1 * (i % 2 + 1)
+            timing.outcome, timing.status, timing.size = (config.OUTCOME_DOWNLOADED, 200, 1000000) if i < 8 else (config.OUTCOME_OPEN_ERROR, 404, 0)
+            recorder.record(timing)
+        summary = recorder.finish()
+
+        self.assertEqual((summary['urls'], summary['bytes']), (10, 8000000))
+        self.assertEqual(summary['outcomes'], {config.OUTCOME_DOWNLOADED: 8, config.OUTCOME_OPEN_ERROR: 2})
+        self.assertEqual(summary['statuses'], {'200': 8, '404': 2})
+        self.assertEqual(summary['phases']['ttfb']['count'], 10)
+        self.assertAlmostEqual(summary['phases']['ttfb']['p90'], 0.2)
+        self.assertEqual(list(summary['slowest_hosts']), ['host1', 'host0'])
+        self.assertGreater(summary['urls_per_second'], 0)
+
+        with open(self.path) as handle:
+            records = [json.loads(line) for line in handle]
+        self.assertEqual(len(records), 11)
+        self.assertEqual(records[0]['url'], 'http://host0/0.png')
+        self.assertEqual(records[-1]['summary']['urls'], 10)
+
+        with open(self.prometheus) as handle:
+            text = handle.read()
+        self.assertIn('imgcrawl_urls_total{outcome="downloaded"} 8.0\n', text)
+        self.assertIn('imgcrawl_http_responses_total{status="404"} 2.0\n', text)
+        self.assertIn('imgcrawl_phase_seconds{phase="ttfb",quantile="0.9"} 0.2\n', text)
+        self.assertIn('# TYPE imgcrawl_bytes_total counter\n', text)
+
+    def tearDown(self):
+        for path in (self.path, self.prometheus):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+import pacing
+
+
+class TestAimdController(unittest.TestCase):
+    def test_additive_increase(self):
+        controller = pacing.AimdController(workers=8, host_workers=4, initial=2)
+        self.assertEqual(controller.limit(), 2)
+        self.assertEqual(controller.host_limit('a'), 1)
+
+        # about one more request per round of requests, up to the maximums
+        controller.success('a', 0.1)
+        self.assertEqual(controller.host_limit('a'), 2)
+        controller.success('a', 0.1)
+        self.assertEqual(controller.host_limit('a'), 2)
+        for i in range(100):
+            controller.success('a', 0.1)
+        self.assertEqual(controller.host_limit('a'), 4)
+        self.assertEqual(controller.limit(), 8)
+
+    def test_multiplicative_decrease(self):
+        controller = pacing.AimdController(workers=8, host_workers=8)
+        for i in range(100):
+            controller.success('a')
+        self.assertEqual(controller.host_limit('a'), 8)
+
+        controller.congestion('a')
+        self.assertEqual(controller.host_limit('a'), 4)
+        # the other hosts are not slowed down
+        controller.success('b')
+        self.assertEqual(controller.host_limit('b'), 2)
+        for i in range(10):
+            controller.congestion('a')
+        self.assertEqual(controller.host_limit('a'), 1)
+
+    def test_decrease_once_per_round_trip(self):
+        controller = pacing.AimdController(workers=8, host_workers=8)
+        for i in range(100):
+            controller.success('a', 0.2)
+        controller.congestion('a')
+        # answers of requests started before the decrease do not decrease again
+        controller.congestion('a')
+        self.assertEqual(controller.host_limit('a'), 4)
+        time.sleep(0.25)
+        controller.congestion('a')
+        self.assertEqual(controller.host_limit('a'), 2)
+
+    def test_latency(self):
+        controller = pacing.AimdController(workers=8, host_workers=8)
+        for i in range(100):
+            controller.success('a', 0.1)
+        self.assertEqual(controller.host_limit('a'), 8)
+
+        # a growing time to the first byte shows a queue at the host
+        for i in range(10):
+            controller.success('a', 5.0)
+        self.assertEqual(controller.host_limit('a'), 4)
+        self.assertEqual(controller.decreases, 1)
+
+    def test_global_error_rate(self):
+        controller = pacing.AimdController(workers=8, host_workers=1, initial=8)
+        for i in range(40):
+            controller.success('host%d' % i)
+        self.assertEqual(controller.limit(), 8)
+        for i in range(10):
+            controller.congestion('host%d' % i)
+        self.assertEqual(controller.limit(), 8)
+        controller.congestion('other')
+        self.assertEqual(controller.limit(), 4)
+
+    def test_max_hosts(self):
+        controller = pacing.AimdController(workers=8, host_workers=8, max_hosts=2)
+        for host in ('a', 'a', 'b', 'c'):
+            controller.success(host)
+        self.assertEqual(controller.host_limit('a'), 1)
+        self.assertEqual(controller.host_limit('c'), 2)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            pacing.AimdController(workers=0)
+        with self.assertRaises(ValueError):
+            pacing.AimdController(host_workers=0)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst(self):
+        bucket = pacing.TokenBucket(1000, burst=1000)
+        started = time.monotonic()
+        bucket.consume(1000)
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertEqual(bucket.waited, 0.0)
+
+    def test_rate(self):
+        # the workers together receive no more than the rate
+        bucket = pacing.TokenBucket(100000, burst=10000)
+        started = time.monotonic()
+        threads = [threading.Thread(target=lambda: [bucket.consume(5000) for i in range(5)]) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertGreaterEqual(time.monotonic() - started, 0.85)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            pacing.TokenBucket(0)
+        with self.assertRaises(ValueError):
+            pacing.TokenBucket(1000, burst=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
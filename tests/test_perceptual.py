@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import random
+import unittest
+
+import config
+import perceptual
+
+
+def photo(width=256, height=192, seed=1, image_format='PNG', quality=90):
+    # waves and darker squares without flat areas, encoded in the given format
+    generator = random.Random(seed)
+    x, y = perceptual.numpy.meshgrid(perceptual.numpy.linspace(0, 1, width), perceptual.numpy.linspace(0, 1, height))
+    channels = [127 + 64 * perceptual.numpy.sin(generator.uniform(3, 9) * x + generator.uniform(0, 6))
+                + 63 * perceptual.numpy.cos(generator.uniform(3, 9) * y + generator.uniform(0, 6)) for i in range(3)]
+    pixels = perceptual.numpy.dstack(channels)
+    for shape in range(4):
+        left, top, size = generator.uniform(0, 0.8), generator.uniform(0, 0.8), generator.uniform(0.1, 0.3)
+        pixels[(x >= left) & (x < left + size) & (y >= top) & (y < top + size)] //= 2
+    image = perceptual.Image.fromarray(pixels.astype(perceptual.numpy.uint8))
+    content = io.BytesIO()
+    image.save(content, image_format, **({'quality': quality} if image_format == 'JPEG' else {}))
+    return content.getvalue()
+
+
+@unittest.skipIf(perceptual.numpy is None or perceptual.Image is None, 'NumPy and Pillow are not installed')
+class TestPerceptualHash(unittest.TestCase):
+    def setUp(self):
+        self.paths = []
+
+    def tearDown(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def file(self, name, content):
+        path = 'test_perceptual_%s' % name
+        with open(path, 'wb') as handle:
+            handle.write(content)
+        self.paths.append(path)
+        return path
+
+    def test_image_hash(self):
+        original = self.file('original.png', photo())
+        resized = self.file('resized.jpg', photo(128, 96, image_format='JPEG', quality=60))
+        other = self.file('other.png', photo(seed=2))
+        for method in perceptual.HASHES:
+            value = perceptual.image_hash(original, method)
+            self.assertTrue(0 <= value < 2 ** 64)
+            self.assertLessEqual(bin(value ^ perceptual.image_hash(resized, method)).count('1'), 6, method)
+            self.assertGreater(bin(value ^ perceptual.image_hash(other, method)).count('1'), 10, method)
+
+        # content which cannot be decoded has no hash
+        self.assertIsNone(perceptual.image_hash(self.file('page.svg', b'<svg width="10" height="10"></svg>')))
+
+    def test_hash_index(self):
+        index = perceptual.HashIndex(capacity=2)
+        self.assertEqual(index.nearest(0), (None, None))
+        generator = random.Random(1)
+        values = [generator.getrandbits(64) for i in range(1000)]
+        for number, value in enumerate(values, 1):
+            index.add(value, number)
+        self.assertEqual(len(index), 1000)
+        self.assertEqual(index.nearest(values[500] ^ 0b101), (2, 501))
+
+        # a hash is not found until it is labelled with the number of its image
+        slot = index.add(2 ** 64 - 1)
+        self.assertNotEqual(index.nearest(2 ** 64 - 2)[1], 0)
+        index.label(slot, 2000)
+        self.assertEqual(index.nearest(2 ** 64 - 2), (1, 2000))
+
+        path = self.file('index.npz', b'')
+        index.save(path)
+        loaded = perceptual.HashIndex.load(path)
+        self.assertEqual(len(loaded), 1001)
+        self.assertEqual(loaded.nearest(values[7]), (0, 8))
+
+    def test_near_duplicates(self):
+        detector = perceptual.NearDuplicates(threshold=6, skip=True, processes=1)
+        try:
+            self.assertEqual(detector.check(self.file('original.png', photo())), (None, 0))
+            detector.label(0, 1)
+            self.assertEqual(detector.check(self.file('other.png', photo(seed=2))), (None, 1))
+            # a resized copy is a near duplicate of the first image and not indexed
+            match, slot = detector.check(self.file('resized.jpg', photo(128, 96, image_format='JPEG')))
+            self.assertEqual((match[0], slot), (1, None))
+            self.assertEqual(len(detector.index), 2)
+        finally:
+            detector.close()
+
+        # logged near duplicates are hashed in the background and indexed with their number
+        detector = perceptual.NearDuplicates(threshold=6, processes=1)
+        reports = []
+        try:
+            for number, (name, content) in enumerate((('original.png', photo()), ('other.png', photo(seed=2)),
+                                                      ('resized.jpg', photo(128, 96, image_format='JPEG'))), 1):
+                path = self.file(name, content)
+                detector.submit(path, number, lambda *match: reports.append(match))
+                os.remove(path)
+            detector.wait()
+            self.assertEqual([nearest for nearest, distance in reports], [1])
+            self.assertEqual(sorted(detector.index._numbers[:len(detector.index)]), [1, 2, 3])
+            self.assertFalse([name for name in os.listdir('.') if name.endswith(config.HASH_SUFFIX)])
+        finally:
+            detector.close()
+
+        with self.assertRaises(ValueError):
+            perceptual.NearDuplicates(threshold=65)
+        with self.assertRaises(ValueError):
+            perceptual.NearDuplicates(method='md5')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import logging
+import os
+import pstats
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+import config
+import imgcrawl
+import metrics
+import profiling
+from tests.server import LocalServer, png_image
+
+
+def busy(count):
+    return sum(i * i for i in range(count))
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.join(os.curdir, 'test_profiling_dir')
+        os.makedirs(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_stage_counters(self):
+        stages = profiling.StageCounters()
+        with stages.stage('read'):
+            time.sleep(0.01)
+        stages.add('read', 0.03)
+        timing = metrics.Timing('http://example.com/1.png', 'example.com')
+        timing.phases['ttfb'] = 0.25
+        stages.record(timing)
+        snapshot = stages.snapshot()
+        self.assertEqual(set(snapshot), set(profiling.STAGES))
+        self.assertEqual(snapshot['read'][0], 2)
+        self.assertGreater(snapshot['read'][1], 0.04)
+        self.assertEqual(snapshot['read'][2], 0.03)
+        self.assertEqual(snapshot['ttfb'], (1, 0.25, 0.25))
+        self.assertEqual((snapshot['download'][0], snapshot['dns'][0]), (1, 0))
+
+        # the report is written with a single write
+        reading, writing = os.pipe()
+        stages.dump(writing)
+        os.close(writing)
+        with os.fdopen(reading) as pipe:
+            lines = pipe.read().splitlines()
+        self.assertEqual(len(lines), len(profiling.STAGES) + 1)
+        self.assertEqual(lines[profiling.STAGES.index('ttfb') + 1].split(), ['ttfb', '1', '0.250', '250.000', '250.000'])
+
+    def test_stage_counters_threads(self):
+        # each thread counts on its own, the counters of running and finished threads are added up
+        stages = profiling.StageCounters()
+
+        def count(seconds):
+            for i in range(1000):
+                stages.add('collect', seconds)
+        threads = [threading.Thread(target=count, args=(0.001 * (i + 1),)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stages.add('collect', 0.0)
+        snapshot = stages.snapshot()
+        self.assertEqual(snapshot['collect'][0], 8001)
+        self.assertAlmostEqual(snapshot['collect'][1], 36.0)
+        self.assertEqual(snapshot['collect'][2], 0.008)
+
+        # the counters of the finished threads are combined once another thread starts counting
+        thread = threading.Thread(target=count, args=(0.0,))
+        thread.start()
+        thread.join()
+        self.assertEqual(len(stages._threads[1]), 2)
+        self.assertEqual(stages.snapshot()['collect'][0], 9001)
+
+    def test_timed_handler(self):
+        stages = profiling.StageCounters()
+        output = io.StringIO()
+        logger = logging.getLogger('test_profiling')
+        handler = profiling.TimedHandler(logging.StreamHandler(output), stages)
+        logger.addHandler(handler)
+        try:
+            logger.warning('first')
+            logger.warning('second')
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        self.assertEqual(output.getvalue(), 'first\nsecond\n')
+        self.assertEqual(stages.snapshot()['log'][0], 2)
+
+    def test_profiler(self):
+        # the calls of the main thread and of the wrapped functions in other threads are combined
+        path = os.path.join(self.directory, 'crawl.pstats')
+        profiler = profiling.Profiler(path)
+        profiler.start()
+        thread = threading.Thread(target=profiler.wrap(busy), args=(10000,))
+        thread.start()
+        thread.join()
+        busy(10)
+        self.assertIsInstance(profiler.stop(), pstats.Stats)
+        calls = {function[2]: value[1] for function, value in pstats.Stats(path).stats.items()}
+        self.assertEqual(calls['busy'], 2)
+
+    def test_memory_tracer(self):
+        records = []
+        logger = logging.getLogger('test_profiling_memory')
+        logger.setLevel(logging.INFO)
+        handler = logging.Handler()
+        handler.emit = lambda record: records.append(record.getMessage())
+        logger.addHandler(handler)
+        tracer = profiling.MemoryTracer(0.05, logger, top=3)
+        try:
+            tracer.start()
+            retained = [bytearray(1000) for i in range(1000)]
+            time.sleep(0.2)
+            tracer.stop()
+        finally:
+            logger.removeHandler(handler)
+        self.assertGreaterEqual(tracer.snapshots, 2)
+        self.assertEqual(len(records), 4 * tracer.snapshots)
+        self.assertTrue(records[0].startswith('memory: ') and records[0].endswith(' blocks'))
+        self.assertTrue(any(__file__ in record for record in records))
+        self.assertGreater(len(retained), 0)
+
+        with self.assertRaises(ValueError):
+            profiling.MemoryTracer(0, logger)
+
+    def test_crawl(self):
+        # the stages of a crawl are counted, the download threads profiled and the memory snapshots logged
+        routes = {'/robots.txt': (200, 'text/plain', b'User-agent: *\n')}
+        for i in range(10):
+            routes['/img/%d.png' % i] = (200, 'image/png', png_image(size=100 + i))
+        url_file = os.path.join(self.directory, 'urls.txt')
+        log_file = os.path.join(self.directory, 'crawl.log')
+        path = os.path.join(self.directory, 'crawl.pstats')
+        with LocalServer(routes) as server:
+            with open(url_file, 'w') as handle:
+                handle.writelines('%s\n' % server.url('/img/%d.png' % i) for i in range(10))
+            profiler = profiling.Profiler(path)
+            crawler = imgcrawl.ImgCrawler(4, profiler=profiler, trace_memory=60)
+            profiler.start()
+            crawler.download_images(url_file, os.path.join(self.directory, 'images'), log_file)
+            profiler.stop()
+
+        snapshot = crawler.stages.snapshot()
+        self.assertEqual(snapshot['download'][0], 10)
+        self.assertEqual(snapshot['ttfb'][0], 10)
+        self.assertEqual(snapshot['read'][0], 11)
+        self.assertGreaterEqual(snapshot['log'][0], 12)
+        functions = {function[2] for function in pstats.Stats(path).stats}
+        self.assertTrue({'_run', '_download', '_receive'} <= functions)
+        with open(log_file) as log:
+            lines = log.readlines()
+        self.assertIn(config.LOG_MEMORY.split('%')[0], lines[-2 - config.TRACE_MEMORY_TOP])
+        self.assertIn('summary:', lines[-1])
+
+    def test_signal(self):
+        # the stage counters of a running crawl are written to the standard error on SIGUSR1
+        routes = {'/robots.txt': (200, 'text/plain', b'User-agent: *\n'),
+                  '/slow.png': (200, 'image/png', lambda handler: time.sleep(1) or (200, {}, png_image()))}
+        url_file = os.path.join(self.directory, 'urls.txt')
+        with LocalServer(routes) as server:
+            with open(url_file, 'w') as handle:
+                handle.write(server.url('/slow.png') + '\n')
+            process = subprocess.Popen([sys.executable, imgcrawl.__file__, url_file, '-d', os.path.join(self.directory, 'images'),
+                                        '-l', os.path.join(self.directory, 'crawl.log')],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            for i in range(100):
+                if server.requests and server.requests[-1][0] == '/slow.png':
+                    break
+                time.sleep(0.02)
+            process.send_signal(signal.SIGUSR1)
+            errors = process.communicate(timeout=10)[1].decode()
+        self.assertEqual(process.returncode, 0)
+        self.assertIn('stages after', errors)
+        self.assertIn('robots', errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
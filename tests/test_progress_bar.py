@@ -3,6 +3,9 @@
 
 import sys
 import io
+import logging
+import threading
+import time
 import unittest
 
 import progressbar
@@ -42,6 +45,18 @@ class TestProgressBar(unittest.TestCase):
         with self.assertRaises(TypeError):
             bar.set([4])
 
+    def test_resize_bar(self):
+        # growing the maximal value of an estimated total
+        bar = progressbar.ProgressBar(8, 10)
+        bar.set(4)
+        bar.resize(16)
+        bar.set(4)
+        self.assertTrue(self.output.getvalue().endswith('[04 / 16] |==--------| 25.0%'))
+
+        # an empty total is complete right away
+        bar = progressbar.ProgressBar(0, 10)
+        self.assertTrue(self.output.getvalue().endswith('[0 / 0] |==========| 100.0%'))
+
     def test_bar_complete(self):
         # test completing the bar
         bar = progressbar.ProgressBar(5, 8)
@@ -49,6 +64,56 @@ class TestProgressBar(unittest.TestCase):
         bar.complete('done!')
         self.assertTrue(self.output.getvalue().endswith('[5 / 5] |========| 100.0% done!\n'))
         
+    def test_dashboard_counters(self):
+        # counters updated by many threads at once add up, error log entries are counted
+        dashboard = progressbar.Dashboard(100, interval=60)
+
+        def update():
+            for i in range(1000):
+                dashboard.add(10)
+        threads = [threading.Thread(target=update) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        record = lambda level: logging.LogRecord('test', level, __file__, 1, 'message', None, None)
+        self.assertTrue(dashboard.count_errors(record(logging.ERROR)))
+        self.assertTrue(dashboard.count_errors(record(logging.INFO)))
+        dashboard.set(50, active=4)
+        self.assertEqual(dashboard.bytes, 80000)
+        self.assertIn('50 / 100 urls (50.0%)', dashboard.status())
+        self.assertIn('4 active, 1 errors', dashboard.status())
+        dashboard.complete()
+        self.assertTrue(self.output.getvalue().endswith(' 0 active, 1 errors completed\n'))
+        self.assertEqual(self.output.getvalue().count('\n'), 1)
+
+    def test_dashboard_periodic_line(self):
+        # without a terminal a status line is printed once per interval, not per update
+        dashboard = progressbar.Dashboard(1000, start=100, interval=0.05)
+        for i in range(100, 1000):
+            dashboard.set(i)
+        time.sleep(0.2)
+        dashboard.complete('done')
+        lines = self.output.getvalue().splitlines()
+        self.assertTrue(2 <= len(lines) <= 10)
+        self.assertTrue(lines[-1].startswith('1000 / 1000 urls (100.0%)'))
+        self.assertTrue(lines[-1].endswith(' done'))
+
+    def test_dashboard_terminal(self):
+        # on a terminal the bar is redrawn in place
+        class Terminal(io.StringIO):
+            def isatty(self):
+                return True
+        terminal = Terminal()
+        dashboard = progressbar.Dashboard(8, width=10, interval=0.05, stream=terminal)
+        dashboard.set(4)
+        time.sleep(0.2)
+        self.assertIn('\r[4 / 8] |=====-----| 50.0%', terminal.getvalue())
+        dashboard.complete()
+        self.assertNotIn('\n', terminal.getvalue()[:-1])
+        self.assertIn('\r[8 / 8] |==========| 100.0%', terminal.getvalue())
+        self.assertEqual(self.output.getvalue(), '')
+
     def tearDown(self):
         sys.stdout = self.old_stdout
 
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import errno
+import http.client
+import socket
+import ssl
+import time
+import unittest
+import urllib.error
+
+import retry
+
+
+class TestRetry(unittest.TestCase):
+    def test_transient(self):
+        self.assertTrue(retry.transient(urllib.error.HTTPError('http://a/', 503, 'unavailable', {}, None)))
+        self.assertTrue(retry.transient(urllib.error.HTTPError('http://a/', 429, 'too many requests', {}, None)))
+        self.assertFalse(retry.transient(urllib.error.HTTPError('http://a/', 404, 'not found', {}, None)))
+        self.assertTrue(retry.transient(urllib.error.URLError(socket.timeout('timed out'))))
+        self.assertTrue(retry.transient(urllib.error.URLError(ConnectionResetError())))
+        self.assertFalse(retry.transient(urllib.error.URLError(socket.gaierror(-2, 'name unknown'))))
+        self.assertFalse(retry.transient(urllib.error.URLError('unknown url type: ftp')))
+        self.assertFalse(retry.transient(ValueError()))
+
+        # only errors of the connection are retried, not those of the certificate or local files
+        self.assertTrue(retry.transient(urllib.error.URLError(OSError(errno.ENETUNREACH, 'network is unreachable'))))
+        self.assertTrue(retry.transient(urllib.error.URLError(ssl.SSLEOFError())))
+        self.assertTrue(retry.transient(urllib.error.URLError(http.client.RemoteDisconnected())))
+        self.assertTrue(retry.transient(ConnectionRefusedError(errno.ECONNREFUSED, 'refused')))
+        self.assertFalse(retry.transient(urllib.error.URLError(ssl.SSLCertVerificationError(1, 'certificate verify failed'))))
+        self.assertFalse(retry.transient(ssl.SSLCertVerificationError(1, 'certificate verify failed')))
+        self.assertFalse(retry.transient(urllib.error.URLError(ssl.SSLError(1, 'wrong version number'))))
+        self.assertFalse(retry.transient(urllib.error.URLError(PermissionError(errno.EACCES, 'permission denied'))))
+        self.assertFalse(retry.transient(urllib.error.URLError(http.client.LineTooLong('header line'))))
+
+    def test_backoff(self):
+        backoff = retry.Backoff(base=1.0, cap=5.0)
+        for attempt, limit in enumerate((1.0, 2.0, 4.0, 5.0, 5.0)):
+            for i in range(20):
+                self.assertTrue(0 <= backoff.delay(attempt) <= limit)
+        with self.assertRaises(ValueError):
+            retry.Backoff(-1)
+
+    def test_circuit_breaker(self):
+        breaker = retry.CircuitBreaker(threshold=3, cooldown=0.05)
+        for i in range(2):
+            breaker.failure('a')
+        self.assertTrue(breaker.allow('a'))
+
+        # a success resets the consecutive failures
+        breaker.success('a')
+        for i in range(2):
+            breaker.failure('a')
+        self.assertFalse(breaker.is_open('a'))
+        breaker.failure('a')
+        self.assertTrue(breaker.is_open('a'))
+        self.assertFalse(breaker.allow('a'))
+        self.assertTrue(breaker.allow('b'))
+        self.assertEqual((breaker.opened, breaker.rejected), (1, 1))
+
+        # after the cooldown a single trial is let through, its failure opens the circuit again
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow('a'))
+        self.assertFalse(breaker.allow('a'))
+        breaker.failure('a')
+        self.assertFalse(breaker.allow('a'))
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow('a'))
+        breaker.success('a')
+        self.assertTrue(breaker.allow('a'))
+        self.assertTrue(breaker.allow('a'))
+
+    def test_disabled_circuit_breaker(self):
+        breaker = retry.CircuitBreaker(threshold=0)
+        for i in range(100):
+            breaker.failure('a')
+        self.assertTrue(breaker.allow('a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+import time
+import unittest
+
+import config
+import robotscache
+
+
+class TestRobotsCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_file = 'test_robots_cache.json'
+        self.fetches = 0
+
+    def fetch(self, status=200, lines=('User-agent: *', 'Disallow: /private/')):
+        self.fetches += 1
+        return robotscache.RobotsEntry(status, list(lines))
+
+    def test_entry_rules(self):
+        # rules of a retrieved robots.txt
+        parser = robotscache.RobotsEntry(200, ['User-agent: *', 'Disallow: /private/']).parser()
+        self.assertTrue(parser.can_fetch(config.USER_AGENT, 'http://host/image.png'))
+        self.assertFalse(parser.can_fetch(config.USER_AGENT, 'http://host/private/image.png'))
+
+        # missing robots.txt allows everything, restricted access and server errors disallow everything
+        self.assertTrue(robotscache.RobotsEntry(404).parser().can_fetch(config.USER_AGENT, 'http://host/a.png'))
+        self.assertFalse(robotscache.RobotsEntry(403).parser().can_fetch(config.USER_AGENT, 'http://host/a.png'))
+        self.assertFalse(robotscache.RobotsEntry(503).parser().can_fetch(config.USER_AGENT, 'http://host/a.png'))
+
+        # unreachable hosts
+        self.assertFalse(robotscache.RobotsEntry(None).reachable)
+
+    def test_hits_and_misses(self):
+        cache = robotscache.RobotsCache()
+        for i in range(5):
+            cache.lookup('http', 'host', self.fetch)
+        cache.lookup('HTTP', 'Host', self.fetch)
+        cache.lookup('https', 'host', self.fetch)
+
+        self.assertEqual(self.fetches, 2)
+        self.assertEqual((cache.hits, cache.misses), (5, 2))
+
+    def test_expiry(self):
+        cache = robotscache.RobotsCache(ttl=60)
+        cache.put('http', 'host', robotscache.RobotsEntry(200, [], time.time() - 120))
+        self.assertIsNone(cache.get('http', 'host'))
+        cache.lookup('http', 'host', self.fetch)
+        self.assertEqual(self.fetches, 1)
+
+    def test_lru_eviction(self):
+        cache = robotscache.RobotsCache(max_entries=2)
+        cache.lookup('http', 'a', self.fetch)
+        cache.lookup('http', 'b', self.fetch)
+        cache.lookup('http', 'a', self.fetch)
+        cache.lookup('http', 'c', self.fetch)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get('http', 'a'))
+        self.assertIsNone(cache.get('http', 'b'))
+
+        with self.assertRaises(ValueError):
+            robotscache.RobotsCache(max_entries=0)
+
+    def test_single_fetch_for_concurrent_lookups(self):
+        cache = robotscache.RobotsCache()
+        started = threading.Event()
+
+        def slow_fetch():
+            started.set()
+            time.sleep(0.1)
+            return self.fetch()
+
+        threads = [threading.Thread(target=cache.lookup, args=('http', 'host', slow_fetch)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual((cache.hits, cache.misses), (7, 1))
+
+    def test_persistence(self):
+        cache = robotscache.RobotsCache(path=self.cache_file)
+        cache.lookup('http', 'host', self.fetch)
+        cache.lookup('http', 'down', lambda: robotscache.RobotsEntry(None))
+        cache.put('http', 'old', robotscache.RobotsEntry(200, [], time.time() - 2 * config.ROBOTS_CACHE_TTL))
+        cache.save()
+
+        cache.lookup('http', 'missing', lambda: robotscache.RobotsEntry(404))
+        cache.lookup('http', 'overloaded', lambda: robotscache.RobotsEntry(503))
+        cache.save()
+
+        # transient failures are not kept for the next crawl
+        warm = robotscache.RobotsCache(path=self.cache_file)
+        self.assertEqual(len(warm), 2)
+        self.assertFalse(warm.get('http', 'host').parser().can_fetch(config.USER_AGENT, 'http://host/private/a.png'))
+        self.assertEqual(warm.get('http', 'missing').status, 404)
+        self.assertIsNone(warm.get('http', 'down'))
+        self.assertIsNone(warm.get('http', 'overloaded'))
+
+    def test_negative_expiry(self):
+        # timeouts, unreachable hosts and server errors expire after the negative time to live
+        cache = robotscache.RobotsCache(ttl=3600, negative_ttl=30)
+        fetched = time.time() - 60
+        for host, status in (('down', None), ('overloaded', 503), ('failing', 500), ('forbidden', 403), ('missing', 404)):
+            cache.put('http', host, robotscache.RobotsEntry(status, [], fetched))
+        self.assertEqual([host for host in ('down', 'overloaded', 'failing', 'forbidden', 'missing') if cache.get('http', host)],
+                         ['forbidden', 'missing'])
+        self.assertTrue(robotscache.RobotsEntry(429).transient)
+        self.assertFalse(robotscache.RobotsEntry(200).transient)
+
+    def test_corrupt_file(self):
+        # a truncated or malformed cache file is ignored
+        for content in ('{"http://host": [1.0, 200, ["User-agent', '[1, 2]', '{"http://host": 5}'):
+            with open(self.cache_file, 'w') as handle:
+                handle.write(content)
+            cache = robotscache.RobotsCache(path=self.cache_file)
+            self.assertEqual(len(cache), 0)
+            self.assertIsNotNone(cache.load_error)
+            cache.lookup('http', 'host', self.fetch)
+            cache.save()
+            self.assertEqual(len(robotscache.RobotsCache(path=self.cache_file)), 1)
+
+    def tearDown(self):
+        if os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
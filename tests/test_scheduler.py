@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import pacing
+import scheduler
+
+
+class TestHostScheduler(unittest.TestCase):
+    def test_round_robin(self):
+        # hosts are interleaved instead of following the order of adding
+        hosts = scheduler.HostScheduler(host_workers=1)
+        for i in range(3):
+            hosts.add('a', 'a%d' % i)
+        for i in range(3):
+            hosts.add('b', 'b%d' % i)
+        self.assertEqual(len(hosts), 6)
+
+        order = []
+        while len(hosts):
+            host, item = hosts.pop(0.0)
+            order.append(item)
+            hosts.done(host, 0.0)
+        self.assertEqual(order, ['a0', 'b0', 'a1', 'b1', 'a2', 'b2'])
+
+    def test_host_workers(self):
+        hosts = scheduler.HostScheduler(host_workers=2)
+        for i in range(5):
+            hosts.add('a', i)
+
+        # a single request until the delay of the host is known
+        self.assertEqual(hosts.pop(0.0), ('a', 0))
+        self.assertEqual(hosts.pop(0.0), (None, None))
+        hosts.done('a', 0.0)
+        self.assertTrue(hosts.delay_known('a'))
+
+        self.assertEqual(hosts.pop(0.0), ('a', 1))
+        self.assertEqual(hosts.pop(0.0), ('a', 2))
+        self.assertEqual(hosts.pop(0.0), (None, None))
+        hosts.done('a', 0.0)
+        self.assertEqual(hosts.pop(0.0), ('a', 3))
+
+    def test_controller(self):
+        # the adapted limit of the host bounds its concurrent requests below host_workers
+        controller = pacing.AimdController(workers=8, host_workers=8)
+        hosts = scheduler.HostScheduler(host_workers=3, controller=controller)
+        for i in range(10):
+            hosts.add('a', i)
+        self.assertEqual(hosts.pop(0.0), ('a', 0))
+        hosts.done('a', 0.0)
+        self.assertEqual(hosts.pop(0.0), ('a', 1))
+        self.assertEqual(hosts.pop(0.0), (None, None))
+
+        for i in range(20):
+            controller.success('a')
+        hosts.done('a', 0.0)
+        self.assertEqual([hosts.pop(0.0) for i in range(4)], [('a', 2), ('a', 3), ('a', 4), (None, None)])
+
+    def test_delay(self):
+        hosts = scheduler.HostScheduler(host_workers=4, default_delay=1.0)
+        for i in range(3):
+            hosts.add('a', i)
+        hosts.add('b', 'b')
+        self.assertEqual(hosts.pop(10.0), ('a', 0))
+        self.assertEqual(hosts.pop(10.0), ('b', 'b'))
+        hosts.done('a', 1.0)
+
+        # the next request to a waits for the delay
+        self.assertEqual(hosts.pop(10.5), (None, 0.5))
+        self.assertEqual(hosts.pop(11.0), ('a', 1))
+
+        # a longer delay reported on completion (e.g. from robots.txt) postpones the host
+        hosts.done('a', 5.0)
+        self.assertEqual(hosts.pop(12.0), (None, 4.0))
+        self.assertEqual(hosts.pop(16.0), ('a', 2))
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            scheduler.HostScheduler(host_workers=0)
+        with self.assertRaises(ValueError):
+            scheduler.HostScheduler(default_delay=-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
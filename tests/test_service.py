@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import os.path
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+import config
+import imgcrawl
+import service
+from tests.server import LocalServer, png_image
+
+
+class TestCrawlService(unittest.TestCase):
+    def setUp(self):
+        self.directory = os.path.join(os.curdir, 'test_service_dir')
+        self.spool = os.path.join(self.directory, 'spool')
+        self.download_dir = os.path.join(self.directory, 'images')
+        self.log_file = os.path.join(self.directory, 'service.log')
+        self.socket_path = os.path.join(self.directory, 'service.sock')
+        os.makedirs(self.spool)
+        routes = {'/robots.txt': (200, 'text/plain', b'User-agent: *\n'), '/page.html': (200, 'text/html', b'<html></html>')}
+        for i in range(10):
+            routes['/img/%d.png' % i] = (200, 'image/png', png_image(size=100 + i))
+        self.server = LocalServer(routes).__enter__()
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def spool_batch(self, name, urls):
+        # written under a hidden name and moved into the spool once complete
+        hidden = os.path.join(self.spool, '.' + name)
+        with open(hidden, 'w') as handle:
+            handle.writelines('%s\n' % url for url in urls)
+        os.rename(hidden, os.path.join(self.spool, name))
+
+    def wait_for(self, path):
+        for i in range(200):
+            if os.path.exists(path):
+                return
+            time.sleep(0.05)
+        self.fail('%s not written' % path)
+
+    def send(self, urls):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(self.socket_path)
+            client.sendall(''.join('%s\n' % url for url in urls).encode())
+            client.shutdown(socket.SHUT_WR)
+            with client.makefile('rb') as answers:
+                return [json.loads(line) for line in answers]
+
+    def test_batches(self):
+        crawler = imgcrawl.ImgCrawler(4)
+        crawl_service = service.CrawlService(crawler, self.download_dir, self.log_file, self.spool, self.socket_path, poll=0.01)
+        thread = threading.Thread(target=crawl_service.run)
+        self.spool_batch('first', [self.server.url('/img/%d.png' % i) for i in range(5)] + [self.server.url('/page.html')])
+        thread.start()
+        try:
+            batch_dir = os.path.join(self.directory, config.BATCH_DIRECTORY)
+            self.wait_for(os.path.join(batch_dir, config.BATCH_URLS % 'first'))
+            with open(os.path.join(batch_dir, config.BATCH_RESULTS % 'first')) as handle:
+                results = [json.loads(line) for line in handle]
+            self.assertEqual(sorted(result['outcome'] for result in results), [config.OUTCOME_DOWNLOADED] * 5 + [config.OUTCOME_NOT_AN_IMAGE])
+            with open(os.path.join(batch_dir, config.BATCH_LOG % 'first')) as handle:
+                self.assertIn('summary: robots.txt cache 5 hits, 1 misses', handle.readlines()[-1])
+
+            # the robots.txt and connections stay warm for the next batch, the images are numbered on
+            self.wait_for(self.socket_path)
+            connections = self.server.connections
+            results = self.send([self.server.url('/img/%d.png' % i) for i in range(5, 10)])
+            self.assertEqual(sorted(result['number'] for result in results), list(range(6, 11)))
+            self.assertTrue(all(os.path.exists(result['location']) for result in results))
+            self.assertEqual([path for path, headers in self.server.requests].count('/robots.txt'), 1)
+            self.assertLess(self.server.connections - connections, connections)
+        finally:
+            crawl_service.stop()
+            thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertEqual(len(os.listdir(self.download_dir)), 10)
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertIn(config.LOG_SERVICE_STOPPED % 2, lines[-1])
+
+    def test_terminate(self):
+        # SIGTERM stops the service once the accepted batches are crawled
+        process = subprocess.Popen([sys.executable, imgcrawl.__file__, '--spool', self.spool, '-d', self.download_dir, '-l', self.log_file])
+        try:
+            self.spool_batch('first', [self.server.url('/img/1.png')])
+            self.wait_for(os.path.join(self.directory, config.BATCH_DIRECTORY, config.BATCH_URLS % 'first'))
+        finally:
+            process.send_signal(signal.SIGTERM)
+            self.assertEqual(process.wait(10), 0)
+        with open(self.log_file) as log:
+            self.assertIn(config.LOG_SERVICE_STOPPED % 1, log.readlines()[-1])
+
+    def test_failing_batch(self):
+        # a batch failing with an error is recorded and the service goes on
+        crawler = imgcrawl.ImgCrawler(2, dedup=config.DEDUP_SORT)
+        crawl_service = service.CrawlService(crawler, self.download_dir, self.log_file, self.spool, self.socket_path, poll=0.01)
+        thread = threading.Thread(target=crawl_service.run)
+        self.spool_batch('first', [self.server.url('/img/1.png')])
+        thread.start()
+        try:
+            batch_dir = os.path.join(self.directory, config.BATCH_DIRECTORY)
+            self.wait_for(os.path.join(batch_dir, config.BATCH_URLS % 'first'))
+            with open(os.path.join(batch_dir, config.BATCH_ERROR % 'first')) as handle:
+                self.assertIn('ValueError', handle.read())
+            self.assertEqual(os.listdir(os.path.join(self.spool, config.SPOOL_WORK)), [])
+            self.wait_for(self.socket_path)
+            results = self.send([self.server.url('/img/2.png')])
+            self.assertEqual(list(results[-1]), ['error'])
+            self.assertTrue(thread.is_alive())
+        finally:
+            crawl_service.stop()
+            thread.join(10)
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(sum('failed after 0 urls: ValueError' in line for line in lines), 2)
+        self.assertIn(config.LOG_SERVICE_STOPPED % 2, lines[-1])
+
+    def test_arguments(self):
+        with self.assertRaises(ValueError):
+            service.CrawlService(imgcrawl.ImgCrawler(), self.download_dir, self.log_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import io
+import os
+import os.path
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import unittest
+
+import config
+import imgcrawl
+import manifest
+import sharding
+from tests.server import LocalServer, png_image
+
+
+def other_shard(url, count):
+    # the same url with user information placing its host in another shard (the ports of the test servers vary)
+    for i in range(100):
+        other = url.replace('://', '://user%d@' % i, 1)
+        if sharding.shard_of(other, count) != sharding.shard_of(url, count):
+            return other
+
+
+class TestSharding(unittest.TestCase):
+    def setUp(self):
+        self.log_file = 'test_sharding.log'
+        self.url_file = 'test_sharding_urls.txt'
+        self.download_dir = os.path.join(os.curdir, 'test_sharding_dir/')
+        self.manifest_file = 'test_sharding_manifest.sqlite'
+
+    def test_parse_shard(self):
+        self.assertEqual(sharding.parse_shard('2/4'), (2, 4))
+        for value in ('4/4', '-1/4', '1', 'a/b', '1/2/3'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                sharding.parse_shard(value)
+
+    def test_shard_of(self):
+        # all urls of a host belong to the same shard
+        shards = {sharding.shard_of('http://Host%d.com/%d.png' % (i % 10, i), 4) for i in range(10, 20)}
+        self.assertEqual(shards, {sharding.shard_of('http://host%d.com/' % i, 4) for i in range(10)})
+        self.assertEqual(sharding.shard_of('http://host.com/a.png', 4), sharding.shard_of('http://HOST.com/b.png', 4))
+        counts = [0] * 4
+        for i in range(1000):
+            counts[sharding.shard_of('http://host%d.com/' % i, 4)] += 1
+        self.assertTrue(all(count > 150 for count in counts))
+
+    def test_strip_options(self):
+        argv = ['urls.txt', '--shards', '4', '-j', '2', '--processes=2', '--resume']
+        self.assertEqual(sharding.strip_options(argv, ('--shards', '--processes')), ['urls.txt', '-j', '2', '--resume'])
+
+    def test_merge(self):
+        for index, (start, images) in enumerate(((1, 2), (2, 3))):
+            with open(sharding.shard_path(self.log_file, index, 2), 'w') as log:
+                log.write('2026-01-01 00:00:0%d,000 %s\n' % (start, config.LOG_INITIAL_MESSAGE % ('urls.txt', 'images')))
+                for i in range(images):
+                    log.write('2026-01-01 00:00:0%d,%03d %s %d_%d.png, url: http://host%d/\n' % (start, i + 1, config.LOG_DOWNLOADED, i, index, index))
+                counters = dict.fromkeys(imgcrawl.ImgCrawler().statistics(), 1)
+                counters['requests'] = images
+                log.write('2026-01-01 00:00:0%d,500 %s\n' % (start, config.LOG_SUMMARY % counters))
+        sharding.merge(self.log_file, 2)
+
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(len(lines), 2 + 5)
+        self.assertEqual(lines, sorted(lines))
+        self.assertIn(config.LOG_INITIAL_MESSAGE % ('urls.txt', 'images'), lines[0])
+        self.assertTrue(lines[-1].startswith('2026-01-01 00:00:02,500 summary: robots.txt cache 2 hits, 2 misses'))
+        self.assertIn('5 requests over 2 connections', lines[-1])
+        self.assertFalse(os.path.exists(sharding.shard_path(self.log_file, 0, 2)))
+
+    def test_launch(self):
+        routes = {'/robots.txt': (200, 'text/plain', b'User-agent: *\n')}
+        for i in range(8):
+            routes['/img/%d.png' % i] = (200, 'image/png', lambda handler: (200, {'ETag': '"1"'}, png_image()))
+        with LocalServer(routes) as server:
+            urls = [server.url('/img/%d.png' % i) for i in range(8)]
+            urls = urls[:4] + [other_shard(url, 2) for url in urls[4:]]
+            with open(self.url_file, 'w') as handle:
+                handle.writelines('%s\n' % url for url in urls)
+            script = os.path.abspath(imgcrawl.__file__)
+            argv = [self.url_file, '-d', self.download_dir, '-l', self.log_file, '--manifest', self.manifest_file, '--shards', '2']
+            output, sys.stdout = sys.stdout, io.StringIO()
+            try:
+                status = sharding.launch(script, argv, 2, 2, self.log_file, self.manifest_file)
+            finally:
+                sys.stdout = output
+        self.assertEqual(status, 0)
+
+        # the hosts are crawled by different shards with unique image names, the logs and manifests are merged
+        names = os.listdir(self.download_dir)
+        self.assertEqual(len(names), 8)
+        self.assertEqual(sorted(int(name.split('_')[0]) for name in names)[:2], [1, 2])
+        with open(self.log_file) as log:
+            lines = log.readlines()
+        self.assertEqual(len(lines), len(urls) + 2)
+        self.assertEqual(sum(config.LOG_DOWNLOADED in line for line in lines), 8)
+        self.assertIn('robots.txt cache 6 hits, 2 misses', lines[-1])
+        images = manifest.Manifest(self.manifest_file)
+        self.assertEqual(len(images), 8)
+        images.close()
+        self.assertEqual([name for name in os.listdir(os.curdir) if name.startswith(self.log_file + '.') and not name.endswith(config.JOURNAL_SUFFIX)], [])
+
+    def test_claims(self):
+        # claims of running launchers are kept, claims of crashed or silent launchers are taken over
+        path = self.log_file + config.SHARD_CLAIM
+        self.assertTrue(sharding._claim(path))
+        self.assertFalse(sharding._claim(path))
+        with open(path) as marker:
+            self.assertEqual(marker.read().split()[:2], [str(os.getpid()), socket.gethostname()])
+
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        for owner, age, taken in (('%d other-host 0\n' % process.pid, 0, False), ('%d %s 0\n' % (process.pid, socket.gethostname()), 0, True),
+                                  ('%d other-host 0\n' % os.getpid(), 2 * config.SHARD_STALE, True), ('', 2 * config.SHARD_STALE, True),
+                                  ('1 %s 0\n' % socket.gethostname(), 0, False)):
+            with open(path, 'w') as marker:
+                marker.write(owner)
+            os.utime(path, (time.time() - age, time.time() - age))
+            self.assertEqual(sharding._claim(path), taken, owner)
+            os.remove(path)
+        self.assertEqual([name for name in os.listdir(os.curdir) if name.startswith(path)], [])
+
+    def test_launch_after_crash(self):
+        # a launcher started again after a crash takes over the claims of the shards and of the merge
+        routes = {'/robots.txt': (200, 'text/plain', b'User-agent: *\n'),
+                  '/img.png': (200, 'image/png', png_image())}
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        crashed = '%d %s 0\n' % (process.pid, socket.gethostname())
+        with LocalServer(routes) as server:
+            urls = [server.url('/img.png'), other_shard(server.url('/img.png'), 2)]
+            with open(self.url_file, 'w') as handle:
+                handle.writelines('%s\n' % url for url in urls)
+            for index in range(2):
+                with open(self.log_file + config.SHARD_SUFFIX % (index, 2) + config.SHARD_CLAIM, 'w') as marker:
+                    marker.write(crashed)
+            with open(self.log_file + config.SHARD_MERGE, 'w') as marker:
+                marker.write(crashed)
+            argv = [self.url_file, '-d', self.download_dir, '-l', self.log_file, '--shards', '2']
+            output, sys.stdout = sys.stdout, io.StringIO()
+            try:
+                status = sharding.launch(os.path.abspath(imgcrawl.__file__), argv, 2, 2, self.log_file)
+            finally:
+                sys.stdout = output
+        self.assertEqual(status, 0)
+        self.assertEqual(len(os.listdir(self.download_dir)), 2)
+        with open(self.log_file) as log:
+            self.assertEqual(sum(config.LOG_DOWNLOADED in line for line in log), 2)
+        self.assertEqual([name for name in os.listdir(os.curdir) if name.startswith(self.log_file + '.') and not name.endswith(config.JOURNAL_SUFFIX)], [])
+
+    def tearDown(self):
+        shutil.rmtree(self.download_dir, ignore_errors=True)
+        for name in os.listdir(os.curdir):
+            if name.startswith((self.log_file, self.url_file, self.manifest_file)):
+                os.remove(name)
+
+
+if __name__ == '__main__':
+    unittest.main()
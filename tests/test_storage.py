@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import shutil
+import unittest
+
+import config
+import storage
+
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = 'test_storage_dir'
+
+    def receive(self, store, content):
+        descriptor, temporary = store.temporary()
+        with open(descriptor, 'wb') as handle:
+            handle.write(content)
+        return temporary, hashlib.sha256(content).hexdigest() if store.needs_digest else None
+
+    def test_flat_storage(self):
+        with storage.create(config.STORAGE_FLAT, self.directory) as store:
+            temporary, digest = self.receive(store, b'abc')
+            self.assertFalse(store.store(temporary, '1_a.png', 'http://host/a.png', digest, 3))
+        self.assertEqual(os.listdir(self.directory), ['1_a.png'])
+
+        # an image replaced by a changed version is removed, twice does no harm
+        store.remove(store.location('1_a.png'))
+        store.remove(store.location('1_a.png'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_content_storage(self):
+        with storage.create(config.STORAGE_CONTENT, self.directory) as store:
+            duplicates = []
+            for number, content in enumerate((b'abc', b'def', b'abc', b'abc'), 1):
+                temporary, digest = self.receive(store, content)
+                duplicates.append(store.store(temporary, '%d_a.png' % number, 'http://host%d/a.png' % number, digest, 3))
+        self.assertEqual(duplicates, [False, False, True, True])
+
+        # each content is stored once under its sharded hash path
+        digest = hashlib.sha256(b'abc').hexdigest()
+        blobs = [os.path.join(root, name) for root, dirs, names in os.walk(os.path.join(self.directory, config.CONTENT_OBJECTS))
+                 for name in names]
+        self.assertEqual(len(blobs), 2)
+        self.assertIn(os.path.join(self.directory, config.CONTENT_OBJECTS, digest[:2], digest[2:4], digest), blobs)
+
+        # image names are hard links to the contents and listed in the index
+        self.assertEqual(os.stat(os.path.join(self.directory, '4_a.png')).st_ino,
+                         os.stat(os.path.join(self.directory, '1_a.png')).st_ino)
+        with open(os.path.join(self.directory, config.CONTENT_INDEX)) as index:
+            entries = [line.rstrip('\n').split('\t') for line in index]
+        self.assertEqual(entries[2], [digest, '3', '3_a.png', 'http://host3/a.png'])
+
+    def test_sharded_storage(self):
+        with storage.create(config.STORAGE_SHARDED, self.directory) as store:
+            for number in range(1, 51):
+                temporary, digest = self.receive(store, b'abc')
+                self.assertFalse(store.store(temporary, '%d_a.png' % number, 'http://host/a.png', digest, 3, number))
+            path = store.location('7_a.png')
+            self.assertTrue(store.exists(path))
+        self.assertEqual(os.path.relpath(path, self.directory).count(os.sep), 2)
+        files = [name for root, dirs, names in os.walk(self.directory) for name in names]
+        self.assertEqual(sorted(files), sorted('%d_a.png' % number for number in range(1, 51)))
+        self.assertTrue(len(os.listdir(self.directory)) > 1)
+
+    def test_pack_storage(self):
+        contents = {number: ('http://host/%d.png' % number, os.urandom(number * 10)) for number in range(1, 21)}
+        with storage.create(config.STORAGE_PACK, self.directory) as store:
+            store.segment_size = 500
+            for number in (1, 2, 3, 5, 4, 6, 7, 8, 9, 10):
+                temporary, digest = self.receive(store, contents[number][1])
+                store.store(temporary, '%d_a.png' % number, contents[number][0], digest, number * 10, number)
+            self.assertTrue(store.exists(store.location('3_a.png')))
+            self.assertFalse(store.exists(store.location('11_a.png')))
+            temporary, digest = self.receive(store, b'abc')
+            with self.assertRaises(ValueError):
+                store.store(temporary, 'a.png', 'http://host/a.png', digest, 3)
+            os.remove(temporary)
+
+        # a second writer, e.g. another shard, appends its own segments
+        with storage.PackStorage(self.directory, segment_size=500) as store:
+            for number in range(11, 21):
+                temporary, digest = self.receive(store, contents[number][1])
+                store.store(temporary, '%d_a.png' % number, contents[number][0], digest, number * 10, number)
+        segments = [name for name in os.listdir(self.directory) if name.endswith('.pack')]
+        self.assertGreater(len(segments), 2)
+        self.assertTrue(all(os.path.getsize(os.path.join(self.directory, name)) <= 500 + 200 + 50 for name in segments))
+        self.assertFalse([name for name in os.listdir(self.directory) if name.endswith(config.PARTIAL_SUFFIX)])
+
+        # images are read by sequence number and URL without unpacking
+        with storage.PackReader(self.directory) as reader:
+            self.assertEqual(len(reader), 20)
+            for number, (url, content) in contents.items():
+                self.assertEqual(reader.get(number), content)
+                self.assertEqual(reader.find(url), content)
+            self.assertEqual(reader.names[4], '4_a.png')
+            self.assertIsNone(reader.get(21))
+            self.assertIsNone(reader.get(0))
+            self.assertIsNone(reader.find('http://host/none.png'))
+
+    def test_pack_lookup_tables(self):
+        # the lookup tables grow beyond their initial capacity and find the image last stored for an URL
+        count = config.PACK_TABLE_CAPACITY
+        with storage.PackStorage(self.directory) as store:
+            self.assertEqual(store.highest_number(), 0)
+            for number in range(1, count + 1):
+                temporary, digest = self.receive(store, b'%d' % number)
+                store.store(temporary, '%d_a.png' % number, 'http://host/%d.png' % (number % (count - 10)), digest, len(b'%d' % number), number)
+            self.assertEqual(store.highest_number(), count)
+            self.assertTrue(store.exists(store.location('%d_a.png' % count)))
+            self.assertFalse(store.exists(store.location('%d_b.png' % count)))
+            self.assertFalse(store.exists(store.location('a.png')))
+        table = os.path.join(self.directory, config.PACK_TABLE % 0)
+        self.assertEqual(os.path.getsize(table), 4 * count * storage.PACK_SLOT.size)
+
+        # a later crawl appends to the pack, its images are found before the earlier ones of the same URL
+        with storage.PackStorage(self.directory) as store:
+            temporary, digest = self.receive(store, b'new')
+            store.store(temporary, '%d_a.png' % (count + 1), 'http://host/1.png', digest, 3, count + 1)
+        with storage.PackReader(self.directory) as reader:
+            self.assertEqual(reader.find('http://host/1.png'), b'new')
+            self.assertEqual(reader.find('http://host/2.png'), b'%d' % (count - 8))
+            self.assertEqual(reader.get(1), b'1')
+            self.assertIsNone(reader.find('http://host/%d.png' % count))
+            self.assertEqual(len(reader), count + 1)
+
+        # packs written before the lookup tables are read through their URL lists
+        os.remove(table)
+        with storage.PackReader(self.directory) as reader:
+            self.assertEqual(reader.find('http://host/2.png'), b'%d' % (count - 8))
+        with storage.PackStorage(self.directory) as store:
+            self.assertTrue(store.exists(store.location('3_a.png')))
+
+    def test_unknown_storage(self):
+        with self.assertRaises(ValueError):
+            storage.create('cloud', self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+import config
+import urldedup
+
+
+class TestUrlDeduplication(unittest.TestCase):
+    def setUp(self):
+        self.url_file = 'test_dedup_urls.txt'
+        self.urls = ['http://Host.example/a.png',
+                     'http://host.example:80/a.png#top',
+                     'HTTP://HOST.EXAMPLE/a.png',
+                     'http://host.example/A.png',
+                     'https://host.example:443/a.png',
+                     'https://host.example:8443/a.png',
+                     'foo:bar',
+                     'foo:bar',
+                     'https://host.example/a.png?size=1',
+                     'https://host.example/a.png']
+        self.duplicates = [False, True, True, False, False, False, False, False, False, True]
+        with open(self.url_file, 'w') as handle:
+            handle.writelines('%s\n' % url for url in self.urls)
+
+    def test_normalize(self):
+        self.assertEqual(urldedup.normalize('HTTP://User@Host.Example:80/Path/a.PNG?q=A#frag'), 'http://User@host.example/Path/a.PNG?q=A')
+        self.assertEqual(urldedup.normalize('https://host:8443/a.png'), 'https://host:8443/a.png')
+        self.assertEqual(urldedup.normalize('http://[::1]:80/a.png'), 'http://[::1]/a.png')
+        self.assertIsNone(urldedup.normalize('foo:upload.wikimedia.org/a.png'))
+        self.assertIsNone(urldedup.normalize('http://host'))
+
+    def test_bloom_filter(self):
+        bloom = urldedup.BloomFilter(1000, 0.01)
+        keys = ['http://host/%d.png' % i for i in range(1000)]
+        false_positives = sum(bloom.add(key) for key in keys)
+        self.assertLess(false_positives, 30)
+        self.assertTrue(all(bloom.add(key) for key in keys))
+
+        with self.assertRaises(ValueError):
+            urldedup.BloomFilter(0, 0.01)
+        with self.assertRaises(ValueError):
+            urldedup.BloomFilter(10, 1.5)
+
+    def test_deduplicators(self):
+        for mode in (config.DEDUP_BLOOM, config.DEDUP_SORT):
+            with urldedup.create(mode, self.url_file) as deduplicator:
+                self.assertEqual([deduplicator.duplicate(line, url) for line, url in enumerate(self.urls)], self.duplicates)
+        with urldedup.create(config.DEDUP_OFF, self.url_file) as deduplicator:
+            self.assertFalse(any(deduplicator.duplicate(line, url) for line, url in enumerate(self.urls)))
+
+    def test_external_sort_runs(self):
+        # sorting in runs of three entries spilled to temporary files
+        deduplicator = urldedup.SortDeduplicator(self.url_file, chunk=3)
+        self.assertEqual([deduplicator.duplicate(line, url) for line, url in enumerate(self.urls)], self.duplicates)
+        deduplicator.close()
+
+        with self.assertRaises(ValueError):
+            urldedup.SortDeduplicator(config.STDIN)
+        with self.assertRaises(ValueError):
+            urldedup.create('maybe', self.url_file)
+
+    def tearDown(self):
+        os.remove(self.url_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+import unittest
+
+import config
+import urlinput
+
+
+class TestUrlSource(unittest.TestCase):
+    def setUp(self):
+        self.urls = ['http://host/images/%d.jpg' % i for i in range(1000)]
+        self.content = ('\n'.join(self.urls) + '\n').encode('utf-8')
+        self.files = []
+
+    def write(self, name, content):
+        with open(name, 'wb') as handle:
+            handle.write(content)
+        self.files.append(name)
+        return name
+
+    def test_plain_file(self):
+        with urlinput.UrlSource(self.write('test_urls.txt', self.content)) as source:
+            self.assertEqual(source.size, len(self.content))
+            self.assertEqual([url.strip() for url in source], self.urls)
+            self.assertEqual(source.lines, len(self.urls))
+            self.assertEqual(source.estimate(), len(self.urls))
+
+    def test_compressed_files(self):
+        for name, compress in (('test_urls.txt.gz', gzip.compress), ('test_urls.txt.bz2', bz2.compress),
+                               ('test_urls.txt.xz', lzma.compress)):
+            with urlinput.UrlSource(self.write(name, compress(self.content))) as source:
+                self.assertEqual([url.strip() for url in source], self.urls)
+
+    def test_estimate(self):
+        # the estimate is extrapolated while reading and never below the lines read so far
+        with urlinput.UrlSource(self.write('test_urls.txt', self.content * 100)) as source:
+            self.assertGreater(source.estimate(), 0)
+            for i, url in enumerate(source):
+                if i == 50000:
+                    self.assertAlmostEqual(source.estimate(), 100 * len(self.urls), delta=len(self.urls))
+                self.assertGreaterEqual(source.estimate(), source.lines)
+
+    def test_empty_file(self):
+        with urlinput.UrlSource(self.write('test_urls.txt', b'')) as source:
+            self.assertEqual(source.estimate(), 0)
+            self.assertEqual(list(source), [])
+
+    def test_standard_input(self):
+        old_stdin, sys.stdin = sys.stdin, io.TextIOWrapper(io.BytesIO(self.content))
+        try:
+            with urlinput.UrlSource(config.STDIN) as source:
+                self.assertIsNone(source.size)
+                self.assertEqual([url.strip() for url in source], self.urls)
+                self.assertEqual(source.estimate(), len(self.urls))
+        finally:
+            sys.stdin = old_stdin
+
+    def test_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            urlinput.UrlSource('missing_urls.txt')
+
+    def tearDown(self):
+        for name in self.files:
+            if os.path.exists(name):
+                os.remove(name)
+
+
+if __name__ == '__main__':
+    unittest.main()
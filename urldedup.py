@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import heapq
+import math
+import os
+import tempfile
+import urllib.parse
+
+import config
+import urlinput
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize(url):
+    """
+    Normalizes an URL for duplicate detection: lower case scheme and host, no default port, no fragment.
+    Path and query are kept as they are, since servers may treat them case-sensitively.
+
+    :param url: the URL to be normalized
+    :type url: str
+    :return: the normalized URL, None if the URL is invalid
+    :rtype: str
+    """
+    components = urllib.parse.urlparse(url)
+    if not (components.scheme and components.netloc and components.path):
+        return None
+
+    scheme = components.scheme.lower()
+    try:
+        host, port = components.hostname or '', components.port
+    except ValueError:
+        return url
+    if ':' in host:
+        host = '[%s]' % host
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = '%s:%d' % (host, port)
+    userinfo = components.netloc.rpartition('@')[0]
+    netloc = '%s@%s' % (userinfo, host) if userinfo else host
+
+    return urllib.parse.urlunparse((scheme, netloc, components.path, components.params, components.query, ''))
+
+
+class BloomFilter:
+    """
+    Set membership with a fixed memory budget and a configurable rate of false positives, no false negatives.
+    """
+    def __init__(self, capacity, error_rate):
+        """
+        Bloom filter constructor. Sizes the bit array and the number of hash functions for the expected number of keys.
+
+        :param capacity: expected number of keys
+        :type capacity: int
+        :param error_rate: acceptable probability of reporting a new key as contained
+        :type error_rate: float
+        :return:
+        """
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError('capacity must be positive and the error rate between 0 and 1')
+
+        self.bits = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.bits / capacity * math.log(2))), 1)
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def add(self, key):
+        """
+        Adds a key to the filter.
+
+        :param key: the key to be added
+        :type key: str
+        :return: a flag indicating whether the key was (probably) contained before
+        :rtype: bool
+        """
+        digest = hashlib.blake2b(key.encode('utf-8', 'replace'), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        contained = True
+        for i in range(self.hashes):
+            bit = (first + i * second) % self.bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self._array[byte] & mask:
+                contained = False
+                self._array[byte] |= mask
+        return contained
+
+
+class Deduplicator:
+    """
+    Keeps every URL of the list, the base of the deduplicators.
+    """
+    def duplicate(self, line, url):
+        """
+        Checks whether an URL was already listed before. Called for the lines in file order.
+
+        :param line: the zero-based line number of the URL
+        :type line: int
+        :param url: the URL
+        :type url: str
+        :return: a flag indicating whether the URL is to be skipped
+        :rtype: bool
+        """
+        return False
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BloomDeduplicator(Deduplicator):
+    """
+    Detects repeated URLs while streaming through the list, with memory bounded by a Bloom filter.
+    A small fraction of unique URLs (the error rate) may be reported as duplicates.
+    """
+    def __init__(self, capacity=config.DEDUP_CAPACITY, error_rate=config.DEDUP_ERROR_RATE):
+        self.filter = BloomFilter(capacity, error_rate)
+
+    def duplicate(self, line, url):
+        key = normalize(url)
+        return key is not None and self.filter.add(key)
+
+
+class SortDeduplicator(Deduplicator):
+    """
+    Detects repeated URLs exactly with bounded memory by an external sort: a first pass over the list sorts the
+    normalized URLs with their line numbers in runs spilled to temporary files and merges them, keeping the first
+    line of each URL. The line numbers of the repetitions are sorted the same way, so the crawl consumes them in
+    file order. Requires a URL file which can be read twice (not the standard input).
+    """
+    def __init__(self, url_file, chunk=config.DEDUP_SORT_CHUNK):
+        """
+        Sort deduplicator constructor. Reads the URL file and determines the lines of repeated URLs.
+
+        :param url_file: file name or path to the (compressed) file with URLs
+        :type url_file: str
+        :param chunk: optional number of entries sorted in memory at a time, defaults to config.DEDUP_SORT_CHUNK
+        :type chunk: int
+        :return:
+        """
+        if url_file is None or url_file == config.STDIN:
+            raise ValueError('sorting deduplication needs a URL file, not the standard input or an iterable')
+
+        self.chunk = chunk
+        self._directory = tempfile.TemporaryDirectory(prefix='imgcrawl-dedup-')
+        self._runs = 0
+
+        with urlinput.UrlSource(url_file) as urls:
+            entries = ('%s\t%015d' % (key, line) for line, key in enumerate(normalize(url.strip()) for url in urls) if key is not None)
+            repeated = self._repetitions(self._sort(entries))
+            self._duplicates = self._sort('%015d' % line for line in repeated)
+            self._next = next(self._duplicates, None)
+
+    def _spill(self, batch):
+        self._runs += 1
+        path = os.path.join(self._directory.name, 'run%d' % self._runs)
+        with open(path, 'w', encoding='utf-8') as run:
+            run.writelines('%s\n' % entry for entry in sorted(batch))
+        return path
+
+    def _read(self, path):
+        with open(path, 'r', encoding='utf-8') as run:
+            for entry in run:
+                yield entry[:-1]
+        os.remove(path)
+
+    def _sort(self, entries):
+        """
+        Sorts text entries holding no line breaks, spilling sorted runs of chunk entries to temporary files.
+
+        :param entries: the entries to be sorted
+        :type entries: iterable of str
+        :return: the sorted entries
+        :rtype: iterator of str
+        """
+        runs, batch = [], []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) >= self.chunk:
+                runs.append(self._spill(batch))
+                batch = []
+        if batch:
+            runs.append(self._spill(batch))
+        return heapq.merge(*(self._read(path) for path in runs))
+
+    @staticmethod
+    def _repetitions(entries):
+        previous = None
+        for entry in entries:
+            key, line = entry.rsplit('\t', 1)
+            if key == previous:
+                yield int(line)
+            previous = key
+
+    def duplicate(self, line, url):
+        while self._next is not None and int(self._next) < line:
+            self._next = next(self._duplicates, None)
+        return self._next is not None and int(self._next) == line
+
+    def close(self):
+        self._directory.cleanup()
+
+
+DEDUPLICATORS = (config.DEDUP_OFF, config.DEDUP_BLOOM, config.DEDUP_SORT)
+
+
+def create(mode, url_file, capacity=config.DEDUP_CAPACITY, error_rate=config.DEDUP_ERROR_RATE):
+    """
+    Creates a deduplicator of URL lists.
+
+    :param mode: one of DEDUPLICATORS
+    :type mode: str
+    :param url_file: file name or path to the (compressed) file with URLs, None if the URLs are not read from a file
+    :type url_file: str
+    :param capacity: optional expected number of URLs for the Bloom filter, defaults to config.DEDUP_CAPACITY
+    :type capacity: int
+    :param error_rate: optional false positive rate of the Bloom filter, defaults to config.DEDUP_ERROR_RATE
+    :type error_rate: float
+    :return: the deduplicator
+    :rtype: Deduplicator
+    """
+    if mode == config.DEDUP_OFF:
+        return Deduplicator()
+    if mode == config.DEDUP_BLOOM:
+        return BloomDeduplicator(capacity, error_rate)
+    if mode == config.DEDUP_SORT:
+        return SortDeduplicator(url_file)
+    raise ValueError('unknown deduplication: %s' % mode)
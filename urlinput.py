@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bz2
+import gzip
+import lzma
+import os
+import stat
+import sys
+
+import config
+
+
+class UrlSource:
+    """
+    Reads the URL list once, line by line, from a plaintext file, a gzip, bzip2 or xz compressed file,
+    or the standard input ('-'). The number of lines is estimated from the bytes consumed so far,
+    so processing can start immediately and memory stays constant regardless of the list size.
+    """
+    DECOMPRESSORS = {'.gz': lambda raw: gzip.GzipFile(fileobj=raw, mode='rb'),
+                     '.bz2': bz2.BZ2File,
+                     '.xz': lzma.LZMAFile}
+
+    def __init__(self, url_file):
+        """
+        URL source constructor. Opens the file, the compression is recognized by the file extension.
+
+        :param url_file: file name or path to the file with URLs, or '-' for the standard input
+        :type url_file: str
+        :return:
+        """
+        self.url_file = url_file
+        self.lines = 0
+        self.offset = 0
+
+        if url_file == config.STDIN:
+            self._raw = sys.stdin.buffer
+            self._owned = False
+        else:
+            self._raw = open(url_file, 'rb')
+            self._owned = True
+
+        try:
+            status = os.fstat(self._raw.fileno())
+            self.size = status.st_size if stat.S_ISREG(status.st_mode) else None
+        except (AttributeError, OSError, ValueError):
+            self.size = None
+
+        decompressor = self.DECOMPRESSORS.get(os.path.splitext(url_file)[1].lower())
+        self._stream = decompressor(self._raw) if decompressor else self._raw
+
+    def consumed(self):
+        """
+        Returns the number of (compressed) bytes read from the underlying file so far.
+
+        :return: the read position, None if it cannot be determined
+        :rtype: int
+        """
+        try:
+            return self._raw.tell()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def estimate(self):
+        """
+        Estimates the total number of lines by extrapolating the lines read so far to the file size.
+        Without known size (e.g. a pipe) the number of lines read so far is returned.
+
+        :return: the estimated number of lines, at least the number of lines read so far
+        :rtype: int
+        """
+        consumed = self.consumed()
+        if self.size is None or consumed is None:
+            return self.lines
+        if not self.lines or not consumed:
+            return max(self.size // config.ESTIMATED_URL_BYTES, 1) if self.size else 0
+        return max(self.lines, round(self.lines * self.size / consumed))
+
+    def seek(self, offset, lines):
+        """
+        Continues reading behind the given number of lines ending at the given (uncompressed) byte offset.
+        Seekable files are positioned directly, other input skips the lines.
+
+        :param offset: the byte offset behind the last skipped line
+        :type offset: int
+        :param lines: the number of skipped lines
+        :type lines: int
+        :return:
+        """
+        if self._stream.seekable():
+            self._stream.seek(offset)
+        else:
+            skipped = self.lines
+            while skipped < lines and self._stream.readline():
+                skipped += 1
+        self.lines = lines
+        self.offset = offset
+
+    def __iter__(self):
+        for line in self._stream:
+            self.lines += 1
+            self.offset += len(line)
+            yield line.decode('utf-8', 'replace')
+
+    def close(self):
+        if self._stream is not self._raw:
+            self._stream.close()
+        if self._owned:
+            self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()